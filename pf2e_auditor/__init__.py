@@ -0,0 +1,83 @@
+# pf2e_auditor/__init__.py
+"""Core audit engine for the Pathfinder 2e Character Auditor.
+
+The Streamlit app (app.py) is a thin UI on top of this package; the batch
+auditor (``python -m pf2e_auditor.batch``) uses it without a browser.
+
+Importing the package is side-effect free and cheap: submodules are only
+imported when one of their names is first accessed, and the Gemini SDK is only
+imported on the first LLM call (see pf2e_auditor.llm).
+"""
+
+import importlib
+
+# Public name -> submodule that defines it.
+_EXPORTS = {
+    # models
+    "Abilities": "models", "Money": "models", "Weapon": "models", "Armor": "models",
+    "ProcessedFeat": "models", "SpellLevelEntry": "models", "FocusAbilityDetails": "models",
+    "FocusTraditionDetails": "models", "FocusDetails": "models", "SpellCaster": "models",
+    "Build": "models", "CharacterSheet": "models",
+    # checks
+    "check_unspent_gold": "checks", "get_rune_recommendations": "checks",
+    "check_equipment_runes": "checks", "check_missing_feat_slots": "checks", "check_feat_names": "checks",
+    "get_aon_link": "checks", "run_audit_checks": "checks", "run_audit_check_results": "checks",
+    "AUDIT_CHECKS": "checks", "register_check": "checks",
+    # feat_index
+    "FeatIndex": "feat_index",
+    # fingerprint
+    "character_fingerprint": "fingerprint",
+    # sheet_cache
+    "ParsedSheet": "sheet_cache", "load_sheet": "sheet_cache", "parse_sheet_bytes": "sheet_cache",
+    # roster (needs NumPy)
+    "Roster": "roster", "roster_report": "roster", "character_flags": "roster",
+    # prompt_context
+    "PromptContext": "prompt_context", "get_prompt_context": "prompt_context", "estimate_tokens": "prompt_context",
+    "focus_spell_names": "prompt_context",
+    # llm
+    "build_combat_prompt": "llm", "build_qa_prompt": "llm", "split_suggestions": "llm",
+    "get_combat_suggestions": "llm", "get_character_qa_answer": "llm", "answer_character_question": "llm",
+    "CallNotPermitted": "llm",
+    "LLMBackend": "llm", "set_llm_backend": "llm",
+    # analysis
+    "analyze_sheet": "analysis",
+    # diff
+    "diff_builds": "diff", "CharacterVersion": "diff", "character_identity": "diff",
+    # retrieval
+    "BM25Index": "retrieval", "load_rules_corpus": "retrieval", "ground_question": "retrieval",
+    # qa_cache
+    "SimilarQuestionCache": "qa_cache", "normalize_question": "qa_cache",
+    # prefetch
+    "predict_questions": "prefetch", "PrefetchJob": "prefetch",
+    # name_index
+    "NameIndex": "name_index", "get_name_index": "name_index", "write_name_index": "name_index",
+    # router
+    "AUTO_MODEL": "router", "ModelRouter": "router", "CombatSignals": "router", "classify_request": "router", "get_latency_tracker": "router",
+    # library
+    "CharacterLibrary": "library", "get_character_library": "library",
+    # metrics
+    "Trace": "metrics", "prometheus_text": "metrics",
+    # replay
+    "ReplayBackend": "replay", "RecordingBackend": "replay",
+    # clients
+    "ClientPool": "clients", "get_client_pool": "clients",
+    # scheduler
+    "LLMScheduler": "scheduler", "get_scheduler": "scheduler",
+    # qa_session
+    "QASession": "qa_session", "FakeChatBackend": "qa_session",
+}
+
+__all__ = sorted(_EXPORTS)
+
+
+def __getattr__(name):
+    module_name = _EXPORTS.get(name)
+    if module_name is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(f".{module_name}", __name__), name)
+    globals()[name] = value # Cache so __getattr__ is only hit once per name
+    return value
+
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
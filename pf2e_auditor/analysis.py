@@ -0,0 +1,102 @@
+# pf2e_auditor/analysis.py
+# The per-upload pipeline behind the app's "Analyze Character Sheet" button:
+# parse (through the shared sheet cache), run the audits, build the combat
+# prompt and start the background combat-suggestion job. It lives here rather
+# than in app.py so it can be run and benchmarked without Streamlit.
+
+import json
+from typing import Any, Dict, List, Mapping, MutableMapping, Optional
+
+from .sheet_cache import load_sheet
+from .checks import audit_version, flatten_check_results, run_audit_check_results
+from .diff import CharacterVersion, character_identity, diff_builds, reaudit
+from .llm import DEFAULT_MAX_OUTPUT_TOKENS, build_combat_prompt
+from .prompt_context import DEFAULT_PROMPT_TOKEN_BUDGET, estimate_tokens
+from .background import submit_combat_suggestions
+from . import metrics
+
+
+def analyze_sheet(char_file_bytes: bytes, google_api_key: str, llm_model_name: str, stream_llm: bool = False,
+                  prompt_token_budget: int = DEFAULT_PROMPT_TOKEN_BUDGET, max_output_tokens: int = DEFAULT_MAX_OUTPUT_TOKENS,
+                  finished_combat_ideas: Optional[MutableMapping[tuple, List[str]]] = None,
+                  previous_versions: Optional[Mapping[str, CharacterVersion]] = None) -> Dict[str, Any]:
+    """
+    Parses and audits an upload and starts its combat-suggestion job.
+
+    The audits are returned straight away. Unless finished_combat_ideas already holds
+    suggestions for (fingerprint, model, prompt), "combat_ideas" is None and "combat_job"
+    is generating them. Raises json.JSONDecodeError for a file that isn't JSON; other
+    parse failures are returned in "error".
+
+    If previous_versions (identity -> CharacterVersion, see diff.py) holds an earlier version
+    of this character, "diff" holds the changes, only the checks whose inputs changed are
+    re-run, and the previous combat ideas are reused when the combat prompt is unchanged.
+    "version" is this analysis, to store in previous_versions for next time (its
+    combat_ideas are filled in by the caller once the combat job finishes).
+    """
+    try:
+        parsed = load_sheet(char_file_bytes)
+    except json.JSONDecodeError:
+        raise # Reported by the UI as an invalid file
+    except Exception as e:
+        return {"error": f"Failed to parse character sheet: {e}", "suggestions": [], "combat_ideas": []}
+    sheet = parsed.sheet
+
+    # Caches key on the semantic fingerprint rather than the raw bytes, so re-exports of an
+    # unchanged character (whitespace, key order, unrelated fields) still hit.
+    fingerprint = parsed.fingerprint
+
+    identity = character_identity(sheet.build)
+    diff = None
+    previous = previous_versions.get(identity) if previous_versions is not None else None
+    if previous is not None:
+        with metrics.span("diff.build") as attrs:
+            diff = diff_builds(previous.build, sheet.build)
+            attrs["changed_fields"] = len(diff.changed_fields)
+        check_results, checks_rerun = reaudit(sheet, previous.check_results, diff.changed_fields, previous.audit_version)
+    else:
+        check_results = run_audit_check_results(sheet)
+        checks_rerun = list(check_results)
+    all_suggestions = flatten_check_results(check_results)
+
+    combat_ideas = []
+    combat_job = None
+    combat_prompt = ""
+    combat_ideas_reused = False
+    if google_api_key:
+        with metrics.span("prompt.combat") as attrs:
+            combat_prompt = build_combat_prompt(sheet.build, token_budget=prompt_token_budget)
+            attrs["estimated_tokens"] = estimate_tokens(combat_prompt)
+        # Keyed on the prompt too: a different token budget can trim different sections.
+        combat_ideas = (finished_combat_ideas or {}).get((fingerprint, llm_model_name, combat_prompt))
+        if (combat_ideas is None and previous is not None and previous.combat_ideas
+                and previous.llm_model_name == llm_model_name and previous.combat_prompt == combat_prompt):
+            combat_ideas = list(previous.combat_ideas) # The edits don't reach the prompt
+            combat_ideas_reused = True
+        if combat_ideas is None:
+            combat_job = submit_combat_suggestions(sheet, google_api_key, llm_model_name, prompt=combat_prompt, stream=stream_llm,
+                                                   max_output_tokens=max_output_tokens)
+    else:
+        combat_ideas = ["Google AI Studio API key not provided..."]
+
+    version = CharacterVersion(identity=identity, fingerprint=fingerprint, build=sheet.build, check_results=check_results,
+                               audit_version=audit_version(),
+                               llm_model_name=llm_model_name, combat_prompt=combat_prompt,
+                               combat_ideas=combat_ideas if google_api_key else None)
+
+    return {
+        "character_name": sheet.build.name,
+        "character_level": sheet.build.level,
+        "character_class": sheet.build.class_name,
+        "audit_suggestions": all_suggestions,
+        "combat_ideas": combat_ideas,
+        "combat_job": combat_job,
+        "combat_prompt": combat_prompt,
+        "parsed_sheet": parsed, # Raw bytes plus the lazily decoded dict (Raw Data tab)
+        "parsed_sheet_object_direct": sheet,
+        "character_fingerprint": fingerprint, # Cache key for Q&A and combat ideas
+        "version": version,
+        "diff": diff,
+        "checks_rerun": checks_rerun,
+        "combat_ideas_reused": combat_ideas_reused,
+    }
@@ -0,0 +1,118 @@
+# pf2e_auditor/background.py
+# Runs slow LLM work off the request path. The deterministic audits return as
+# soon as the sheet is parsed; the combat-suggestion call runs as a background
+# job that the UI polls (partial blocks included) and can cancel.
+
+import contextvars
+import threading
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import List, Optional
+
+from .models import CharacterSheet
+from .scheduler import BACKGROUND
+from .llm import (
+    DEFAULT_MODEL_NAME, DEFAULT_MAX_OUTPUT_TOKENS, SuggestionStreamParser, build_combat_prompt,
+    get_combat_suggestions, stream_combat_suggestions,
+)
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def get_executor(max_workers: int = 8) -> ThreadPoolExecutor:
+    """Shared thread pool for background LLM jobs (the work is network-bound, so threads are enough)."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="pf2e-llm")
+        return _executor
+
+
+class CombatSuggestionsJob:
+    """
+    A combat-suggestion request running in the background.
+
+    Poll done()/completed_blocks()/pending_text() from the UI, or call result() to wait.
+    cancel() stops the job at the next streamed chunk (or before it starts); a cancelled
+    job's result() is None.
+    """
+
+    def __init__(self, character: CharacterSheet, google_api_key: str, llm_model_name: str = DEFAULT_MODEL_NAME,
+                 prompt: Optional[str] = None, stream: bool = True, max_output_tokens: int = DEFAULT_MAX_OUTPUT_TOKENS,
+                 priority: int = BACKGROUND):
+        self.prompt = prompt if prompt is not None else build_combat_prompt(character.build)
+        self.llm_model_name = llm_model_name
+        self.max_output_tokens = max_output_tokens
+        self.priority = priority
+        self._character = character
+        self._google_api_key = google_api_key
+        self._stream = stream
+        self._cancel_event = threading.Event()
+        self._lock = threading.Lock()
+        self._parser = SuggestionStreamParser()
+        self._completed: List[str] = []
+        self.future: Optional[Future] = None
+
+    def start(self, executor: Optional[ThreadPoolExecutor] = None) -> "CombatSuggestionsJob":
+        # Run in a copy of the caller's context, so the job's spans land in the caller's metrics trace.
+        self.future = (executor or get_executor()).submit(contextvars.copy_context().run, self._run)
+        return self
+
+    def _run(self) -> Optional[List[str]]:
+        if self._cancel_event.is_set():
+            return None
+        if not self._stream:
+            suggestions = get_combat_suggestions(self._character, self._google_api_key, self.llm_model_name, prompt=self.prompt,
+                                                 max_output_tokens=self.max_output_tokens, priority=self.priority)
+            return None if self._cancel_event.is_set() else suggestions
+
+        for chunk in stream_combat_suggestions(self._character, self._google_api_key, self.llm_model_name, prompt=self.prompt,
+                                               max_output_tokens=self.max_output_tokens, priority=self.priority):
+            if self._cancel_event.is_set():
+                return None # Closing the generator here stops reading the HTTP stream
+            with self._lock:
+                self._completed.extend(self._parser.feed(chunk))
+        with self._lock:
+            remaining = self._parser.finish()
+            if self._parser.seen_marker:
+                self._completed.extend(remaining)
+            else:
+                self._completed = remaining # finish() re-split the whole text with the fallback markers
+            return list(self._completed)
+
+    # --- Polling API ---
+
+    def cancel(self):
+        self._cancel_event.set()
+        if self.future is not None:
+            self.future.cancel()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancel_event.is_set()
+
+    def done(self) -> bool:
+        return self.future is not None and self.future.done()
+
+    def completed_blocks(self) -> List[str]:
+        """Suggestion blocks finished so far (streaming mode only)."""
+        with self._lock:
+            return list(self._completed)
+
+    def pending_text(self) -> str:
+        """Text of the block currently being generated (streaming mode only)."""
+        with self._lock:
+            return self._parser.pending
+
+    def result(self, timeout: Optional[float] = None) -> Optional[List[str]]:
+        if self.future is None or self.future.cancelled():
+            return None
+        return self.future.result(timeout=timeout)
+
+
+def submit_combat_suggestions(character: CharacterSheet, google_api_key: str, llm_model_name: str = DEFAULT_MODEL_NAME,
+                              prompt: Optional[str] = None, stream: bool = True,
+                              max_output_tokens: int = DEFAULT_MAX_OUTPUT_TOKENS, priority: int = BACKGROUND) -> CombatSuggestionsJob:
+    """Starts a background combat-suggestion job and returns it immediately."""
+    return CombatSuggestionsJob(character, google_api_key, llm_model_name, prompt=prompt, stream=stream,
+                                max_output_tokens=max_output_tokens, priority=priority).start()
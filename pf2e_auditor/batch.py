@@ -0,0 +1,111 @@
+# pf2e_auditor/batch.py
+# Headless batch auditor: runs the same parse + audit pipeline as the Streamlit
+# app over a directory (or glob) of Pathbuilder exports, fanned out across a
+# process pool, writing one JSON line per character as soon as it finishes.
+#
+# Usage:
+#   python -m pf2e_auditor.batch characters/ "league/**/*.json" -o results.jsonl -j 8
+
+import argparse
+import glob
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import List, Dict, Any, Iterable, Iterator, Optional, TextIO
+
+from .sheet_cache import parse_sheet_bytes
+from .checks import run_audit_checks
+from .fingerprint import character_fingerprint
+
+
+def expand_inputs(inputs: Iterable[str]) -> List[str]:
+    """Expands directories and glob patterns into a sorted, de-duplicated list of JSON files."""
+    paths = []
+    for item in inputs:
+        if os.path.isdir(item):
+            matches = glob.glob(os.path.join(item, "**", "*.json"), recursive=True)
+        else:
+            matches = glob.glob(item, recursive=True)
+        paths.extend(p for p in matches if os.path.isfile(p))
+    return sorted(set(paths))
+
+
+def audit_character_file(path: str) -> Dict[str, Any]:
+    """
+    Parses and audits a single Pathbuilder export.
+    Never raises: parse/IO failures are reported in the "error" field so one bad
+    file does not take down the whole batch.
+    """
+    try:
+        with open(path, "rb") as f:
+            sheet = parse_sheet_bytes(f.read())
+    except json.JSONDecodeError as e:
+        return {"file": path, "error": f"Invalid JSON: {e}"}
+    except Exception as e:
+        return {"file": path, "error": f"Failed to parse character sheet: {e}"}
+
+    return {
+        "file": path,
+        "character_name": sheet.build.name,
+        "character_level": sheet.build.level,
+        "character_class": sheet.build.class_name,
+        "free_archetype_active": sheet.build.free_archetype_active,
+        "character_fingerprint": character_fingerprint(sheet.build),
+        "audit_suggestions": run_audit_checks(sheet),
+    }
+
+
+def iter_batch_audit(paths: Iterable[str], max_workers: Optional[int] = None) -> Iterator[Dict[str, Any]]:
+    """Audits files on a process pool, yielding results in completion order."""
+    paths = list(paths)
+    if not paths:
+        return
+    if max_workers == 1:
+        # Avoids pool start-up cost for tiny runs and keeps tracebacks debuggable.
+        for path in paths:
+            yield audit_character_file(path)
+        return
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(audit_character_file, path) for path in paths]
+        for future in as_completed(futures):
+            yield future.result()
+
+
+def write_jsonl(results: Iterable[Dict[str, Any]], out: TextIO) -> int:
+    """Writes each result as one JSON line, flushing per line so consumers can tail it. Returns the count."""
+    count = 0
+    for result in results:
+        out.write(json.dumps(result, ensure_ascii=False) + "\n")
+        out.flush()
+        count += 1
+    return count
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="python -m pf2e_auditor.batch",
+        description="Audit a directory or glob of Pathbuilder JSON exports and stream JSONL results.",
+    )
+    parser.add_argument("inputs", nargs="+", help="Directories, files, or glob patterns (quote globs to avoid shell expansion).")
+    parser.add_argument("-o", "--output", default="-", help="Output JSONL file (default: stdout).")
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="Worker processes (default: CPU count).")
+    args = parser.parse_args(argv)
+
+    paths = expand_inputs(args.inputs)
+    if not paths:
+        print("No JSON files matched the given inputs.", file=sys.stderr)
+        return 1
+
+    results = iter_batch_audit(paths, max_workers=args.jobs)
+    if args.output == "-":
+        count = write_jsonl(results, sys.stdout)
+    else:
+        with open(args.output, "w", encoding="utf-8") as out:
+            count = write_jsonl(results, out)
+    print(f"Audited {count} character file(s).", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
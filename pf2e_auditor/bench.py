@@ -0,0 +1,314 @@
+# pf2e_auditor/bench.py
+# Offline performance benchmarks: no API key, no network.
+#
+# Times each stage of the pipeline on real and synthetic sheets: parsing, every
+# registered audit check, prompt construction, suggestion splitting, and the
+# app's end-to-end analysis (analysis.analyze_sheet plus the background combat
+# job). Gemini is replaced by a ReplayBackend serving recorded responses with
+# configurable latency, and the persistent response cache is turned off so every
+# run measures the same work. Results are written as JSON and can be compared
+# against an earlier run.
+#
+# Usage:
+#   python -m pf2e_auditor.bench                      # melon.json + synthetic level-20 casters
+#   python -m pf2e_auditor.bench --compare latest     # flag regressions against the previous run
+#   python -m pf2e_auditor.bench --ttft 0.4 --tps 80  # simulate a live model's latency
+
+import argparse
+import datetime
+import glob
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_FIXTURES = [os.path.join(REPO_ROOT, "characters", "melon.json")]
+DEFAULT_RESPONSES_PATH = os.path.join(REPO_ROOT, "benchmarks", "recorded_responses.jsonl")
+DEFAULT_RESULTS_DIR = os.path.join(REPO_ROOT, "benchmarks", "results")
+DEFAULT_REGRESSION_THRESHOLD = 0.20 # Median slower than the baseline by more than this is a regression
+
+BENCH_API_KEY = "offline-benchmark" # Never sent anywhere: the replay backend ignores it
+BENCH_MODEL_NAME = "bench-replay"
+
+TRADITIONS = ("arcane", "divine", "occult", "primal")
+FEAT_CATEGORIES = ("Ancestry Feat", "Class Feat", "General Feat", "Skill Feat", "Archetype Feat")
+
+
+# --- Fixtures ---
+
+def synthetic_sheet(level: int = 20, casters: int = 4, feats: int = 300, spells_per_rank: int = 12, seed: int = 0) -> Dict[str, Any]:
+    """
+    A Pathbuilder-shaped export for a high-level multi-caster with many feats, built from
+    melon.json so every field the models read is present. Deterministic for a given seed.
+    """
+    rng = random.Random(seed)
+    with open(DEFAULT_FIXTURES[0], "r", encoding="utf-8") as f:
+        data = json.load(f)
+    build = data["build"]
+    build.update(name=f"Synthetic L{level} x{casters} ({feats} feats)", level=level,
+                 money={"cp": 37, "sp": 12, "gp": 4200, "pp": 15})
+
+    rows = [["Sylph", None, "Heritage", 1, "Heritage Feat", "standardChoice", None]]
+    for i in range(feats):
+        category = FEAT_CATEGORIES[i % len(FEAT_CATEGORIES)]
+        feat_level = rng.randint(1, level)
+        source = f"Free Archetype {feat_level}" if category == "Archetype Feat" else f"{category.split()[0]} Feat {feat_level}"
+        name = f"Unselected {category}" if rng.random() < 0.02 else f"{category.split()[0]} Technique {i}"
+        rows.append([name, None, category, feat_level, source, "standardChoice", None])
+    build["feats"] = rows
+    build["specials"] = [f"Class Feature {i}" for i in range(40)]
+
+    build["weapons"] = [
+        {"name": f"Weapon {i}", "qty": 1, "prof": "martial", "die": "d8", "pot": rng.choice([None, 1, 2, 3]),
+         "str": rng.choice([None, "striking", "greaterStriking", "majorStriking"]), "mat": None,
+         "display": f"+2 Greater Striking Weapon {i}", "runes": rng.sample(["flaming", "frost", "shock", "holy"], 2),
+         "damageType": "S", "attack": 30, "damageBonus": 6, "extraDamage": ["1d6 fire"]}
+        for i in range(6)
+    ]
+    build["armor"] = [
+        {"name": "Full Plate", "qty": 1, "prof": "heavy", "pot": 2, "res": "greaterResilient", "mat": None,
+         "display": "+2 Greater Resilient Full Plate", "worn": True, "runes": ["fortification"]},
+    ]
+
+    build["spellCasters"] = [
+        {"name": f"Caster {c}", "magicTradition": TRADITIONS[c % len(TRADITIONS)],
+         "spellcastingType": "prepared" if c % 2 else "spontaneous", "ability": "cha", "proficiency": 8,
+         "focusPoints": 0, "innate": c == casters - 1, "perDay": [5] + [4] * 10,
+         "spells": [{"spellLevel": rank, "list": [f"Spell {c}-{rank}-{s}" for s in range(spells_per_rank)]} for rank in range(11)],
+         "prepared": [], "blendedSpells": []}
+        for c in range(casters)
+    ]
+    build["focus"] = {tradition: {"cha": {"abilityBonus": 7, "proficiency": 8, "itemBonus": 0, "focusCantrips": [],
+                                          "focusSpells": [f"{tradition.title()} Focus {i}" for i in range(5)]}}
+                      for tradition in TRADITIONS[:casters]}
+    return data
+
+
+def load_fixtures(paths: List[str], synthetic: int, synthetic_feats: int) -> List[Tuple[str, bytes]]:
+    fixtures = []
+    for path in paths:
+        with open(path, "rb") as f:
+            fixtures.append((os.path.basename(path), f.read()))
+    for seed in range(synthetic):
+        data = synthetic_sheet(feats=synthetic_feats, seed=seed)
+        fixtures.append((f"synthetic-l20-{synthetic_feats}feats-{seed}", json.dumps(data).encode("utf-8")))
+    return fixtures
+
+
+# --- Timing ---
+
+def _summarize(samples_ms: List[float]) -> Dict[str, float]:
+    ordered = sorted(samples_ms)
+    return {
+        "n": len(ordered),
+        "min_ms": ordered[0],
+        "median_ms": statistics.median(ordered),
+        "p95_ms": ordered[min(len(ordered) - 1, int(round(0.95 * (len(ordered) - 1))))],
+        "mean_ms": statistics.fmean(ordered),
+    }
+
+
+def time_call(func: Callable[[], Any], repeat: int, setup: Optional[Callable[[], None]] = None) -> Dict[str, float]:
+    """Runs func repeat times (after one untimed warm-up), calling setup untimed before each run."""
+    if setup:
+        setup()
+    func()
+    samples = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - start) * 1000)
+    return _summarize(samples)
+
+
+# --- Benchmarks ---
+
+def bench_fixture(raw: bytes, repeat: int, combat_response: str) -> Dict[str, Dict[str, float]]:
+    from .sheet_cache import ParsedSheetCache, parse_sheet_bytes
+    from .checks import AUDIT_CHECKS
+    from .llm import SuggestionStreamParser, build_combat_prompt, build_qa_prompt, split_suggestions
+    from .analysis import analyze_sheet
+
+    results: Dict[str, Dict[str, float]] = {}
+    results["parse"] = time_call(lambda: parse_sheet_bytes(raw), repeat)
+    warm_cache = ParsedSheetCache()
+    results["parse_cached"] = time_call(lambda: warm_cache.load(raw), repeat)
+
+    sheet = parse_sheet_bytes(raw)
+    for name, check in AUDIT_CHECKS.items():
+        results[f"check:{name}"] = time_call(lambda: check.func(sheet), repeat)
+
+    def reset_context():
+        sheet.build._prompt_context = None
+    results["prompt:combat"] = time_call(lambda: build_combat_prompt(sheet.build), repeat, setup=reset_context)
+    results["prompt:combat_cached_context"] = time_call(lambda: build_combat_prompt(sheet.build), repeat)
+    results["prompt:qa"] = time_call(lambda: build_qa_prompt(sheet.build, "How does my Reach Spell feat work?"), repeat)
+    results["prompt:qa_ungrounded"] = time_call(
+        lambda: build_qa_prompt(sheet.build, "How does my Reach Spell feat work?", grounded=False), repeat)
+
+    results["split_suggestions"] = time_call(lambda: split_suggestions(combat_response), repeat)
+    chunks = [combat_response[i:i + 64] for i in range(0, len(combat_response), 64)]
+
+    def stream_parse():
+        parser = SuggestionStreamParser()
+        for chunk in chunks:
+            parser.feed(chunk)
+        parser.finish()
+    results["stream_parser"] = time_call(stream_parse, repeat)
+
+    # End to end: every run gets distinct bytes (trailing whitespace), so the sheet
+    # cache can't short-circuit the parse, and an empty finished-ideas store.
+    variants = iter(range(1, 10 ** 9))
+    last: Dict[str, Any] = {}
+
+    def analyze():
+        last.update(analyze_sheet(raw + b" " * next(variants), BENCH_API_KEY, BENCH_MODEL_NAME, stream_llm=False,
+                                  finished_combat_ideas={}))
+    results["end_to_end:audits"] = time_call(analyze, repeat)
+
+    def analyze_and_wait():
+        analyze()
+        last["combat_job"].result()
+    results["end_to_end:combat_ideas"] = time_call(analyze_and_wait, repeat)
+
+    def analyze_and_stream():
+        last.update(analyze_sheet(raw + b" " * next(variants), BENCH_API_KEY, BENCH_MODEL_NAME, stream_llm=True,
+                                  finished_combat_ideas={}))
+        last["combat_job"].result()
+    results["end_to_end:combat_ideas_streamed"] = time_call(analyze_and_stream, repeat)
+    return results
+
+
+def run_benchmarks(fixtures: List[Tuple[str, bytes]], repeat: int, ttft_seconds: float, tokens_per_second: float,
+                   responses_path: Optional[str] = DEFAULT_RESPONSES_PATH) -> Dict[str, Any]:
+    """Runs every benchmark on every fixture with the replay backend installed; restores the real backend after."""
+    from .llm import set_llm_backend
+    from .replay import COMBAT, ReplayBackend, load_recorded_responses
+    from .scheduler import LLMScheduler, set_scheduler
+
+    responses = load_recorded_responses(responses_path) if responses_path and os.path.exists(responses_path) else []
+    backend = ReplayBackend(responses, ttft_seconds=ttft_seconds, tokens_per_second=tokens_per_second)
+    combat_response = next((r["response"] for r in responses if r.get("kind", COMBAT) == COMBAT), backend.default_response)
+
+    previous_cache_disabled = os.environ.get("PF2E_LLM_CACHE_DISABLED")
+    os.environ["PF2E_LLM_CACHE_DISABLED"] = "1" # Every call must reach the backend
+    previous_backend = set_llm_backend(backend)
+    # The real per-minute quotas would throttle hundreds of replayed calls.
+    previous_scheduler = set_scheduler(LLMScheduler(rate_limit=(10 ** 9, 10 ** 12)))
+    try:
+        per_fixture = {name: bench_fixture(raw, repeat, combat_response) for name, raw in fixtures}
+    finally:
+        set_llm_backend(previous_backend)
+        set_scheduler(previous_scheduler)
+        if previous_cache_disabled is None:
+            del os.environ["PF2E_LLM_CACHE_DISABLED"]
+        else:
+            os.environ["PF2E_LLM_CACHE_DISABLED"] = previous_cache_disabled
+
+    return {
+        "created": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "settings": {"repeat": repeat, "ttft_seconds": ttft_seconds, "tokens_per_second": tokens_per_second,
+                     "recorded_responses": len(responses)},
+        "fixtures": {name: len(raw) for name, raw in fixtures},
+        "results": per_fixture,
+    }
+
+
+# --- Results ---
+
+def save_results(report: Dict[str, Any], results_dir: str = DEFAULT_RESULTS_DIR) -> str:
+    os.makedirs(results_dir, exist_ok=True)
+    path = os.path.join(results_dir, datetime.datetime.now().strftime("%Y%m%d-%H%M%S") + ".json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    return path
+
+
+def latest_results(results_dir: str = DEFAULT_RESULTS_DIR, exclude: Optional[str] = None) -> Optional[str]:
+    paths = sorted(p for p in glob.glob(os.path.join(results_dir, "*.json")) if p != exclude)
+    return paths[-1] if paths else None
+
+
+def compare_results(baseline: Dict[str, Any], current: Dict[str, Any],
+                    threshold: float = DEFAULT_REGRESSION_THRESHOLD) -> List[Dict[str, Any]]:
+    """Per (fixture, benchmark) present in both runs: baseline/current medians, ratio and a regression flag."""
+    rows = []
+    for fixture, benches in current["results"].items():
+        for name, stats in benches.items():
+            before = baseline.get("results", {}).get(fixture, {}).get(name)
+            if before is None:
+                continue
+            ratio = stats["median_ms"] / before["median_ms"] if before["median_ms"] > 0 else float("inf")
+            rows.append({"fixture": fixture, "benchmark": name, "baseline_ms": before["median_ms"],
+                         "current_ms": stats["median_ms"], "ratio": ratio, "regression": ratio > 1 + threshold})
+    return rows
+
+
+def format_report(report: Dict[str, Any]) -> str:
+    lines = []
+    for fixture, benches in report["results"].items():
+        lines.append(f"{fixture} ({report['fixtures'][fixture]} bytes)")
+        for name, stats in benches.items():
+            lines.append(f"  {name:<34} median {stats['median_ms']:9.3f} ms   p95 {stats['p95_ms']:9.3f} ms   min {stats['min_ms']:9.3f} ms")
+    return "\n".join(lines)
+
+
+def format_comparison(rows: List[Dict[str, Any]]) -> str:
+    lines = []
+    for row in rows:
+        flag = "  REGRESSION" if row["regression"] else ""
+        lines.append(f"{row['fixture']:<32} {row['benchmark']:<34} {row['baseline_ms']:9.3f} -> {row['current_ms']:9.3f} ms  x{row['ratio']:.2f}{flag}")
+    return "\n".join(lines)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m pf2e_auditor.bench",
+                                     description="Offline benchmarks of parsing, audits, prompts and the end-to-end analysis.")
+    parser.add_argument("fixtures", nargs="*", default=DEFAULT_FIXTURES, help="Pathbuilder JSON exports (default: characters/melon.json).")
+    parser.add_argument("--synthetic", type=int, default=2, help="Synthetic level-20 multi-caster sheets to add (default: 2).")
+    parser.add_argument("--synthetic-feats", type=int, default=300, help="Feats per synthetic sheet (default: 300).")
+    parser.add_argument("-n", "--repeat", type=int, default=30, help="Timed runs per benchmark (default: 30).")
+    parser.add_argument("--ttft", type=float, default=0.0, help="Replayed time to first token, in seconds (default: 0).")
+    parser.add_argument("--tps", type=float, default=0.0, help="Replayed output tokens per second; 0 = instant (default: 0).")
+    parser.add_argument("--responses", default=DEFAULT_RESPONSES_PATH, help="Recorded responses JSONL for the replay backend.")
+    parser.add_argument("--results-dir", default=DEFAULT_RESULTS_DIR, help="Where result files are written.")
+    parser.add_argument("--no-save", action="store_true", help="Don't write a results file.")
+    parser.add_argument("--compare", metavar="RESULTS", help="Results file to compare against, or 'latest' for the previous run.")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_REGRESSION_THRESHOLD,
+                        help="Median slowdown counted as a regression (default: 0.20 = 20%%).")
+    args = parser.parse_args(argv)
+
+    report = run_benchmarks(load_fixtures(args.fixtures, args.synthetic, args.synthetic_feats), args.repeat,
+                            args.ttft, args.tps, args.responses)
+    print(format_report(report))
+
+    saved = None
+    if not args.no_save:
+        saved = save_results(report, args.results_dir)
+        print(f"\nResults written to {saved}", file=sys.stderr)
+
+    if args.compare:
+        baseline_path = latest_results(args.results_dir, exclude=saved) if args.compare == "latest" else args.compare
+        if baseline_path is None:
+            print("No earlier results to compare against.", file=sys.stderr)
+            return 0
+        with open(baseline_path, "r", encoding="utf-8") as f:
+            rows = compare_results(json.load(f), report, args.threshold)
+        print(f"\nCompared with {baseline_path}:")
+        print(format_comparison(rows))
+        if any(row["regression"] for row in rows):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,234 @@
+# pf2e_auditor/cache.py
+# Persistent, cross-process cache for LLM responses, backed by SQLite.
+#
+# Entries are keyed on the model name plus a SHA-256 of the final prompt (the
+# API key is never part of the key or stored). Every replica pointed at the same
+# file shares the cache. SQLite's WAL mode and a busy timeout make concurrent
+# readers/writers from several processes safe. Old entries are evicted by age,
+# and least-recently-used entries are evicted when the entry or size budget is
+# exceeded. Hit/miss counters are stored in the database so they are global.
+#
+# Lookups are plain SELECTs, so readers never take SQLite's write lock. Hits,
+# misses and access times are queued in memory and written behind by a single
+# writer thread per cache (batched, like the latency samples in
+# pf2e_auditor.router); set() and stats() write whatever is still queued first.
+#
+# Configuration (environment variables):
+#   PF2E_LLM_CACHE_PATH      database file (default: ~/.cache/pf2e_auditor/llm_cache.sqlite3)
+#   PF2E_LLM_CACHE_DISABLED  set to "1" to turn the cache off
+
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_PATH = os.path.join(os.path.expanduser("~"), ".cache", "pf2e_auditor", "llm_cache.sqlite3")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    model TEXT NOT NULL,
+    response TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    last_access REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS responses_last_access ON responses(last_access);
+CREATE INDEX IF NOT EXISTS responses_created_at ON responses(created_at);
+CREATE TABLE IF NOT EXISTS counters (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+"""
+
+
+def make_cache_key(llm_model_name: str, prompt: str) -> str:
+    """Cache key for a model + final prompt. Never include credentials here."""
+    prompt_hash = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+    return f"{llm_model_name}:{prompt_hash}"
+
+
+class LLMResponseCache:
+    """SQLite-backed LLM response cache with age and LRU size eviction."""
+
+    def __init__(self, path: str = DEFAULT_CACHE_PATH, max_entries: int = 10000,
+                 max_bytes: int = 100 * 1024 * 1024, max_age_seconds: float = 30 * 24 * 3600):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_seconds
+        self._local = threading.local() # One connection per thread; sqlite3 connections aren't thread-safe
+        self._lock = threading.Lock()
+        self._accessed: Dict[str, float] = {} # key -> latest hit time, not yet written
+        self._counts: Dict[str, int] = {}     # counter -> increments not yet written
+        self._write_scheduled = False
+        self._writer: Optional[ThreadPoolExecutor] = None
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._connect().executescript(_SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # isolation_level=None: autocommit, with explicit BEGIN IMMEDIATE for multi-statement writes
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _bump(self, conn: sqlite3.Connection, counter: str, by: int = 1):
+        conn.execute(
+            "INSERT INTO counters(name, value) VALUES (?, ?) ON CONFLICT(name) DO UPDATE SET value = value + excluded.value",
+            (counter, by),
+        )
+
+    def get(self, llm_model_name: str, prompt: str) -> Optional[str]:
+        """Returns the cached response, or None on a miss (expired entries count as misses; set() evicts them)."""
+        key = make_cache_key(llm_model_name, prompt)
+        now = time.time()
+        row = self._connect().execute("SELECT response, created_at FROM responses WHERE key = ?", (key,)).fetchone()
+        if row is not None and now - row[1] > self.max_age_seconds:
+            row = None
+        with self._lock:
+            counter = "misses" if row is None else "hits"
+            self._counts[counter] = self._counts.get(counter, 0) + 1
+            if row is not None:
+                self._accessed[key] = now
+            if self._write_scheduled: # The queued write will pick this lookup up
+                return None if row is None else row[0]
+            self._write_scheduled = True
+            if self._writer is None:
+                self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="pf2e-llm-cache")
+            writer = self._writer
+        writer.submit(self._write_pending)
+        return None if row is None else row[0]
+
+    def _take_pending(self):
+        with self._lock:
+            accessed, counts = self._accessed, self._counts
+            self._accessed, self._counts, self._write_scheduled = {}, {}, False
+        return accessed, counts
+
+    def _apply_pending(self, conn: sqlite3.Connection, accessed: Dict[str, float], counts: Dict[str, int]):
+        """Writes queued access times and counters (inside the caller's transaction)."""
+        conn.executemany("UPDATE responses SET last_access = MAX(last_access, ?) WHERE key = ?",
+                         [(at, key) for key, at in accessed.items()])
+        for counter, by in counts.items():
+            self._bump(conn, counter, by)
+
+    def _write_pending(self):
+        accessed, counts = self._take_pending()
+        if not accessed and not counts:
+            return
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._apply_pending(conn, accessed, counts)
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        except sqlite3.Error as e:
+            logger.warning("Could not record LLM response cache usage: %s", e)
+
+    def _wait_for_writer(self):
+        with self._lock:
+            writer = self._writer
+        if writer is not None:
+            writer.submit(lambda: None).result() # The single writer runs queued writes in order
+
+    def flush(self):
+        """Writes every queued access time and counter now (e.g. before exit or in tests)."""
+        self._wait_for_writer()
+        self._write_pending()
+
+    def set(self, llm_model_name: str, prompt: str, response: str):
+        key = make_cache_key(llm_model_name, prompt)
+        now = time.time()
+        self._wait_for_writer() # Then write what is queued with this entry, so eviction sees every hit
+        accessed, counts = self._take_pending()
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            self._apply_pending(conn, accessed, counts)
+            conn.execute(
+                "INSERT OR REPLACE INTO responses(key, model, response, size, created_at, last_access) VALUES (?, ?, ?, ?, ?, ?)",
+                (key, llm_model_name, response, len(response.encode("utf-8")), now, now),
+            )
+            self._evict(conn, now)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _evict(self, conn: sqlite3.Connection, now: float):
+        conn.execute("DELETE FROM responses WHERE created_at < ?", (now - self.max_age_seconds,))
+        count, total_bytes = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+        if count <= self.max_entries and total_bytes <= self.max_bytes:
+            return
+        # Walk from least recently used, dropping rows until both budgets are met.
+        doomed = []
+        for key, size in conn.execute("SELECT key, size FROM responses ORDER BY last_access ASC"):
+            if count <= self.max_entries and total_bytes <= self.max_bytes:
+                break
+            doomed.append((key,))
+            count -= 1
+            total_bytes -= size
+        conn.executemany("DELETE FROM responses WHERE key = ?", doomed)
+        for _ in doomed:
+            self._bump(conn, "evictions")
+
+    def stats(self) -> Dict[str, int]:
+        self.flush()
+        conn = self._connect()
+        counters = dict(conn.execute("SELECT name, value FROM counters").fetchall())
+        count, total_bytes = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+        return {
+            "hits": counters.get("hits", 0),
+            "misses": counters.get("misses", 0),
+            "evictions": counters.get("evictions", 0),
+            "entries": count,
+            "bytes": total_bytes,
+        }
+
+    def clear(self):
+        self._take_pending()
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute("DELETE FROM responses")
+        conn.execute("DELETE FROM counters")
+        conn.execute("COMMIT")
+
+
+_default_cache: Optional[LLMResponseCache] = None
+_default_cache_lock = threading.Lock()
+
+
+def get_response_cache() -> Optional[LLMResponseCache]:
+    """The process-wide LLM response cache, created on first use. None when disabled."""
+    global _default_cache
+    if os.environ.get("PF2E_LLM_CACHE_DISABLED") == "1":
+        return None
+    with _default_cache_lock:
+        if _default_cache is None:
+            try:
+                _default_cache = LLMResponseCache(os.environ.get("PF2E_LLM_CACHE_PATH", DEFAULT_CACHE_PATH))
+            except (OSError, sqlite3.Error) as e:
+                logger.warning("LLM response cache unavailable, continuing without it: %s", e)
+                return None
+        return _default_cache
+
+
+def set_response_cache(cache: Optional[LLMResponseCache]):
+    """Replaces the process-wide cache (e.g. with a temporary one in tests/benchmarks)."""
+    global _default_cache
+    with _default_cache_lock:
+        _default_cache = cache
@@ -0,0 +1,290 @@
+# pf2e_auditor/checks.py
+# Rule-based audit checks. These only need the Pydantic models, so they can be
+# imported from batch workers and tests without pulling in Streamlit or Gemini.
+#
+# Checks register themselves with @register_check and read their thresholds from
+# the precomputed tables in rules.py. run_audit_checks runs every registered
+# check in registration order. To add a rule, write a function taking a
+# CharacterSheet and returning a list of suggestion strings, and register it.
+#
+# Stored check results (see diff.reaudit and the character library) carry the
+# audit_version() that produced them, and are only reused while it is unchanged.
+
+import hashlib
+from dataclasses import dataclass
+from typing import Callable, List, Dict, Optional, Any, Iterable, Mapping, Sequence, Tuple
+from urllib.parse import quote_plus # For AoN link generation
+
+from .models import CharacterSheet
+from .name_index import FEAT, get_name_index
+from . import metrics, rules
+from .rules import (
+    RUNES_BY_LEVEL, STRIKING_RANKS, RESILIENCY_RANKS, HIGH_GOLD_FACTOR, gold_thresholds,
+    ANCESTRY_FEAT_LEVELS, GENERAL_FEAT_LEVELS, expected_feat_counts, table_level,
+)
+
+# --- Check registry ---
+
+@dataclass(frozen=True)
+class AuditCheck:
+    name: str
+    func: Callable[[CharacterSheet], List[str]]
+    inputs: Tuple[str, ...] # Build fields the check reads
+
+AUDIT_CHECKS: Dict[str, AuditCheck] = {}
+
+def register_check(name: str, inputs: Sequence[str] = ()):
+    """Decorator adding a check to AUDIT_CHECKS (re-registering a name replaces it)."""
+    def decorator(func: Callable[[CharacterSheet], List[str]]):
+        AUDIT_CHECKS[name] = AuditCheck(name=name, func=func, inputs=tuple(inputs))
+        return func
+    return decorator
+
+_code_version: Optional[str] = None
+
+def audit_version() -> str:
+    """
+    What produced a set of check results: the source of this module and rules.py (checks and rule
+    tables), the registered checks and the name index in use. Results from another version are re-run.
+    """
+    global _code_version
+    if _code_version is None:
+        digest = hashlib.sha256()
+        for path in (__file__, rules.__file__):
+            with open(path, "rb") as f:
+                digest.update(f.read())
+        _code_version = digest.hexdigest()[:16]
+    registered = hashlib.sha256(repr([(check.name, check.inputs, check.func.__module__, check.func.__qualname__)
+                                      for check in AUDIT_CHECKS.values()]).encode("utf-8")).hexdigest()[:8]
+    name_index = get_name_index()
+    return f"{_code_version}.{registered}.{name_index.version if name_index is not None else 'none'}"
+
+# --- Analysis/Checks ---
+
+@register_check("unspent_gold", inputs=("level", "money"))
+def check_unspent_gold(character: CharacterSheet, gold_threshold_factor: int = HIGH_GOLD_FACTOR) -> List[str]:
+    suggestions = []
+    total_gp = character.build.money.total_in_gp()
+    level = character.build.level
+    low_threshold, threshold = gold_thresholds(level, gold_threshold_factor)
+
+    if total_gp > threshold:
+        suggestions.append(
+            f"High Unspent Gold: Character has {total_gp:.2f}gp. "
+            f"Consider spending some; a guideline for this level might be less than {threshold}gp unspent. "
+            f"Look into consumables, gear upgrades, or savings for a major purchase."
+        )
+    if low_threshold is not None and total_gp < low_threshold: # Arbitrary low gold threshold
+         suggestions.append(
+            f"Low Gold: Character has only {total_gp:.2f}gp. This might be tight for consumables or repairs."
+        )
+    return suggestions
+
+def get_rune_recommendations(level: int) -> Mapping[str, Any]:
+    """Returns recommended potency/striking/resiliency levels for a character level (read-only table row)."""
+    return RUNES_BY_LEVEL[table_level(level)]
+
+@register_check("equipment_runes", inputs=("level", "weapons", "armor"))
+def check_equipment_runes(character: CharacterSheet) -> List[str]:
+    suggestions = []
+    level = character.build.level
+    recommendations = get_rune_recommendations(level)
+
+    # Weapon Checks
+    for weapon in character.build.weapons:
+        # Potency Rune
+        if weapon.pot is None or weapon.pot < 1:
+            suggestions.append(f"Weapon '{weapon.name}': Missing Potency rune. Recommended: +{recommendations['weapon_potency']}")
+        elif weapon.pot < recommendations["weapon_potency"]:
+            suggestions.append(
+                f"Weapon '{weapon.name}': Potency rune (+{weapon.pot}) is lower than recommended (+{recommendations['weapon_potency']}) for level {level}."
+            )
+
+        # Striking Rune (only if potency is present)
+        if weapon.pot and weapon.pot > 0: # Potency rune is a prerequisite for striking
+            if not weapon.str_rune:
+                suggestions.append(f"Weapon '{weapon.name}': Missing Striking rune. Recommended: {recommendations['weapon_striking_name']}")
+            else:
+                # Simplistic comparison for striking runes
+                if STRIKING_RANKS.get(weapon.str_rune, 0) < recommendations["weapon_striking_rank"]:
+                     suggestions.append(
+                        f"Weapon '{weapon.name}': Striking rune ({weapon.str_rune}) is lower than recommended ({recommendations['weapon_striking_name']}) for level {level}."
+                    )
+
+        # Property Runes
+        if weapon.pot and weapon.pot > 0:
+            max_property_runes = weapon.pot
+            if len(weapon.runes) < max_property_runes:
+                suggestions.append(
+                    f"Weapon '{weapon.name}': Has {len(weapon.runes)}/{max_property_runes} property rune slots filled. Consider adding more."
+                )
+
+    # Armor Checks (only for worn armor)
+    for armor_item in character.build.armor:
+        if armor_item.worn:
+            # Potency Rune
+            if armor_item.pot is None or armor_item.pot < 1:
+                suggestions.append(f"Armor '{armor_item.name}': Missing Potency rune. Recommended: +{recommendations['armor_potency']}")
+            elif armor_item.pot < recommendations["armor_potency"]:
+                suggestions.append(
+                    f"Armor '{armor_item.name}': Potency rune (+{armor_item.pot}) is lower than recommended (+{recommendations['armor_potency']}) for level {level}."
+                )
+
+            # Resiliency Rune (only if potency is present)
+            if armor_item.pot and armor_item.pot > 0:
+                if not armor_item.res:
+                    suggestions.append(f"Armor '{armor_item.name}': Missing Resiliency rune. Recommended: {recommendations['armor_resiliency_name']}")
+                else:
+                    if RESILIENCY_RANKS.get(armor_item.res, 0) < recommendations["armor_resiliency_rank"]:
+                        suggestions.append(
+                            f"Armor '{armor_item.name}': Resiliency rune ({armor_item.res}) is lower than recommended ({recommendations['armor_resiliency_name']}) for level {level}."
+                        )
+            # Property Runes
+            if armor_item.pot and armor_item.pot > 0:
+                max_property_runes = armor_item.pot
+                if len(armor_item.runes) < max_property_runes:
+                    suggestions.append(
+                        f"Armor '{armor_item.name}': Has {len(armor_item.runes)}/{max_property_runes} property rune slots filled. Consider adding more."
+                    )
+    return suggestions
+
+@register_check("missing_feat_slots", inputs=("level", "class_name", "processed_feats", "free_archetype_active"))
+def check_missing_feat_slots(character: CharacterSheet) -> List[str]:
+    suggestions = []
+    level = character.build.level
+    feat_index = character.build.feat_index
+    char_class = character.build.class_name.lower()
+    is_fa_active = character.build.free_archetype_active
+
+    # 1. Check for explicit "Unselected", "Choose", or "Empty" feat names from Pathbuilder
+    # These are strong indicators of an unfilled slot (pre-bucketed by FeatIndex).
+    # With a name index, real feats that merely contain those words (e.g. Empty Body) aren't placeholders.
+    name_index = get_name_index()
+    unselected_placeholders = []
+    for f in feat_index.placeholders:
+        if name_index is not None and "unselected" not in f.name.lower() and name_index.get(f.name, FEAT) is not None:
+            continue
+        # Try to get a more descriptive source for the unselected feat
+        source_info = f.source_description if f.source_description else f.category
+        unselected_placeholders.append(f"{f.name} (slot: {source_info}, level {f.level_taken})")
+
+    if unselected_placeholders:
+        suggestions.append(
+            f"Unselected Feat Slots Found: Pathbuilder indicates potentially empty slots for: {'; '.join(unselected_placeholders)}. Please select feats for these slots."
+        )
+
+    # 2. Count expected vs. actual feats (as a secondary check)
+    # This section is more for auditing if Pathbuilder missed something or for general understanding.
+    # Pathbuilder is usually quite good at enforcing feat slot rules.
+
+    # Expected counts, from the per-class slot schedules in rules.py (e.g. rogues get a skill
+    # feat every level, fighters an extra class feat at L1).
+    # Note: Bonus skill feats from high Intelligence are hard to calculate here without Ability Scores fully parsed
+    # and applied to rules. Pathbuilder handles this, so placeholder check is more important.
+    expected = expected_feat_counts(char_class, level)
+    expected_ancestry_feats = expected["ancestry"]
+    expected_skill_feats = expected["skill"]
+    expected_general_feats = expected["general"]
+    expected_class_feats = expected["class"]
+    expected_archetype_feats = expected["free_archetype"] if is_fa_active else 0
+
+    # Actual counts from Pathbuilder's list
+    actual_ancestry_feats = feat_index.ancestry_slot_count
+    actual_skill_feats = feat_index.category_count("Skill Feat") # Assumes background/awarded skill feats are fine.
+    actual_general_feats = feat_index.category_count("General Feat")
+    actual_class_feats = feat_index.category_count("Class Feat")
+    actual_archetype_feats = feat_index.category_count("Archetype Feat")
+
+    # Reporting discrepancies (usually only if no placeholders found, as placeholders are more direct)
+    if not unselected_placeholders:
+        if actual_ancestry_feats < expected_ancestry_feats:
+            suggestions.append(f"Ancestry Feats Count: Expected {expected_ancestry_feats}, found {actual_ancestry_feats}. Review ancestry feat progression (Levels {', '.join(map(str, ANCESTRY_FEAT_LEVELS))}).")
+        
+        # Skill feat count is very complex due to Int/class bonuses that Pathbuilder handles.
+        # The placeholder check is usually sufficient. This count is a very rough guide.
+        # if actual_skill_feats < expected_skill_feats:
+        #     suggestions.append(f"Skill Feats Count: Expected ~{expected_skill_feats} (base), found {actual_skill_feats}. Pathbuilder usually handles this with placeholders if a slot is empty.")
+
+        if actual_general_feats < expected_general_feats:
+            suggestions.append(f"General Feats Count: Expected {expected_general_feats}, found {actual_general_feats}. Review general feat progression (Levels {', '.join(map(str, GENERAL_FEAT_LEVELS))}).")
+        
+        # Class feat counting also has nuances (e.g. Ancient Elf). Pathbuilder placeholders are key.
+        if actual_class_feats < expected_class_feats:
+             suggestions.append(f"Class Feats Count: Expected {expected_class_feats} (for {char_class}), found {actual_class_feats}. Review class feat progression.")
+
+        if is_fa_active and actual_archetype_feats < expected_archetype_feats:
+            suggestions.append(f"Free Archetype Feats Count: Expected {expected_archetype_feats}, found {actual_archetype_feats}. Review archetype feat progression for Free Archetype slots (Levels 2, 4, 6...).")
+        elif not is_fa_active and actual_archetype_feats > 0:
+             suggestions.append(f"Archetype Feats Present: Found {actual_archetype_feats} Archetype feats, but Free Archetype variant rule does not seem to be active (no feats sourced from 'Free Archetype X'). These feats should be taking up Class Feat slots if selected via multiclass archetypes.")
+
+
+    return suggestions
+
+@register_check("feat_names", inputs=("level", "processed_feats"))
+def check_feat_names(character: CharacterSheet) -> List[str]:
+    """
+    Misspelled (or, with a complete index, unknown) feats, and feats above the level of the slot they were
+    taken in (needs the name index).
+    """
+    name_index = get_name_index()
+    if name_index is None:
+        return []
+    suggestions = []
+    placeholders = set(map(id, character.build.feat_index.placeholders))
+    for feat in character.build.feat_index.selected:
+        if id(feat) in placeholders or feat.category == "Heritage":
+            continue
+        entry = name_index.get(feat.name, FEAT)
+        if entry is None:
+            close = name_index.fuzzy(feat.name, FEAT)
+            where = f"(level {feat.level_taken}, {feat.category})"
+            if name_index.complete:
+                hint = f" Did you mean {' or '.join(e.name for e in close)}?" if close else " Check the spelling or its source book."
+                suggestions.append(f"Unknown Feat: '{feat.name}' {where} is not in the offline rules index.{hint}")
+            elif close: # A partial index can't tell an unlisted feat from an unknown one, only a near-miss
+                suggestions.append(f"Possible Misspelling: '{feat.name}' {where}. Did you mean {' or '.join(e.name for e in close)}?")
+        elif feat.category != "Awarded Feat" and entry.level > feat.level_taken:
+            suggestions.append(
+                f"Feat Level: '{entry.name}' is a level {entry.level} feat but was taken in a level {feat.level_taken} slot"
+                f"{f' ({feat.source_description})' if feat.source_description else ''}. Check that slot's choice."
+            )
+    return suggestions
+
+# --- AoN Link Function ---
+def get_aon_link(item_name: str, item_type: Optional[str] = None) -> str:
+    """
+    Link to Archives of Nethys for a given name: its page when the name index resolves it
+    (item_type: "feat", "spell" or "item" narrows the lookup), otherwise a site search.
+    """
+    name_index = get_name_index()
+    entry = name_index.get(item_name, item_type) if name_index is not None else None
+    if entry is not None and entry.url:
+        return entry.aon_url
+    # Basic sanitization and URL encoding
+    query = quote_plus(item_name.strip())
+    # We can try to be a bit smarter with the item_type later if needed,
+    # but a general search is usually quite good on AoN.
+    # Example: https://2e.aonprd.com/Search.aspx?q=Sudden%20Charge
+    return f"https://2e.aonprd.com/Search.aspx?q={query}"
+
+
+# --- Audit pipeline ---
+
+def run_audit_check_results(character: CharacterSheet, check_names: Optional[Iterable[str]] = None) -> Dict[str, List[str]]:
+    """Runs the registered audit checks (all of them, or just check_names) and returns each check's suggestions by name."""
+    checks = AUDIT_CHECKS.values() if check_names is None else [AUDIT_CHECKS[name] for name in check_names]
+    results = {}
+    for check in checks:
+        with metrics.span(f"audit.{check.name}") as attrs:
+            results[check.name] = check.func(character)
+            attrs["suggestions"] = len(results[check.name])
+    return results
+
+
+def flatten_check_results(results: Mapping[str, List[str]]) -> List[str]:
+    return [suggestion for suggestions in results.values() for suggestion in suggestions]
+
+
+def run_audit_checks(character: CharacterSheet, check_names: Optional[Iterable[str]] = None) -> List[str]:
+    """Runs the registered audit checks (all of them, or just check_names) and returns the combined suggestions."""
+    return flatten_check_results(run_audit_check_results(character, check_names))
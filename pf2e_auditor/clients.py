@@ -0,0 +1,140 @@
+# pf2e_auditor/clients.py
+# Per-API-key Gemini clients, shared across requests and threads.
+#
+# genai.configure(api_key=...) swaps the SDK's process-global clients, so two
+# sessions with different keys racing through it could send one user's
+# request with another user's key, and every call re-created its
+# GenerativeModel (and, after a configure, its gRPC channel). The pool below
+# instead builds one set of service clients per API key, with the key in that
+# client's own options (never the global config), and keeps GenerativeModel
+# handles per (key, model) bound to them. How many requests one key may have
+# in flight is capped by the scheduler (PF2E_LLM_MAX_CONCURRENCY_PER_KEY), in
+# priority order, not here.
+
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+DEFAULT_MAX_KEYS = 256 # Least recently used keys beyond this have their clients closed
+
+_genai = None
+
+
+def _get_genai():
+    """Imports google.generativeai on first use and caches the module."""
+    global _genai
+    if _genai is None:
+        import google.generativeai as genai
+        _genai = genai
+    return _genai
+
+
+def _key_id(google_api_key: str) -> str:
+    # Pool entries are looked up by a digest so the raw key isn't used as a dict key or logged.
+    return hashlib.sha256(google_api_key.encode("utf-8")).hexdigest()
+
+
+class KeyClients:
+    """The service clients and model handles for one API key."""
+
+    def __init__(self, google_api_key: str):
+        self._google_api_key = google_api_key
+        self._lock = threading.Lock()
+        self._generative_client = None
+        self._cache_client = None
+        self._models: Dict[str, Any] = {}
+
+    @property
+    def generative_client(self):
+        with self._lock:
+            if self._generative_client is None:
+                _get_genai()
+                from google.ai.generativelanguage import GenerativeServiceClient
+                self._generative_client = GenerativeServiceClient(client_options={"api_key": self._google_api_key})
+            return self._generative_client
+
+    @property
+    def cache_client(self):
+        with self._lock:
+            if self._cache_client is None:
+                _get_genai()
+                from google.ai.generativelanguage import CacheServiceClient
+                self._cache_client = CacheServiceClient(client_options={"api_key": self._google_api_key})
+            return self._cache_client
+
+    def bind(self, model):
+        """Points a GenerativeModel at this key's client instead of the SDK's global default."""
+        model._client = self.generative_client
+        return model
+
+    def model(self, llm_model_name: str):
+        """Shared GenerativeModel handle for this key and model (no per-model state is mutated per call)."""
+        with self._lock:
+            model = self._models.get(llm_model_name)
+        if model is None:
+            model = self.bind(_get_genai().GenerativeModel(model_name=llm_model_name))
+            with self._lock:
+                model = self._models.setdefault(llm_model_name, model)
+        return model
+
+    def close(self):
+        with self._lock:
+            for client in (self._generative_client, self._cache_client):
+                if client is not None:
+                    try:
+                        client.transport.close()
+                    except Exception:
+                        pass
+            self._generative_client = self._cache_client = None
+            self._models.clear()
+
+
+class ClientPool:
+    """Thread-safe pool of KeyClients, least recently used first out past max_keys."""
+
+    def __init__(self, max_keys: int = DEFAULT_MAX_KEYS):
+        self.max_keys = max_keys
+        self._keys: "OrderedDict[str, KeyClients]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def for_key(self, google_api_key: str) -> KeyClients:
+        key_id = _key_id(google_api_key)
+        with self._lock:
+            clients = self._keys.get(key_id)
+            if clients is not None:
+                self._keys.move_to_end(key_id)
+                return clients
+            clients = KeyClients(google_api_key)
+            self._keys[key_id] = clients
+            while len(self._keys) > self.max_keys:
+                # Dropped, not closed: in-flight calls may still hold it; the channel closes when collected.
+                self._keys.popitem(last=False)
+            return clients
+
+    def model(self, google_api_key: str, llm_model_name: str):
+        """The shared model handle for (key, model). Call it through the scheduler, which admits the call."""
+        return self.for_key(google_api_key).model(llm_model_name)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"keys": len(self._keys)}
+
+    def close(self):
+        with self._lock:
+            keys, self._keys = list(self._keys.values()), OrderedDict()
+        for clients in keys:
+            clients.close()
+
+
+_default_pool: Optional[ClientPool] = None
+_default_pool_lock = threading.Lock()
+
+
+def get_client_pool() -> ClientPool:
+    """The process-wide client pool."""
+    global _default_pool
+    with _default_pool_lock:
+        if _default_pool is None:
+            _default_pool = ClientPool()
+        return _default_pool
@@ -0,0 +1,138 @@
+# pf2e_auditor/diff.py
+# Incremental re-analysis of a new version of a known character.
+#
+# Players usually re-upload after a small edit (a level-up, a new feat, some
+# gold spent). Instead of re-running everything, the previous analysis is kept
+# as a CharacterVersion. When an upload has the same identity (name, class and
+# ancestry), the two Builds are diffed field by field:
+#
+# - only audit checks whose declared inputs (AuditCheck.inputs) changed are
+#   re-run; the rest reuse the previous version's results, unless those came
+#   from other check code or another name index (checks.audit_version);
+# - combat suggestions are only regenerated if the combat prompt itself changed
+#   (edits the prompt doesn't show, like gold or equipment, keep the old ideas);
+# - the diff is shown to the user.
+
+from dataclasses import dataclass, field
+from typing import Any, Dict, FrozenSet, Iterable, List, Optional, Tuple
+
+from .models import Build, CharacterSheet
+from .checks import AUDIT_CHECKS, audit_version, run_audit_check_results
+from .prompt_context import focus_spell_names
+
+
+def character_identity(build: Build) -> str:
+    """Which character a sheet is, across versions: stays the same when the character levels up or is edited."""
+    return "|".join(part.strip().lower() for part in (build.name, build.class_name, build.ancestry))
+
+
+@dataclass
+class CharacterVersion:
+    """The last analyzed version of a character: its Build and everything derived from it."""
+    identity: str
+    fingerprint: str
+    build: Build
+    check_results: Dict[str, List[str]]  # Check name -> suggestions
+    audit_version: str = ""               # checks.audit_version() when check_results were produced ("" if unknown)
+    llm_model_name: str = ""
+    combat_prompt: str = ""
+    combat_ideas: Optional[List[str]] = None # None until the combat job has finished
+
+
+# --- Build diff ---
+
+SCALAR_FIELDS: Tuple[Tuple[str, str], ...] = (
+    ("level", "Level"), ("class_name", "Class"), ("ancestry", "Ancestry"), ("heritage", "Heritage"),
+    ("background", "Background"), ("keyability", "Key ability"), ("free_archetype_active", "Free Archetype"),
+)
+ABILITY_FIELDS: Tuple[Tuple[str, str], ...] = (
+    ("str_score", "STR"), ("dex_score", "DEX"), ("con_score", "CON"),
+    ("int_score", "INT"), ("wis_score", "WIS"), ("cha_score", "CHA"),
+)
+
+
+@dataclass
+class BuildDiff:
+    changed_fields: FrozenSet[str]                                   # Build field names whose value changed
+    scalar_changes: List[Tuple[str, Any, Any]] = field(default_factory=list)  # (label, before, after)
+    added: Dict[str, List[str]] = field(default_factory=dict)        # Section -> items only in the new version
+    removed: Dict[str, List[str]] = field(default_factory=dict)      # Section -> items only in the old version
+
+    @property
+    def is_empty(self) -> bool:
+        return not self.changed_fields
+
+    def summary_lines(self) -> List[str]:
+        """Markdown bullet lines describing the changes."""
+        lines = [f"- **{label}:** {before} → {after}" for label, before, after in self.scalar_changes]
+        for section in sorted(set(self.added) | set(self.removed)):
+            for item in self.added.get(section, []):
+                lines.append(f"- **{section}:** + {item}")
+            for item in self.removed.get(section, []):
+                lines.append(f"- **{section}:** − {item}")
+        return lines
+
+
+def _items_diff(before: Iterable[str], after: Iterable[str]) -> Tuple[List[str], List[str]]:
+    before, after = list(before), list(after)
+    before_set, after_set = set(before), set(after)
+    return [item for item in after if item not in before_set], [item for item in before if item not in after_set]
+
+
+def _section_items(build: Build) -> Dict[str, List[str]]:
+    return {
+        "Feats": [f"{feat.name} ({feat.category}, level {feat.level_taken})" for feat in build.processed_feats],
+        "Class features": list(build.specials),
+        "Weapons": [weapon.display for weapon in build.weapons],
+        "Armor": [armor.display + (" (worn)" if armor.worn else "") for armor in build.armor],
+        "Spells": [f"{sc.name}: {spell} (rank {entry.spellLevel})"
+                   for sc in build.spellCasters for entry in sc.spells for spell in entry.list_of_spells],
+        "Focus spells": focus_spell_names(build),
+    }
+
+
+def diff_builds(before: Build, after: Build) -> BuildDiff:
+    changed = frozenset(name for name in type(after).model_fields if getattr(before, name) != getattr(after, name))
+    diff = BuildDiff(changed_fields=changed)
+    for name, label in SCALAR_FIELDS:
+        if name in changed:
+            diff.scalar_changes.append((label, getattr(before, name), getattr(after, name)))
+    if "abilities" in changed:
+        for name, label in ABILITY_FIELDS:
+            old, new = getattr(before.abilities, name), getattr(after.abilities, name)
+            if old != new:
+                diff.scalar_changes.append((label, old, new))
+    if "money" in changed:
+        diff.scalar_changes.append(("Gold", f"{before.money.total_in_gp():.2f}gp", f"{after.money.total_in_gp():.2f}gp"))
+    before_items, after_items = _section_items(before), _section_items(after)
+    for section in after_items:
+        added, removed = _items_diff(before_items[section], after_items[section])
+        if added:
+            diff.added[section] = added
+        if removed:
+            diff.removed[section] = removed
+    return diff
+
+
+# --- Incremental audit ---
+
+def checks_to_rerun(changed_fields: Iterable[str], previous_results: Dict[str, List[str]],
+                    previous_audit_version: str = "") -> List[str]:
+    """
+    Registered checks that read a changed field (or have no previous result), in registration order.
+    All of them if the previous results came from another audit_version (or an unknown one).
+    """
+    if previous_audit_version != audit_version():
+        return list(AUDIT_CHECKS)
+    changed = set(changed_fields)
+    return [name for name, check in AUDIT_CHECKS.items()
+            if name not in previous_results or not check.inputs or changed.intersection(check.inputs)]
+
+
+def reaudit(character: CharacterSheet, previous_results: Dict[str, List[str]], changed_fields: Iterable[str],
+            previous_audit_version: str = "") -> Tuple[Dict[str, List[str]], List[str]]:
+    """Per-check results for the new version, re-running only the affected checks. Returns (results, re-run names)."""
+    rerun = checks_to_rerun(changed_fields, previous_results, previous_audit_version)
+    fresh = run_audit_check_results(character, rerun)
+    results = {name: fresh[name] if name in fresh else list(previous_results[name]) for name in AUDIT_CHECKS}
+    return results, rerun
@@ -0,0 +1,95 @@
+# pf2e_auditor/feat_index.py
+# One-pass index over a character's feats.
+#
+# The feat-slot check, Free Archetype detection, both prompt builders and the
+# AoN link list all used to walk build.processed_feats separately, lower-casing
+# names and categories each time. Build now creates a FeatIndex once, right
+# after validation (see Build.feat_index), and every consumer reads the
+# pre-bucketed, pre-normalized views from it.
+
+from collections import defaultdict
+from typing import TYPE_CHECKING, Dict, List, Sequence, Tuple
+
+if TYPE_CHECKING: # models imports this module, so only import for type hints
+    from .models import ProcessedFeat
+
+PLACEHOLDER_KEYWORDS = ("unselected", "choose", "empty")
+
+# Category -> source bucket. Anything sourced from a "Free Archetype N" slot goes to
+# "free_archetype" regardless of category.
+SOURCE_BY_CATEGORY = {
+    "Ancestry Feat": "ancestry",
+    "Heritage": "heritage",
+    "Class Feat": "class",
+    "Skill Feat": "skill",
+    "General Feat": "general",
+    "Archetype Feat": "archetype",
+    "Awarded Feat": "awarded",
+}
+
+
+def feat_source(feat: "ProcessedFeat") -> str:
+    """Which kind of slot a feat came from: free_archetype, class, ancestry, skill, general, ... or other."""
+    if feat.source_description and "Free Archetype" in feat.source_description:
+        return "free_archetype"
+    return SOURCE_BY_CATEGORY.get(feat.category, "other")
+
+
+def is_placeholder_feat(feat: "ProcessedFeat", name_lower: str) -> bool:
+    """Pathbuilder's markers for an unfilled slot ("Unselected", "Choose ...", "Empty", blank names)."""
+    return bool(feat.name) and (
+        any(keyword in name_lower for keyword in PLACEHOLDER_KEYWORDS)
+        or feat.name.strip() == ""
+        or bool(feat.category and "unselected" in feat.category.lower()) # Sometimes category might indicate it
+    )
+
+
+class FeatIndex:
+    """
+    Read-only views over a feat list, built in a single pass:
+
+    - feats / names_lower: all feats, with lower-cased names aligned by position
+    - by_category: feats bucketed by category (the feat-slot check and the roster count them)
+    - placeholders: unfilled-slot entries (see is_placeholder_feat)
+    - selected: named feats that aren't "unselected" placeholders (what prompts and links show)
+    - free_archetype_active: any feat sourced from a Free Archetype slot
+    """
+
+    def __init__(self, feats: Sequence["ProcessedFeat"]):
+        self.feats: Tuple["ProcessedFeat", ...] = tuple(feats)
+        names_lower = []
+        by_category: Dict[str, List["ProcessedFeat"]] = defaultdict(list)
+        placeholders = []
+        selected = []
+        ancestry_slot_count = 0
+        free_archetype_active = False
+
+        for feat in self.feats:
+            name_lower = feat.name.lower() if feat.name else ""
+            names_lower.append(name_lower)
+            by_category[feat.category].append(feat)
+            if not free_archetype_active and feat_source(feat) == "free_archetype":
+                free_archetype_active = True
+            if is_placeholder_feat(feat, name_lower):
+                placeholders.append(feat)
+            if feat.name and "unselected" not in name_lower:
+                selected.append(feat)
+            # Heritage feats granted through an ancestry-feat slot count as ancestry feats
+            if feat.category == "Ancestry Feat" or (feat.category == "Heritage" and feat.source_description and "Feat" in feat.source_description):
+                ancestry_slot_count += 1
+
+        self.names_lower: Tuple[str, ...] = tuple(names_lower)
+        self.by_category: Dict[str, Tuple["ProcessedFeat", ...]] = {k: tuple(v) for k, v in by_category.items()}
+        self.placeholders: Tuple["ProcessedFeat", ...] = tuple(placeholders)
+        self.selected: Tuple["ProcessedFeat", ...] = tuple(selected)
+        self.ancestry_slot_count = ancestry_slot_count
+        self.free_archetype_active = free_archetype_active
+
+    def category_count(self, category: str) -> int:
+        return len(self.by_category.get(category, ()))
+
+    def selected_up_to_level(self, level: int) -> List["ProcessedFeat"]:
+        return [feat for feat in self.selected if feat.level_taken <= level]
+
+    def __len__(self) -> int:
+        return len(self.feats)
@@ -0,0 +1,64 @@
+# pf2e_auditor/fingerprint.py
+# Semantic fingerprint of a character, used as the cache key everywhere.
+#
+# Hashing the raw upload bytes misses the cache on every re-export from
+# Pathbuilder (whitespace, key order, unrelated metadata). Instead we hash a
+# canonical JSON of only the Build fields that the prompts and audit checks
+# read, so two sheets with the same fingerprint produce identical prompts and
+# identical audit results. Bump FINGERPRINT_VERSION whenever a prompt or check
+# starts reading a new field, so old cache entries stop matching.
+
+import hashlib
+import json
+from typing import Any, Dict
+
+from .models import Build
+
+FINGERPRINT_VERSION = 1
+
+
+def _focus_spells(build: Build) -> Dict[str, Dict[str, list]]:
+    if not build.focus:
+        return {}
+    focus = {}
+    for tradition_name, tradition_details in build.focus.model_dump(exclude_none=True).items():
+        if isinstance(tradition_details, dict):
+            focus[tradition_name] = {
+                ability_name: ability_details.get("focusSpells", [])
+                for ability_name, ability_details in tradition_details.items()
+                if isinstance(ability_details, dict)
+            }
+    return focus
+
+
+def fingerprint_fields(build: Build) -> Dict[str, Any]:
+    """The prompt- and check-relevant subset of a Build, as plain JSON-able data."""
+    return {
+        "name": build.name,
+        "class": build.class_name,
+        "level": build.level,
+        "ancestry": build.ancestry,
+        "heritage": build.heritage,
+        "keyability": build.keyability,
+        # Order is kept: the prompts list feats, specials and spells in sheet order.
+        "feats": [[f.name, f.category, f.level_taken, f.source_description] for f in build.processed_feats],
+        "specials": list(build.specials),
+        "money": [build.money.pp, build.money.gp, build.money.sp, build.money.cp],
+        "weapons": [
+            [w.name, w.display, w.die, w.pot, w.str_rune, list(w.runes), list(w.extraDamage)]
+            for w in build.weapons
+        ],
+        "armor": [[a.name, a.display, a.worn, a.pot, a.res, list(a.runes)] for a in build.armor],
+        "spellCasters": [
+            [sc.name, sc.magicTradition, sc.spellcastingType, sc.ability, sc.innate, list(sc.perDay),
+             [[entry.spellLevel, list(entry.list_of_spells)] for entry in sc.spells]]
+            for sc in build.spellCasters
+        ],
+        "focus": _focus_spells(build),
+    }
+
+
+def character_fingerprint(build: Build) -> str:
+    """Stable hex digest of fingerprint_fields(build)."""
+    canonical = json.dumps(fingerprint_fields(build), sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(f"v{FINGERPRINT_VERSION}:{canonical}".encode("utf-8")).hexdigest()
@@ -0,0 +1,360 @@
+# pf2e_auditor/library.py
+# Persistent library of analyzed characters, backed by SQLite.
+#
+# Analysis results used to live only in the Streamlit session, so a GM had to
+# re-upload and re-analyze the whole party every week. The library keeps, per
+# distinct character version (semantic fingerprint):
+#
+# - the raw Pathbuilder export, zlib-compressed;
+# - summary fields (name, class, level, ancestry, Free Archetype, gold, feat
+#   count), indexed for the roster view's filters;
+# - the per-check audit results, with the checks.audit_version that produced them;
+# - LLM outputs (combat suggestions, Q&A answers) with the prompt they answered.
+#
+# Versions of one character share an identity (see diff.character_identity),
+# so the latest stored version can seed the incremental re-analysis in a new
+# session (LibraryVersions). Connections follow cache.py: one per thread, WAL
+# mode and a busy timeout, so several app instances can share the file.
+#
+# Configuration (environment variables):
+#   PF2E_LIBRARY_PATH      database file (default: ~/.local/share/pf2e_auditor/library.sqlite3)
+#   PF2E_LIBRARY_DISABLED  set to "1" to turn the library off
+#
+# Usage:
+#   python -m pf2e_auditor.library import characters/ "league/**/*.json"
+#   python -m pf2e_auditor.library list --class Wizard --min-level 5
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import sys
+import threading
+import time
+import zlib
+from collections.abc import Mapping
+from typing import Any, Dict, Iterator, List, Optional, Union
+
+from .checks import audit_version
+from .diff import CharacterVersion, character_identity
+from .sheet_cache import ParsedSheet, load_sheet
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LIBRARY_PATH = os.path.join(os.path.expanduser("~"), ".local", "share", "pf2e_auditor", "library.sqlite3")
+
+COMBAT = "combat"
+QA = "qa"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS characters (
+    fingerprint TEXT PRIMARY KEY,
+    identity TEXT NOT NULL,
+    name TEXT NOT NULL,
+    class_name TEXT NOT NULL,
+    level INTEGER NOT NULL,
+    ancestry TEXT NOT NULL,
+    heritage TEXT NOT NULL,
+    free_archetype INTEGER NOT NULL,
+    total_gp REAL NOT NULL,
+    feat_count INTEGER NOT NULL,
+    suggestion_count INTEGER NOT NULL,
+    raw_sheet BLOB NOT NULL,
+    raw_size INTEGER NOT NULL,
+    audit_results TEXT NOT NULL,
+    audit_version TEXT NOT NULL DEFAULT '',
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS characters_class_level ON characters(class_name, level);
+CREATE INDEX IF NOT EXISTS characters_level ON characters(level);
+CREATE INDEX IF NOT EXISTS characters_ancestry ON characters(ancestry);
+CREATE INDEX IF NOT EXISTS characters_free_archetype ON characters(free_archetype);
+CREATE INDEX IF NOT EXISTS characters_identity ON characters(identity, updated_at);
+CREATE TABLE IF NOT EXISTS llm_outputs (
+    fingerprint TEXT NOT NULL REFERENCES characters(fingerprint) ON DELETE CASCADE,
+    kind TEXT NOT NULL,
+    model TEXT NOT NULL,
+    prompt_sha256 TEXT NOT NULL,
+    prompt TEXT NOT NULL,
+    label TEXT NOT NULL,
+    output TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    PRIMARY KEY (fingerprint, kind, model, prompt_sha256)
+);
+CREATE INDEX IF NOT EXISTS llm_outputs_recent ON llm_outputs(fingerprint, kind, created_at);
+"""
+
+# Summary columns returned by query() (everything but the raw sheet and audit details).
+SUMMARY_COLUMNS = ("fingerprint", "identity", "name", "class_name", "level", "ancestry", "heritage", "free_archetype",
+                   "total_gp", "feat_count", "suggestion_count", "raw_size", "created_at", "updated_at")
+
+
+def _prompt_sha256(prompt: str) -> str:
+    return hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+
+
+class CharacterLibrary:
+    """SQLite-backed store of analyzed character versions and their LLM outputs."""
+
+    def __init__(self, path: str = DEFAULT_LIBRARY_PATH):
+        self.path = path
+        self._local = threading.local() # One connection per thread; sqlite3 connections aren't thread-safe
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        conn = self._connect()
+        conn.executescript(_SCHEMA)
+        if "audit_version" not in {row["name"] for row in conn.execute("PRAGMA table_info(characters)")}:
+            # Libraries created before audit versions were stored; their results are re-run on first reuse
+            conn.execute("ALTER TABLE characters ADD COLUMN audit_version TEXT NOT NULL DEFAULT ''")
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA foreign_keys=ON")
+            conn.row_factory = sqlite3.Row
+            self._local.conn = conn
+        return conn
+
+    # --- Writes ---
+
+    def save_analysis(self, parsed: ParsedSheet, check_results: Dict[str, List[str]], results_version: Optional[str] = None):
+        """
+        Stores (or refreshes) one analyzed character version. results_version: the checks.audit_version()
+        that produced check_results (default: the current one).
+        """
+        build = parsed.sheet.build
+        now = time.time()
+        self._connect().execute(
+            """INSERT INTO characters(fingerprint, identity, name, class_name, level, ancestry, heritage, free_archetype,
+                                      total_gp, feat_count, suggestion_count, raw_sheet, raw_size, audit_results,
+                                      audit_version, created_at, updated_at)
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+               ON CONFLICT(fingerprint) DO UPDATE SET
+                   raw_sheet = excluded.raw_sheet, raw_size = excluded.raw_size, audit_results = excluded.audit_results,
+                   audit_version = excluded.audit_version, suggestion_count = excluded.suggestion_count,
+                   updated_at = excluded.updated_at""",
+            (parsed.fingerprint, character_identity(build), build.name, build.class_name, build.level, build.ancestry,
+             build.heritage, int(build.free_archetype_active), build.money.total_in_gp(), len(build.feat_index.selected),
+             sum(len(s) for s in check_results.values()), zlib.compress(parsed.raw, 6), len(parsed.raw),
+             json.dumps(check_results, ensure_ascii=False), audit_version() if results_version is None else results_version,
+             now, now),
+        )
+
+    def save_llm_output(self, fingerprint: str, kind: str, llm_model_name: str, prompt: str,
+                        output: Union[str, List[str]], label: str = ""):
+        """Stores an LLM output for a stored character (combat ideas as a list, Q&A answers as text; label: the question)."""
+        self._connect().execute(
+            "INSERT OR REPLACE INTO llm_outputs(fingerprint, kind, model, prompt_sha256, prompt, label, output, created_at) "
+            "SELECT ?, ?, ?, ?, ?, ?, ?, ? WHERE EXISTS (SELECT 1 FROM characters WHERE fingerprint = ?)",
+            (fingerprint, kind, llm_model_name, _prompt_sha256(prompt), prompt, label, json.dumps(output, ensure_ascii=False),
+             time.time(), fingerprint),
+        )
+
+    def delete(self, fingerprint: str):
+        self._connect().execute("DELETE FROM characters WHERE fingerprint = ?", (fingerprint,))
+
+    # --- Reads ---
+
+    def load_raw(self, fingerprint: str) -> Optional[bytes]:
+        row = self._connect().execute("SELECT raw_sheet FROM characters WHERE fingerprint = ?", (fingerprint,)).fetchone()
+        return None if row is None else zlib.decompress(row["raw_sheet"])
+
+    def audit_results(self, fingerprint: str) -> Optional[Dict[str, List[str]]]:
+        row = self._connect().execute("SELECT audit_results FROM characters WHERE fingerprint = ?", (fingerprint,)).fetchone()
+        return None if row is None else json.loads(row["audit_results"])
+
+    def get_llm_output(self, fingerprint: str, kind: str, llm_model_name: str, prompt: str) -> Optional[Union[str, List[str]]]:
+        row = self._connect().execute(
+            "SELECT output FROM llm_outputs WHERE fingerprint = ? AND kind = ? AND model = ? AND prompt_sha256 = ?",
+            (fingerprint, kind, llm_model_name, _prompt_sha256(prompt)),
+        ).fetchone()
+        return None if row is None else json.loads(row["output"])
+
+    def llm_outputs(self, fingerprint: str, kind: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Stored outputs for a character version, newest first."""
+        sql = "SELECT kind, model, label, output, created_at FROM llm_outputs WHERE fingerprint = ?"
+        params: List[Any] = [fingerprint]
+        if kind is not None:
+            sql += " AND kind = ?"
+            params.append(kind)
+        rows = self._connect().execute(sql + " ORDER BY created_at DESC", params).fetchall()
+        return [{**dict(row), "output": json.loads(row["output"])} for row in rows]
+
+    def query(self, class_name: Optional[str] = None, ancestry: Optional[str] = None,
+              min_level: Optional[int] = None, max_level: Optional[int] = None,
+              free_archetype: Optional[bool] = None, name_contains: Optional[str] = None,
+              latest_only: bool = True, limit: int = 500) -> List[Dict[str, Any]]:
+        """Summary rows matching every given filter, most recently analyzed first. latest_only: one row per character."""
+        where, params = [], []
+        if class_name:
+            where.append("class_name = ?")
+            params.append(class_name)
+        if ancestry:
+            where.append("ancestry = ?")
+            params.append(ancestry)
+        if min_level is not None:
+            where.append("level >= ?")
+            params.append(min_level)
+        if max_level is not None:
+            where.append("level <= ?")
+            params.append(max_level)
+        if free_archetype is not None:
+            where.append("free_archetype = ?")
+            params.append(int(free_archetype))
+        if name_contains:
+            where.append("name LIKE ? ESCAPE '\\'")
+            params.append("%" + name_contains.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%")
+        if latest_only:
+            where.append("updated_at = (SELECT MAX(c2.updated_at) FROM characters c2 WHERE c2.identity = characters.identity)")
+        sql = f"SELECT {', '.join(SUMMARY_COLUMNS)} FROM characters"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY updated_at DESC LIMIT ?"
+        rows = self._connect().execute(sql, params + [limit]).fetchall()
+        return [{**dict(row), "free_archetype": bool(row["free_archetype"])} for row in rows]
+
+    def distinct(self, column: str) -> List[Any]:
+        """Distinct values of an indexed summary column (for filter widgets)."""
+        if column not in ("class_name", "ancestry", "level"):
+            raise ValueError(f"Not a filterable column: {column}")
+        return [row[0] for row in self._connect().execute(f"SELECT DISTINCT {column} FROM characters ORDER BY {column}")]
+
+    def latest_version(self, identity: str) -> Optional[CharacterVersion]:
+        """The most recently analyzed version of a character, ready to diff a new upload against."""
+        conn = self._connect()
+        row = conn.execute(
+            "SELECT fingerprint, raw_sheet, audit_results, audit_version FROM characters WHERE identity = ? ORDER BY updated_at DESC LIMIT 1",
+            (identity,),
+        ).fetchone()
+        if row is None:
+            return None
+        try:
+            parsed = load_sheet(zlib.decompress(row["raw_sheet"]))
+        except Exception as e: # Stored by an older version whose models no longer validate it
+            logger.warning("Could not load stored character %s: %s", row["fingerprint"][:12], e)
+            return None
+        version = CharacterVersion(identity=identity, fingerprint=parsed.fingerprint, build=parsed.sheet.build,
+                                   check_results=json.loads(row["audit_results"]), audit_version=row["audit_version"])
+        combat = conn.execute(
+            "SELECT model, prompt, output FROM llm_outputs WHERE fingerprint = ? AND kind = ? ORDER BY created_at DESC LIMIT 1",
+            (row["fingerprint"], COMBAT),
+        ).fetchone()
+        if combat is not None:
+            version.llm_model_name, version.combat_prompt = combat["model"], combat["prompt"]
+            version.combat_ideas = json.loads(combat["output"])
+        return version
+
+    def stats(self) -> Dict[str, int]:
+        conn = self._connect()
+        versions, characters, raw_bytes = conn.execute(
+            "SELECT COUNT(*), COUNT(DISTINCT identity), COALESCE(SUM(raw_size), 0) FROM characters").fetchone()
+        outputs = conn.execute("SELECT COUNT(*) FROM llm_outputs").fetchone()[0]
+        return {"characters": characters, "versions": versions, "llm_outputs": outputs, "raw_bytes": raw_bytes}
+
+
+class LibraryVersions(Mapping):
+    """
+    Previous character versions for diff-based re-analysis (analysis.analyze_sheet's
+    previous_versions): this session's versions first, then the library's latest.
+    """
+
+    def __init__(self, session_versions: Dict[str, CharacterVersion], library: Optional[CharacterLibrary]):
+        self._session_versions = session_versions
+        self._library = library
+
+    def __getitem__(self, identity: str) -> CharacterVersion:
+        version = self._session_versions.get(identity)
+        if version is None and self._library is not None:
+            version = self._library.latest_version(identity)
+        if version is None:
+            raise KeyError(identity)
+        return version
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._session_versions)
+
+    def __len__(self) -> int:
+        return len(self._session_versions)
+
+
+_default_library: Optional[CharacterLibrary] = None
+_default_library_lock = threading.Lock()
+
+
+def get_character_library() -> Optional[CharacterLibrary]:
+    """The process-wide character library, created on first use. None when disabled."""
+    global _default_library
+    if os.environ.get("PF2E_LIBRARY_DISABLED") == "1":
+        return None
+    with _default_library_lock:
+        if _default_library is None:
+            try:
+                _default_library = CharacterLibrary(os.environ.get("PF2E_LIBRARY_PATH", DEFAULT_LIBRARY_PATH))
+            except (OSError, sqlite3.Error) as e:
+                logger.warning("Character library unavailable, continuing without it: %s", e)
+                return None
+        return _default_library
+
+
+def set_character_library(library: Optional[CharacterLibrary]):
+    """Replaces the process-wide library (e.g. with a temporary one in tests/benchmarks)."""
+    global _default_library
+    with _default_library_lock:
+        _default_library = library
+
+
+# --- Command line ---
+
+def import_files(library: CharacterLibrary, paths: List[str]) -> int:
+    """Parses, audits and stores each file (no LLM calls). Returns how many were stored."""
+    from .checks import run_audit_check_results
+    stored = 0
+    for path in paths:
+        try:
+            with open(path, "rb") as f:
+                parsed = load_sheet(f.read())
+        except Exception as e:
+            print(f"{path}: skipped ({e})", file=sys.stderr)
+            continue
+        library.save_analysis(parsed, run_audit_check_results(parsed.sheet))
+        stored += 1
+    return stored
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    from .batch import expand_inputs
+
+    parser = argparse.ArgumentParser(prog="python -m pf2e_auditor.library", description="Manage the local character library.")
+    parser.add_argument("--db", default=os.environ.get("PF2E_LIBRARY_PATH", DEFAULT_LIBRARY_PATH), help="Library database file.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    importer = commands.add_parser("import", help="Parse, audit and store Pathbuilder exports.")
+    importer.add_argument("inputs", nargs="+", help="Directories, files, or glob patterns.")
+    lister = commands.add_parser("list", help="Print the roster (one JSON line per character).")
+    lister.add_argument("--class", dest="class_name")
+    lister.add_argument("--ancestry")
+    lister.add_argument("--min-level", type=int)
+    lister.add_argument("--max-level", type=int)
+    lister.add_argument("--free-archetype", choices=("yes", "no"))
+    lister.add_argument("--all-versions", action="store_true", help="Include earlier versions of each character.")
+    args = parser.parse_args(argv)
+
+    library = CharacterLibrary(args.db)
+    if args.command == "import":
+        paths = expand_inputs(args.inputs)
+        print(f"Stored {import_files(library, paths)} of {len(paths)} file(s) in {args.db}.", file=sys.stderr)
+        return 0
+    free_archetype = None if args.free_archetype is None else args.free_archetype == "yes"
+    for row in library.query(args.class_name, args.ancestry, args.min_level, args.max_level, free_archetype,
+                             latest_only=not args.all_versions):
+        print(json.dumps(row, ensure_ascii=False))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,418 @@
+# pf2e_auditor/llm.py
+# Gemini-backed combat suggestions and character Q&A.
+#
+# The google-generativeai SDK takes seconds to import, so it is loaded lazily
+# on the first LLM call (see clients._get_genai). Importing this module, or
+# building prompts, never touches the SDK. Calls go through the per-key client
+# pool in clients.py rather than the SDK's global genai.configure.
+#
+# Passing router.AUTO_MODEL as the model routes each request to a concrete model
+# by complexity and measured latency (see pf2e_auditor.router); every uncached
+# call records its latency for that purpose.
+
+import logging
+import time
+from typing import Callable, List, Optional, Iterator, Iterable, Sequence
+
+from .models import Build, CharacterSheet
+from .cache import get_response_cache
+from .clients import _get_genai, get_client_pool
+from .prompt_context import estimate_tokens, render_prompt
+from .retrieval import Passage, QAGrounding, ground_question
+from .router import COMBAT, QA, get_latency_tracker, resolve_model
+from .scheduler import BACKGROUND, INTERACTIVE, get_scheduler
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MODEL_NAME = "gemini-1.5-flash-latest"
+DEFAULT_MAX_OUTPUT_TOKENS = 20000 # Per-call override: max_output_tokens on every generate/stream function
+
+# --- Prompt Construction ---
+# The character itself is serialized once per Build by prompt_context; these
+# functions only add each prompt's instructions and apply the token budget.
+
+def build_combat_prompt(build: Build, token_budget: Optional[int] = None) -> str:
+    """Builds the combat-suggestion prompt for a character (token_budget: see prompt_context.render_prompt)."""
+    return render_prompt(
+        [
+            "You are an expert Pathfinder 2nd Edition tactical advisor. A player needs suggestions for their turn in combat.",
+            "\n--- Character Information ---",
+        ],
+        build,
+        [
+            "--- End Character Information ---",
+            "\nBased on this character, provide 3-5 distinct and actionable combat suggestions for a typical combat encounter.",
+            "Each suggestion should be a paragraph explaining the action(s), why it's effective for this character (referencing specific feats, spells, or abilities), and the general tactical benefit.",
+            "Prioritize creative uses of their abilities and synergies. Format each suggestion clearly, perhaps starting each with 'Suggestion:' or using markdown for structure.",
+        ],
+        token_budget,
+    ).text
+
+
+QA_INSTRUCTIONS = [
+    "You are a helpful Pathfinder 2nd Edition expert assistant. You will be given information about a player character and a question from the user about that character. Answer the question based *only* on the provided character information and general Pathfinder 2e rules.",
+    "Do not invent new abilities or information not present in the character sheet summary. If the information is not in the sheet, state that.",
+    "\n--- Character Information ---",
+]
+
+
+PARTIAL_CONTEXT_NOTE = "(Only the character sections related to the question are included.)"
+
+
+def format_rules_passages(passages: Sequence[Passage]) -> List[str]:
+    """The rules-reference part of a Q&A prompt (empty without retrieved passages)."""
+    if not passages:
+        return []
+    return [
+        "--- Rules Reference ---",
+        "Rules excerpts retrieved for this question. Prefer them over general knowledge; if they don't cover the question, say so.",
+        *(passage.render() for passage in passages),
+        "--- End Rules Reference ---",
+    ]
+
+
+def format_qa_question(user_question: str, passages: Sequence[Passage] = ()) -> List[str]:
+    """The question part of a Q&A prompt (also sent on its own as a follow-up in a QASession)."""
+    return [
+        *format_rules_passages(passages),
+        f"User's Question: {user_question}",
+        "\nYour Answer (based on the character sheet and Pathfinder 2e rules):",
+    ]
+
+
+def build_qa_prompt(build: Build, user_question: str, token_budget: Optional[int] = None, grounded: bool = True) -> str:
+    """
+    Builds the character Q&A prompt for a character and question (token_budget: see prompt_context.render_prompt).
+    grounded: add the question's retrieved rules passages and send only the related character sections (see retrieval).
+    """
+    grounding = ground_question(build, user_question) if grounded else QAGrounding()
+    head = QA_INSTRUCTIONS if grounding.sections is None else [*QA_INSTRUCTIONS[:-1], PARTIAL_CONTEXT_NOTE, QA_INSTRUCTIONS[-1]]
+    return render_prompt(
+        head, build, ["--- End Character Information ---", "", *format_qa_question(user_question, grounding.passages)],
+        token_budget, sections=grounding.sections,
+    ).text
+
+
+def build_qa_context(build: Build, token_budget: Optional[int] = None) -> str:
+    """The question-independent part of the Q&A prompt: instructions plus character context (a QASession's system instruction)."""
+    return render_prompt(QA_INSTRUCTIONS, build, ["--- End Character Information ---"], token_budget).text
+
+
+# --- Response Parsing ---
+
+SPLIT_MARKERS = ["Suggestion:", "\n\n**", "\n\n*", "\n\n-", "\n\n1.", "\n\n2.", "\n\n3.", "\n\n4.", "\n\n5."]
+
+
+def split_suggestions(response_content: str) -> List[str]:
+    """Splits a combat-suggestion response into individual suggestion blocks."""
+    current_best_split = [response_content] # Default to whole content if no markers found
+    for marker in SPLIT_MARKERS:
+        if marker in response_content:
+            potential_split = [s.strip() for s in response_content.split(marker) if s.strip()]
+            if not potential_split: continue
+
+            # If the marker itself isn't the suggestion text (e.g. "Suggestion:"),
+            # we might need to prepend it to all but the first (if it was a numbered/bulleted list from LLM)
+            # For "Suggestion:", the first part of split is empty or preamble, so we take the rest.
+            if marker == "Suggestion:":
+                 current_best_split = potential_split # Each item after "Suggestion:" is a suggestion
+            elif marker.strip().endswith((".", "-", "*")): # For list-like markers
+                 current_best_split = [potential_split[0]] + [marker.strip() + " " + s for s in potential_split[1:]]
+            else: # For "**" or other section markers
+                current_best_split = potential_split
+            break # Take the first marker that successfully splits into multiple parts
+
+    return current_best_split if any(s.strip() for s in current_best_split) else ["LLM returned no distinct suggestions or format was unexpected."]
+
+
+class SuggestionStreamParser:
+    """
+    Incremental version of split_suggestions for streamed responses.
+
+    feed() each text chunk as it arrives; it returns the suggestion blocks that
+    were completed by that chunk (a block is complete once the next "Suggestion:"
+    marker shows up). finish() returns whatever is left. If the model never used
+    the "Suggestion:" marker, finish() falls back to split_suggestions over the
+    full text so the end result matches the non-streaming path.
+    """
+
+    def __init__(self, marker: str = "Suggestion:"):
+        self.marker = marker
+        self._chunks: List[str] = []
+        self._buffer = ""
+        self._seen_marker = False
+
+    @property
+    def text(self) -> str:
+        """Full response text received so far."""
+        return "".join(self._chunks)
+
+    @property
+    def seen_marker(self) -> bool:
+        """True once at least one "Suggestion:" boundary has been seen."""
+        return self._seen_marker
+
+    @property
+    def pending(self) -> str:
+        """Text of the block currently being streamed (not yet complete)."""
+        return self._buffer
+
+    def feed(self, chunk: str) -> List[str]:
+        self._chunks.append(chunk)
+        self._buffer += chunk
+        completed = []
+        while True:
+            idx = self._buffer.find(self.marker)
+            if idx == -1:
+                break
+            block = self._buffer[:idx].strip()
+            if block:
+                completed.append(block)
+            self._buffer = self._buffer[idx + len(self.marker):]
+            self._seen_marker = True
+        return completed
+
+    def finish(self) -> List[str]:
+        if not self._seen_marker:
+            return split_suggestions(self.text)
+        tail = self._buffer.strip()
+        self._buffer = ""
+        return [tail] if tail else []
+
+
+def iter_suggestion_blocks(chunks: Iterable[str]) -> Iterator[str]:
+    """Yields each completed suggestion block from a stream of text chunks as soon as its boundary arrives."""
+    parser = SuggestionStreamParser()
+    for chunk in chunks:
+        yield from parser.feed(chunk)
+    yield from parser.finish()
+
+
+# --- Gemini Calls ---
+# The raw calls go through a replaceable backend, so benchmarks and offline runs
+# can swap in a stub (see pf2e_auditor.replay) while the response cache and the
+# scheduler stay in the path.
+
+class LLMBackend:
+    """Produces model output for a final prompt. generate() returns the text; stream() yields chunks."""
+
+    def generate(self, prompt: str, google_api_key: str, llm_model_name: str, max_output_tokens: int) -> str:
+        raise NotImplementedError
+
+    def stream(self, prompt: str, google_api_key: str, llm_model_name: str, max_output_tokens: int) -> Iterator[str]:
+        yield self.generate(prompt, google_api_key, llm_model_name, max_output_tokens)
+
+
+class GeminiBackend(LLMBackend):
+    """The real Gemini API, through the per-key client pool."""
+
+    def generate(self, prompt: str, google_api_key: str, llm_model_name: str, max_output_tokens: int) -> str:
+        generation_config = _get_genai().types.GenerationConfig(max_output_tokens=max_output_tokens)
+        model = get_client_pool().model(google_api_key, llm_model_name)
+        return model.generate_content(prompt, generation_config=generation_config).text
+
+    def stream(self, prompt: str, google_api_key: str, llm_model_name: str, max_output_tokens: int) -> Iterator[str]:
+        generation_config = _get_genai().types.GenerationConfig(max_output_tokens=max_output_tokens)
+        # The scheduler holds the call's slot until the stream is consumed or closed.
+        model = get_client_pool().model(google_api_key, llm_model_name)
+        for chunk in model.generate_content(prompt, generation_config=generation_config, stream=True):
+            # Chunks with no text parts (e.g. a final safety/finish chunk) raise on .text
+            try:
+                text = chunk.text
+            except ValueError:
+                continue
+            if text:
+                yield text
+
+
+_backend: LLMBackend = GeminiBackend()
+
+
+def get_llm_backend() -> LLMBackend:
+    return _backend
+
+
+def set_llm_backend(backend: Optional[LLMBackend]) -> LLMBackend:
+    """Replaces the process-wide backend (None restores Gemini) and returns the previous one."""
+    global _backend
+    previous, _backend = _backend, backend or GeminiBackend()
+    return previous
+
+
+def _call_gemini(prompt: str, google_api_key: str, llm_model_name: str, max_output_tokens: int = DEFAULT_MAX_OUTPUT_TOKENS) -> str:
+    return _backend.generate(prompt, google_api_key, llm_model_name, max_output_tokens)
+
+
+def _call_gemini_stream(prompt: str, google_api_key: str, llm_model_name: str, max_output_tokens: int = DEFAULT_MAX_OUTPUT_TOKENS) -> Iterator[str]:
+    yield from _backend.stream(prompt, google_api_key, llm_model_name, max_output_tokens)
+
+
+def _timed_call(llm_model_name: str, kind: str, call):
+    """Runs call(), recording its latency for the model router (failed calls aren't recorded)."""
+    start = time.perf_counter()
+    result = call()
+    get_latency_tracker().record(llm_model_name, kind, time.perf_counter() - start)
+    return result
+
+
+def _timed_chunks(llm_model_name: str, kind: str, chunks: Iterator[str]) -> Iterator[str]:
+    """Passes chunks through, recording the whole stream's latency once it completes."""
+    start = time.perf_counter()
+    yield from chunks
+    get_latency_tracker().record(llm_model_name, kind, time.perf_counter() - start)
+
+
+def _cache_model_key(llm_model_name: str, max_output_tokens: int) -> str:
+    """Response-cache namespace. A non-default output limit can truncate differently, so it gets its own entries."""
+    if max_output_tokens == DEFAULT_MAX_OUTPUT_TOKENS:
+        return llm_model_name
+    return f"{llm_model_name}@{max_output_tokens}"
+
+
+class CallNotPermitted(Exception):
+    """Raised when a permit callback declines an uncached API call (e.g. an exhausted prefetch budget)."""
+
+
+def _generate(prompt: str, google_api_key: str, llm_model_name: str, max_output_tokens: int = DEFAULT_MAX_OUTPUT_TOKENS,
+              priority: int = INTERACTIVE, kind: str = QA, permit: Optional[Callable[[], bool]] = None) -> str:
+    """
+    Gemini call behind the persistent response cache (see pf2e_auditor.cache) and the request scheduler.
+    permit, if given, runs only when the call actually goes to the API; returning False raises CallNotPermitted.
+    """
+    cache = get_response_cache()
+    cache_model = _cache_model_key(llm_model_name, max_output_tokens)
+    if cache is not None:
+        with metrics.span("llm.cache_lookup", model=llm_model_name) as attrs:
+            cached = cache.get(cache_model, prompt)
+            attrs["hit"] = cached is not None
+        if cached is not None:
+            return cached
+    if permit is not None and not permit():
+        raise CallNotPermitted(f"{kind} call to {llm_model_name} not permitted")
+    prompt_tokens = estimate_tokens(prompt)
+    metrics.count(metrics.PROMPT_TOKENS, prompt_tokens)
+    with metrics.span("llm.total", model=llm_model_name, streamed=False):
+        text = get_scheduler().run(
+            lambda: _timed_call(llm_model_name, kind, lambda: _call_gemini(prompt, google_api_key, llm_model_name, max_output_tokens)),
+            google_api_key, llm_model_name, prompt_tokens, priority)
+    metrics.count(metrics.RESPONSE_TOKENS, estimate_tokens(text))
+    if cache is not None and text:
+        cache.set(cache_model, prompt, text)
+    return text
+
+
+def _generate_stream(prompt: str, google_api_key: str, llm_model_name: str, max_output_tokens: int = DEFAULT_MAX_OUTPUT_TOKENS,
+                     priority: int = INTERACTIVE, kind: str = QA) -> Iterator[str]:
+    """
+    Streaming Gemini call behind the persistent response cache and the request scheduler.
+    A hit is yielded as a single chunk; a miss is stored only once the stream has completed.
+    """
+    cache = get_response_cache()
+    cache_model = _cache_model_key(llm_model_name, max_output_tokens)
+    if cache is not None:
+        with metrics.span("llm.cache_lookup", model=llm_model_name) as attrs:
+            cached = cache.get(cache_model, prompt)
+            attrs["hit"] = cached is not None
+        if cached is not None:
+            yield cached
+            return
+    prompt_tokens = estimate_tokens(prompt)
+    metrics.count(metrics.PROMPT_TOKENS, prompt_tokens)
+    chunks = []
+    for chunk in metrics.timed_stream(get_scheduler().stream(
+            lambda: _timed_chunks(llm_model_name, kind, _call_gemini_stream(prompt, google_api_key, llm_model_name, max_output_tokens)),
+            google_api_key, llm_model_name, prompt_tokens, priority), model=llm_model_name):
+        chunks.append(chunk)
+        yield chunk
+    # Not reached if the consumer stopped early (cancelled job) or the stream raised.
+    if cache is not None and chunks:
+        cache.set(cache_model, prompt, "".join(chunks))
+
+
+def get_combat_suggestions(character: CharacterSheet, google_api_key: str, llm_model_name: str = DEFAULT_MODEL_NAME, prompt: Optional[str] = None,
+                           max_output_tokens: int = DEFAULT_MAX_OUTPUT_TOKENS, priority: int = BACKGROUND) -> List[str]:
+    """
+    Generates combat suggestions using a Google Gemini LLM.
+    Errors are returned as a single-item list rather than raised, so the UI can show them inline.
+    """
+    if not google_api_key:
+        return ["Google AI Studio API key not provided. Cannot fetch LLM suggestions."]
+    if prompt is None:
+        prompt = build_combat_prompt(character.build)
+    try:
+        llm_model_name = resolve_model(llm_model_name, COMBAT, prompt, build=character.build)
+        response_content = _generate(prompt, google_api_key, llm_model_name, max_output_tokens, priority, COMBAT)
+        return split_suggestions(response_content)
+    except Exception as e:
+        logger.error("Error calling Google Generative AI (Combat Suggestions): %s", e)
+        return [f"Error calling Google Generative AI: {e}"]
+
+
+def answer_character_question(character: CharacterSheet, user_question: str, google_api_key: str, llm_model_name: str = DEFAULT_MODEL_NAME,
+                              prompt: Optional[str] = None, max_output_tokens: int = DEFAULT_MAX_OUTPUT_TOKENS,
+                              priority: int = INTERACTIVE, permit: Optional[Callable[[], bool]] = None) -> str:
+    """
+    Like get_character_qa_answer, but failures raise instead of coming back as answer text.
+    permit: see _generate (not consulted for response-cache hits).
+    """
+    if prompt is None:
+        prompt = build_qa_prompt(character.build, user_question)
+    llm_model_name = resolve_model(llm_model_name, QA, prompt, user_question)
+    return _generate(prompt, google_api_key, llm_model_name, max_output_tokens, priority, QA, permit)
+
+
+def get_character_qa_answer(character: CharacterSheet, user_question: str, google_api_key: str, llm_model_name: str = DEFAULT_MODEL_NAME, prompt: Optional[str] = None,
+                            max_output_tokens: int = DEFAULT_MAX_OUTPUT_TOKENS, priority: int = INTERACTIVE) -> str:
+    """Answers a user's question about their character using a Google Gemini LLM."""
+    if not google_api_key:
+        return "Google AI Studio API key not provided. Cannot answer question."
+    if not user_question:
+        return "No question asked."
+    try:
+        return answer_character_question(character, user_question, google_api_key, llm_model_name, prompt,
+                                         max_output_tokens, priority)
+    except Exception as e:
+        logger.error("Error answering question (Google Generative AI): %s", e)
+        return f"Error answering question: {e}"
+
+
+# --- Streaming variants ---
+# These yield raw text chunks as Gemini produces them. Errors are yielded as a
+# final chunk instead of raised, mirroring the non-streaming functions.
+# (priority: see pf2e_auditor.scheduler; combat suggestions default to BACKGROUND,
+# since they run as background jobs, and Q&A to INTERACTIVE.)
+
+def stream_combat_suggestions(character: CharacterSheet, google_api_key: str, llm_model_name: str = DEFAULT_MODEL_NAME, prompt: Optional[str] = None,
+                              max_output_tokens: int = DEFAULT_MAX_OUTPUT_TOKENS, priority: int = BACKGROUND) -> Iterator[str]:
+    """Streams the combat-suggestion response text. Feed it to SuggestionStreamParser to get blocks."""
+    if not google_api_key:
+        yield "Google AI Studio API key not provided. Cannot fetch LLM suggestions."
+        return
+    if prompt is None:
+        prompt = build_combat_prompt(character.build)
+    try:
+        llm_model_name = resolve_model(llm_model_name, COMBAT, prompt, build=character.build)
+        yield from _generate_stream(prompt, google_api_key, llm_model_name, max_output_tokens, priority, COMBAT)
+    except Exception as e:
+        logger.error("Error calling Google Generative AI (Combat Suggestions, streaming): %s", e)
+        yield f"\n\nError calling Google Generative AI: {e}"
+
+
+def stream_character_qa_answer(character: CharacterSheet, user_question: str, google_api_key: str, llm_model_name: str = DEFAULT_MODEL_NAME, prompt: Optional[str] = None,
+                               max_output_tokens: int = DEFAULT_MAX_OUTPUT_TOKENS, priority: int = INTERACTIVE) -> Iterator[str]:
+    """Streams the answer to a user's question about their character."""
+    if not google_api_key:
+        yield "Google AI Studio API key not provided. Cannot answer question."
+        return
+    if not user_question:
+        yield "No question asked."
+        return
+    if prompt is None:
+        prompt = build_qa_prompt(character.build, user_question)
+    try:
+        llm_model_name = resolve_model(llm_model_name, QA, prompt, user_question)
+        yield from _generate_stream(prompt, google_api_key, llm_model_name, max_output_tokens, priority, QA)
+    except Exception as e:
+        logger.error("Error answering question (Google Generative AI, streaming): %s", e)
+        yield f"\n\nError answering question: {e}"
@@ -0,0 +1,240 @@
+# pf2e_auditor/metrics.py
+# Per-stage timing spans and token counts.
+#
+# The pipeline records a span for each stage it runs (sheet parse, each audit
+# check, prompt build, scheduler queue wait, time to first token, total LLM
+# time) and counts prompt/response tokens. Each span goes to two places:
+#
+# - the active Trace, if any: one upload's analysis or one Q&A question. The
+#   app activates a trace around the work and shows it in the Performance tab.
+#   The trace lives in a context variable, and background jobs copy the
+#   submitting context (see background.CombatSuggestionsJob.start), so spans
+#   recorded on worker threads still land in the right trace;
+# - the process-wide MetricsRegistry, which aggregates every span into
+#   Prometheus histograms and counters (prometheus_text()).
+#
+# Set PF2E_METRICS_JSONL_PATH to also append every span of every trace to a
+# JSONL file, one object per line, for log shippers.
+
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from .prompt_context import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+METRICS_JSONL_PATH = os.environ.get("PF2E_METRICS_JSONL_PATH", "")
+
+# Histogram bucket upper bounds, in seconds (stages range from microsecond checks to multi-second LLM calls).
+DURATION_BUCKETS: Tuple[float, ...] = (0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+PROMPT_TOKENS = "llm.prompt_tokens"
+RESPONSE_TOKENS = "llm.response_tokens"
+
+
+@dataclass(frozen=True)
+class Span:
+    name: str
+    start: float        # Wall-clock start (epoch seconds)
+    duration_ms: float
+    attrs: Dict[str, Any] = field(default_factory=dict)
+
+
+class Trace:
+    """The spans and token counts of one unit of work (an analysis, a Q&A question). Thread-safe."""
+
+    def __init__(self, name: str, **attrs):
+        self.id = uuid.uuid4().hex[:16]
+        self.name = name
+        self.attrs = attrs
+        self.started = time.time()
+        self._spans: List[Span] = []
+        self._counters: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def add(self, span: Span):
+        with self._lock:
+            self._spans.append(span)
+
+    def count(self, name: str, value: float):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    @property
+    def spans(self) -> List[Span]:
+        with self._lock:
+            return list(self._spans)
+
+    @property
+    def counters(self) -> Dict[str, float]:
+        with self._lock:
+            return dict(self._counters)
+
+    def span_records(self) -> List[Dict[str, Any]]:
+        """One flat dict per span, in recording order (the JSONL export format)."""
+        return [_span_record(self, span) for span in self.spans]
+
+    def to_jsonl(self) -> str:
+        lines = [json.dumps(record, ensure_ascii=False, default=str) for record in self.span_records()]
+        lines.append(json.dumps({"trace": self.id, "trace_name": self.name, **self.attrs, "counters": self.counters},
+                                ensure_ascii=False, default=str))
+        return "\n".join(lines) + "\n"
+
+
+def _span_record(trace: Trace, span: Span) -> Dict[str, Any]:
+    return {"trace": trace.id, "trace_name": trace.name, "span": span.name, "start": span.start,
+            "duration_ms": round(span.duration_ms, 3), **span.attrs}
+
+
+# --- Process-wide aggregation ---
+
+def _metric_name(stage: str) -> str:
+    return stage.replace(".", "_").replace("-", "_").replace(":", "_")
+
+
+class MetricsRegistry:
+    """Prometheus-style histograms of span durations (by stage) and counters. Thread-safe."""
+
+    def __init__(self, buckets: Tuple[float, ...] = DURATION_BUCKETS):
+        self.buckets = buckets
+        self._histograms: Dict[str, List[float]] = {} # stage -> bucket counts, then +Inf count, then sum
+        self._counters: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, stage: str, seconds: float):
+        with self._lock:
+            hist = self._histograms.get(stage)
+            if hist is None:
+                hist = self._histograms[stage] = [0.0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    hist[i] += 1
+            hist[-2] += 1 # +Inf (= count)
+            hist[-1] += seconds
+
+    def count(self, name: str, value: float):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def prometheus_text(self) -> str:
+        """The registry in the Prometheus text exposition format (version 0.0.4)."""
+        with self._lock:
+            histograms = {stage: list(hist) for stage, hist in self._histograms.items()}
+            counters = dict(self._counters)
+        lines = [
+            "# HELP pf2e_stage_duration_seconds Time spent in each pipeline stage.",
+            "# TYPE pf2e_stage_duration_seconds histogram",
+        ]
+        for stage in sorted(histograms):
+            hist = histograms[stage]
+            for bound, n in zip(self.buckets, hist):
+                lines.append(f'pf2e_stage_duration_seconds_bucket{{stage="{stage}",le="{bound}"}} {n:g}')
+            lines.append(f'pf2e_stage_duration_seconds_bucket{{stage="{stage}",le="+Inf"}} {hist[-2]:g}')
+            lines.append(f'pf2e_stage_duration_seconds_sum{{stage="{stage}"}} {hist[-1]:.6f}')
+            lines.append(f'pf2e_stage_duration_seconds_count{{stage="{stage}"}} {hist[-2]:g}')
+        for name in sorted(counters):
+            metric = f"pf2e_{_metric_name(name)}_total"
+            lines.append(f"# TYPE {metric} counter")
+            lines.append(f"{metric} {counters[name]:g}")
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+
+
+_registry = MetricsRegistry()
+_current_trace: contextvars.ContextVar[Optional[Trace]] = contextvars.ContextVar("pf2e_trace", default=None)
+_jsonl_lock = threading.Lock()
+
+
+def get_registry() -> MetricsRegistry:
+    return _registry
+
+
+def prometheus_text() -> str:
+    return _registry.prometheus_text()
+
+
+def current_trace() -> Optional[Trace]:
+    return _current_trace.get()
+
+
+@contextmanager
+def activate(trace: Trace) -> Iterator[Trace]:
+    """Makes trace the destination of spans recorded in this context (and contexts copied from it)."""
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _current_trace.reset(token)
+
+
+def _write_jsonl(record: Dict[str, Any]):
+    try:
+        with _jsonl_lock, open(METRICS_JSONL_PATH, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+    except OSError as e:
+        logger.warning("Could not write metrics to %s: %s", METRICS_JSONL_PATH, e)
+
+
+def record(name: str, duration_ms: float, start: Optional[float] = None, **attrs):
+    """Records a finished stage: aggregated process-wide, and added to the active trace if there is one."""
+    _registry.observe(name, duration_ms / 1000)
+    trace = _current_trace.get()
+    if trace is None:
+        return
+    span = Span(name, start if start is not None else time.time() - duration_ms / 1000, duration_ms, attrs)
+    trace.add(span)
+    if METRICS_JSONL_PATH:
+        _write_jsonl(_span_record(trace, span))
+
+
+def count(name: str, value: float):
+    """Adds to a counter (e.g. tokens), process-wide and on the active trace."""
+    _registry.count(name, value)
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.count(name, value)
+
+
+@contextmanager
+def span(name: str, **attrs) -> Iterator[Dict[str, Any]]:
+    """Times the block as one stage. Yields attrs, so the block can add details to the span."""
+    start_wall = time.time()
+    start = time.perf_counter()
+    try:
+        yield attrs
+    finally:
+        record(name, (time.perf_counter() - start) * 1000, start_wall, **attrs)
+
+
+def timed_stream(chunks: Iterable[str], prefix: str = "llm", **attrs) -> Iterator[str]:
+    """
+    Passes chunks through, recording <prefix>.ttft (time to the first chunk, measured from the
+    first next() call, so it includes any queue wait) and <prefix>.total, and counting response tokens.
+    """
+    start_wall = time.time()
+    start = time.perf_counter()
+    first = True
+    received: List[str] = []
+    try:
+        for chunk in chunks:
+            if first:
+                record(f"{prefix}.ttft", (time.perf_counter() - start) * 1000, start_wall, **attrs)
+                first = False
+            received.append(chunk)
+            yield chunk
+    finally:
+        record(f"{prefix}.total", (time.perf_counter() - start) * 1000, start_wall, streamed=True,
+               chunks=len(received), **attrs)
+        count(RESPONSE_TOKENS, estimate_tokens("".join(received)))
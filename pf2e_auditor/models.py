@@ -0,0 +1,206 @@
+# pf2e_auditor/models.py
+# Pydantic (v2) models for Pathbuilder JSON exports.
+#
+# Sheets should be validated straight from the uploaded bytes with
+# CharacterSheet.model_validate_json (see sheet_cache.parse_sheet_bytes), which
+# decodes and validates in one pass inside pydantic-core instead of building a
+# Python dict first.
+
+import logging
+from typing import List, Dict, Optional, Any
+from typing_extensions import Annotated
+from pydantic import (
+    BaseModel, BeforeValidator, ConfigDict, Field, PrivateAttr, TypeAdapter, ValidationError, field_validator, model_validator,
+)
+
+from .feat_index import FeatIndex
+
+logger = logging.getLogger(__name__)
+
+# --- Pydantic Models ---
+
+class Abilities(BaseModel):
+    str_score: int = Field(alias='str')
+    dex_score: int = Field(alias='dex')
+    con_score: int = Field(alias='con')
+    int_score: int = Field(alias='int')
+    wis_score: int = Field(alias='wis')
+    cha_score: int = Field(alias='cha')
+    # Add breakdown if needed for more detailed analysis later
+
+class Money(BaseModel):
+    cp: int
+    sp: int
+    gp: int
+    pp: int
+
+    def total_in_gp(self) -> float:
+        return self.pp * 10 + self.gp + self.sp / 10 + self.cp / 100
+
+class Weapon(BaseModel):
+    name: str
+    qty: int
+    prof: str
+    die: str
+    pot: Optional[int] = None # Potency rune level (+1, +2, +3)
+    str_rune: Optional[str] = Field(default=None, alias='str') # Striking (striking, greaterStriking, majorStriking)
+    mat: Optional[str] = None # Material
+    display: str
+    runes: List[str] = Field(default_factory=list) # Property runes
+    damageType: str
+    attack: Optional[int] = None
+    damageBonus: Optional[int] = None
+    extraDamage: List[str] = Field(default_factory=list)
+
+class Armor(BaseModel):
+    name: str
+    qty: int
+    prof: str
+    pot: Optional[int] = None # Potency rune level
+    res: Optional[str] = None # Resiliency rune (resilient, greaterResilient, majorResilient)
+    mat: Optional[str] = None # Material
+    display: str
+    worn: bool
+    runes: List[str] = Field(default_factory=list) # Property runes
+
+# To handle the list-based feat structure:
+class ProcessedFeat(BaseModel):
+    model_config = ConfigDict(coerce_numbers_to_str=True) # Like pydantic v1: a parent feat id of 12 becomes "12"
+
+    name: Optional[str]
+    category: str # "Awarded Feat", "Heritage", "Ancestry Feat", "Class Feat", etc.
+    level_taken: int
+    source_description: Optional[str] # e.g., "Fighter Feat 1", "Free Archetype 2"
+    choice_type: Optional[str]
+    parent_feat_id: Optional[str] = None # For childChoice feats
+
+    @field_validator('level_taken', mode='before')
+    @classmethod
+    def truncate_float_level(cls, v):
+        return int(v) if isinstance(v, float) else v # Like pydantic v1, which truncated 2.0 and 2.5 alike
+
+class BasePydanticModel(BaseModel):
+    model_config = ConfigDict(extra='ignore') # To prevent errors if Pathbuilder adds new fields
+
+# Pathbuilder stores each feat as a positional list whose length varies (4 to 7 columns):
+#   [name, <unused>, category, level, source description, choice type, parent feat]
+# Rows are kept as they come (any values) and decoded by a typed adapter: the whole list
+# is validated in one pydantic-core pass. A row that doesn't fit ProcessedFeat is skipped
+# (with a warning) instead of failing the whole sheet.
+FEAT_ROW_COLUMNS = 7
+
+def _feat_row_fields(row: Any) -> Any:
+    """ProcessedFeat fields for one feat row, or None for a row without a name."""
+    if not isinstance(row, (list, tuple)):
+        return row # Left for validation to reject
+    name, _unused, category, level_taken, source_desc, choice_type, parent_id = (
+        list(row[:FEAT_ROW_COLUMNS]) + [None] * FEAT_ROW_COLUMNS)[:FEAT_ROW_COLUMNS]
+    if not name:
+        return None
+    return dict(name=name, category=category if category is not None else "Unknown Feat Type",
+                level_taken=level_taken if level_taken is not None else 0,
+                source_description=source_desc, choice_type=choice_type, parent_feat_id=parent_id)
+
+FeatRow = Annotated[Optional[ProcessedFeat], BeforeValidator(_feat_row_fields)]
+_FEAT_ROWS = TypeAdapter(List[FeatRow])
+
+def processed_feats_from_rows(rows: List[Any]) -> List[ProcessedFeat]:
+    """The ProcessedFeats for Pathbuilder feat rows, skipping rows without a name or with unusable values."""
+    try:
+        feats = _FEAT_ROWS.validate_python(rows)
+    except ValidationError as e:
+        problems: Dict[int, List[str]] = {}
+        for error in e.errors():
+            problems.setdefault(error['loc'][0], []).append(f"{'.'.join(map(str, error['loc'][1:]))}: {error['msg']}")
+        for index, messages in sorted(problems.items()):
+            logger.warning("Error parsing feat_data %s: %s", rows[index], "; ".join(messages))
+        feats = _FEAT_ROWS.validate_python([row for index, row in enumerate(rows) if index not in problems])
+    return [feat for feat in feats if feat is not None]
+
+class SpellLevelEntry(BasePydanticModel):
+    spellLevel: int
+    list_of_spells: List[str] = Field(alias='list', default_factory=list)
+
+class FocusAbilityDetails(BasePydanticModel): # For focus spells
+    abilityBonus: int
+    proficiency: int
+    itemBonus: int
+    focusCantrips: List[str] = Field(default_factory=list)
+    focusSpells: List[str] = Field(default_factory=list)
+
+class FocusTraditionDetails(BasePydanticModel): # For focus spells
+    # This will hold fields like "cha", "wis" which are FocusAbilityDetails
+    # We can use Dict[str, FocusAbilityDetails] to capture this dynamic nature
+    # Or, if the ability keys are fixed (like just cha, wis, int etc.), define them explicitly
+    cha: Optional[FocusAbilityDetails] = None
+    wis: Optional[FocusAbilityDetails] = None
+    con: Optional[FocusAbilityDetails] = None # Add others if they can appear
+    str_score: Optional[FocusAbilityDetails] = Field(default=None, alias='str') # alias if 'str' is used
+    dex: Optional[FocusAbilityDetails] = None
+    int_score: Optional[FocusAbilityDetails] = Field(default=None, alias='int')
+
+
+class FocusDetails(BasePydanticModel): # For the main 'focus' object
+    divine: Optional[FocusTraditionDetails] = None
+    arcane: Optional[FocusTraditionDetails] = None
+    primal: Optional[FocusTraditionDetails] = None
+    occult: Optional[FocusTraditionDetails] = None
+
+class SpellCaster(BasePydanticModel):
+    name: str
+    magicTradition: str
+    spellcastingType: str
+    ability: str
+    proficiency: int
+    focusPoints: Optional[int] = Field(default=0) # This is from the top-level build.focusPoints
+    innate: Optional[bool] = False
+    perDay: List[int] = Field(default_factory=list)
+    spells: List[SpellLevelEntry] = Field(default_factory=list)
+    # 'prepared' and 'blendedSpells' are empty in this JSON, so default_factory=list is fine.
+    # If they could contain data, model them more specifically.
+    prepared: List[Any] = Field(default_factory=list) 
+    blendedSpells: List[Any] = Field(default_factory=list)
+
+class Build(BaseModel): # Add this to your existing Build model
+    name: str
+    class_name: str = Field(alias='class')
+    level: int
+    ancestry: str
+    heritage: str
+    background: str
+    keyability: str
+    abilities: Abilities
+    proficiencies: Dict[str, int]
+    feats_raw: List[List[Any]] = Field(alias='feats')
+    processed_feats: List[ProcessedFeat] = Field(default_factory=list)
+    specials: List[str]
+    equipment: List[Any]
+    weapons: List[Weapon] = Field(default_factory=list)
+    money: Money
+    armor: List[Armor] = Field(default_factory=list)
+    spellCasters: List[SpellCaster] = Field(default_factory=list)
+    focusPoints: Optional[int] = Field(default=0) # Top-level focus points
+    focus: Optional[FocusDetails] = None # Add the new FocusDetails model here
+    free_archetype_active: bool = False
+    # acTotal: Dict[str, Any] # Can add if needed for AC checks
+    _feat_index: Optional[FeatIndex] = PrivateAttr(default=None)
+    _prompt_context: Any = PrivateAttr(default=None) # Set by prompt_context.get_prompt_context
+
+    @property
+    def feat_index(self) -> FeatIndex:
+        """Bucketed, pre-normalized view of processed_feats, built once at validation."""
+        if self._feat_index is None: # e.g. a Build made with model_construct
+            self._feat_index = FeatIndex(self.processed_feats)
+        return self._feat_index
+
+    @model_validator(mode='after')
+    def process_the_feats(self):
+        if not self.processed_feats:
+            self.processed_feats = processed_feats_from_rows(self.feats_raw)
+        self._feat_index = FeatIndex(self.processed_feats)
+        self.free_archetype_active = self._feat_index.free_archetype_active
+        return self
+
+class CharacterSheet(BaseModel):
+    success: bool
+    build: Build
@@ -0,0 +1,361 @@
+# pf2e_auditor/name_index.py
+# Offline index of rules names (feats, spells, items), memory-mapped from a compact file.
+#
+# Without it the app could only build an Archives of Nethys search URL per feat,
+# and could not tell a real feat from a typo or a Pathbuilder placeholder. A
+# NameIndex resolves a name to its entry (kind, level, AoN page, prerequisites)
+# with no network round-trip:
+#
+# - get() is an exact lookup, and prefix() lists names starting with a prefix.
+#   Both binary-search the sorted record table in place, so opening the file
+#   costs nothing however large it is, and only the touched pages are read;
+# - fuzzy() finds close spellings ("Powr Attack" -> "Power Attack"). It scans
+#   the names of similar length, so it is only used once a name failed get().
+#
+# Names are matched normalized (case-folded, apostrophes dropped, other
+# punctuation as spaces; non-ASCII letters are kept; see normalize_name), and a trailing parenthetical
+# ("Assurance (Athletics)") is ignored if the full name isn't indexed.
+#
+# File format (little-endian):
+#   header   8s magic "PF2NAME1", u32 flags (1: complete), u32 record count, u32 string table offset
+#   records  one per entry, sorted by (normalized name, kind):
+#            u32/u16 offset/length of the normalized name, display name, AoN URL
+#            and prerequisites in the string table, u8 kind, u8 level
+#   strings  UTF-8, deduplicated
+#
+# Sources are JSONL files with one entry per line:
+#   {"name": "Power Attack", "kind": "feat", "level": 1, "url": "/Feats.aspx?ID=...", "prerequisites": ""}
+# The repository bundles a seed source, name_index/core.jsonl: common core
+# feats and spells with their levels (no AoN URLs, so their links stay
+# searches). get_name_index() builds it on first use into an index file in the
+# cache directory, named after a hash of the source so an edited source is
+# rebuilt. The seed is not a complete list, so checks.check_feat_names only
+# reports near-misses of indexed names; an index built with --complete from a
+# full export also reports names it doesn't contain.
+#
+# Configuration (environment variables):
+#   PF2E_NAME_INDEX       a built index file, or a JSONL source to build (default: name_index/core.jsonl in the repo)
+#   PF2E_NAME_CACHE_DIR   where sources are built (default: ~/.cache/pf2e_auditor)
+#
+# Usage:
+#   python -m pf2e_auditor.name_index build names.jsonl pf2e_names.idx --complete
+#   python -m pf2e_auditor.name_index lookup "Powr Attack"
+
+import argparse
+import difflib
+import hashlib
+import json
+import logging
+import mmap
+import os
+import re
+import struct
+import sys
+import threading
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_NAME_SOURCE = os.path.join(REPO_ROOT, "name_index", "core.jsonl")
+DEFAULT_NAME_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "pf2e_auditor")
+AON_BASE_URL = "https://2e.aonprd.com"
+
+MAGIC = b"PF2NAME1"
+_HEADER = struct.Struct("<8sIII")
+COMPLETE = 1 # Header flag: the index lists every name of its kinds, so a missing name is unknown
+_RECORD = struct.Struct("<IHIHIHIHBB")
+
+# Entry kinds
+FEAT = "feat"
+SPELL = "spell"
+ITEM = "item"
+KINDS: Tuple[str, ...] = (FEAT, SPELL, ITEM)
+
+FUZZY_CUTOFF = 0.88 # difflib ratio a misspelling must reach ("Reactive Strike" vs "Reactive Shield" is 0.8)
+
+_PARENTHETICAL_RE = re.compile(r"\s*\([^)]*\)\s*$")
+_NON_WORD_RE = re.compile(r"[\W_]+") # Any letter or digit is kept, not only ASCII ones
+
+
+def normalize_name(name: str) -> str:
+    """Lookup key for a name: "Battle Medicine" and "battle-medicine" -> "battle medicine", "Cat's Luck" -> "cats luck"."""
+    lowered = name.casefold().replace("'", "").replace("’", "")
+    return " ".join(_NON_WORD_RE.sub(" ", lowered).split())
+
+
+@dataclass(frozen=True)
+class NameEntry:
+    name: str
+    kind: str                # FEAT, SPELL or ITEM
+    level: int               # Feat/item level, spell rank
+    url: str = ""            # AoN path ("/Feats.aspx?ID=1") or full URL
+    prerequisites: str = ""
+
+    @property
+    def aon_url(self) -> str:
+        return AON_BASE_URL + self.url if self.url.startswith("/") else self.url
+
+
+# --- Building ---
+
+def load_name_entries(path: str) -> List[NameEntry]:
+    """Entries from a JSONL file (see the module comment). Lines with an unknown kind are skipped."""
+    entries = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            data = json.loads(line)
+            kind = str(data.get("kind", FEAT)).lower()
+            if kind in KINDS and data.get("name"):
+                entries.append(NameEntry(data["name"], kind, int(data.get("level") or 0), data.get("url", ""),
+                                         data.get("prerequisites", "")))
+    return entries
+
+
+def _truncated(text: str, max_bytes: int = 0xFFFF) -> bytes:
+    """UTF-8 of text, cut on a character boundary to fit a u16 length."""
+    data = text.encode("utf-8")
+    return data if len(data) <= max_bytes else data[:max_bytes].decode("utf-8", "ignore").encode("utf-8")
+
+
+def write_name_index(entries: Iterable[NameEntry], path: str, complete: bool = False) -> int:
+    """
+    Writes the index file (atomically). Duplicate (name, kind) pairs keep the first entry. complete: the
+    entries are every name of their kinds (see COMPLETE). Returns the entry count.
+    """
+    unique: Dict[Tuple[str, str], NameEntry] = {}
+    for entry in entries:
+        key = normalize_name(entry.name)
+        if key:
+            unique.setdefault((key, entry.kind), entry)
+    strings = bytearray()
+    offsets: Dict[str, Tuple[int, int]] = {}
+
+    def intern(text: str) -> Tuple[int, int]:
+        if text not in offsets:
+            data = _truncated(text)
+            offsets[text] = (len(strings), len(data))
+            strings.extend(data)
+        return offsets[text]
+
+    records = bytearray()
+    for (key, kind), entry in sorted(unique.items()):
+        records += _RECORD.pack(*intern(key), *intern(entry.name), *intern(entry.url), *intern(entry.prerequisites),
+                                KINDS.index(kind), max(0, min(entry.level, 255)))
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(_HEADER.pack(MAGIC, COMPLETE if complete else 0, len(unique), _HEADER.size + len(records)))
+        f.write(records)
+        f.write(strings)
+    os.replace(tmp_path, path)
+    return len(unique)
+
+
+# --- Reading ---
+
+class NameIndex:
+    """Read-only, memory-mapped name index (see the module comment). Safe to share between threads."""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, flags, self._count, self._strings = _HEADER.unpack_from(self._mm, 0)
+        self.complete = bool(flags & COMPLETE)
+        if magic != MAGIC or self._strings != _HEADER.size + self._count * _RECORD.size:
+            self._mm.close()
+            raise ValueError(f"{path} is not a name index")
+        self._lengths: Optional[Dict[int, List[int]]] = None # Name length -> record numbers, for fuzzy()
+        self._version: Optional[str] = None
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return self._count
+
+    @property
+    def version(self) -> str:
+        """Hash of the file's contents: audit results checked against another index aren't reused (see checks.audit_version)."""
+        if self._version is None:
+            self._version = hashlib.sha256(self._mm).hexdigest()[:16]
+        return self._version
+
+    def close(self):
+        self._mm.close()
+
+    def _string(self, offset: int, length: int) -> str:
+        start = self._strings + offset
+        return self._mm[start:start + length].decode("utf-8")
+
+    def _record(self, n: int) -> Tuple[int, ...]:
+        return _RECORD.unpack_from(self._mm, _HEADER.size + n * _RECORD.size)
+
+    def _key(self, n: int) -> str:
+        fields = self._record(n)
+        return self._string(fields[0], fields[1])
+
+    def _entry(self, n: int) -> NameEntry:
+        (_, _, name_off, name_len, url_off, url_len, pre_off, pre_len, kind, level) = self._record(n)
+        return NameEntry(self._string(name_off, name_len), KINDS[kind], level,
+                         self._string(url_off, url_len), self._string(pre_off, pre_len))
+
+    def _lower_bound(self, key: str) -> int:
+        low, high = 0, self._count
+        while low < high:
+            middle = (low + high) // 2
+            if self._key(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def _exact(self, key: str, kind: Optional[str]) -> Optional[NameEntry]:
+        n = self._lower_bound(key)
+        while n < self._count and self._key(n) == key:
+            entry = self._entry(n)
+            if kind is None or entry.kind == kind:
+                return entry
+            n += 1
+        return None
+
+    def get(self, name: str, kind: Optional[str] = None) -> Optional[NameEntry]:
+        """The entry named name (of the given kind, if any), ignoring a trailing parenthetical if needed."""
+        key = normalize_name(name)
+        entry = self._exact(key, kind) if key else None
+        if entry is None and _PARENTHETICAL_RE.search(name):
+            base = normalize_name(_PARENTHETICAL_RE.sub("", name))
+            entry = self._exact(base, kind) if base else None
+        return entry
+
+    def prefix(self, prefix: str, kind: Optional[str] = None, limit: int = 10) -> List[NameEntry]:
+        """Up to limit entries whose normalized name starts with prefix, alphabetically."""
+        key = normalize_name(prefix)
+        matches = []
+        n = self._lower_bound(key)
+        while n < self._count and len(matches) < limit and self._key(n).startswith(key):
+            entry = self._entry(n)
+            if kind is None or entry.kind == kind:
+                matches.append(entry)
+            n += 1
+        return matches
+
+    def _by_length(self) -> Dict[int, List[int]]:
+        with self._lock:
+            if self._lengths is None:
+                lengths: Dict[int, List[int]] = {}
+                for n in range(self._count):
+                    lengths.setdefault(self._record(n)[1], []).append(n)
+                self._lengths = lengths
+            return self._lengths
+
+    def fuzzy(self, name: str, kind: Optional[str] = None, limit: int = 3, cutoff: float = FUZZY_CUTOFF) -> List[NameEntry]:
+        """Up to limit entries with a name close to name (difflib ratio >= cutoff), closest first."""
+        key = normalize_name(name)
+        if not key:
+            return []
+        slack = max(2, len(key) // 4)
+        matcher = difflib.SequenceMatcher(b=key)
+        scored = []
+        lengths = self._by_length()
+        for length in range(max(len(key) - slack, 1), len(key) + slack + 1):
+            for n in lengths.get(length, ()):
+                candidate = self._key(n)
+                matcher.set_seq1(candidate)
+                if matcher.real_quick_ratio() < cutoff or matcher.quick_ratio() < cutoff:
+                    continue
+                ratio = matcher.ratio()
+                if ratio >= cutoff:
+                    scored.append((-ratio, candidate, n))
+        matches = []
+        for _, _, n in sorted(scored):
+            entry = self._entry(n)
+            if kind is None or entry.kind == kind:
+                matches.append(entry)
+                if len(matches) == limit:
+                    break
+        return matches
+
+
+def built_index_path(source: str, cache_dir: str = DEFAULT_NAME_CACHE_DIR) -> str:
+    """The index file for a JSONL source, built into cache_dir unless an up-to-date one is there."""
+    with open(source, "rb") as f:
+        digest = hashlib.sha256(f.read()).hexdigest()[:16]
+    path = os.path.join(cache_dir, f"names-{digest}.idx")
+    if not os.path.isfile(path):
+        write_name_index(load_name_entries(source), path)
+    return path
+
+
+def open_name_index(path: str) -> NameIndex:
+    """Opens an index file, or builds and opens a JSONL source (see built_index_path)."""
+    if path.endswith(".jsonl"):
+        path = built_index_path(path, os.environ.get("PF2E_NAME_CACHE_DIR", DEFAULT_NAME_CACHE_DIR))
+    return NameIndex(path)
+
+
+_default_index: Optional[NameIndex] = None
+_default_index_set = False
+_default_index_warned: Optional[str] = None
+_default_index_lock = threading.Lock()
+
+
+def get_name_index() -> Optional[NameIndex]:
+    """
+    The process-wide index of the configured file or source, opened on first use. None when there is
+    none (or it failed to open): the next call tries again, so an index added later is picked up.
+    """
+    global _default_index, _default_index_warned
+    with _default_index_lock:
+        if _default_index is None and not _default_index_set:
+            path = os.environ.get("PF2E_NAME_INDEX", DEFAULT_NAME_SOURCE)
+            if os.path.isfile(path):
+                try:
+                    _default_index = open_name_index(path)
+                except (OSError, ValueError, KeyError, struct.error) as e:
+                    if _default_index_warned != path: # Once per path, not on every check
+                        logger.warning("Name index %s unavailable, skipping name checks: %s", path, e)
+                        _default_index_warned = path
+        return _default_index
+
+
+def set_name_index(index: Optional[NameIndex]):
+    """Replaces the process-wide index (e.g. with one built from test data). None: no name index."""
+    global _default_index, _default_index_set
+    with _default_index_lock:
+        _default_index, _default_index_set = index, True
+
+
+# --- Command line ---
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m pf2e_auditor.name_index", description="Build or query the offline name index.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    builder = commands.add_parser("build", help="Build an index file from a JSONL export.")
+    builder.add_argument("source", help="JSONL file, one entry per line.")
+    builder.add_argument("output", help="Index file to write.")
+    builder.add_argument("--complete", action="store_true", help="The source lists every name of its kinds.")
+    lookup = commands.add_parser("lookup", help="Resolve names (exact, then prefix and fuzzy matches).")
+    lookup.add_argument("names", nargs="+")
+    lookup.add_argument("--index", default=os.environ.get("PF2E_NAME_INDEX", DEFAULT_NAME_SOURCE),
+                        help="Index file or JSONL source.")
+    lookup.add_argument("--kind", choices=KINDS)
+    args = parser.parse_args(argv)
+
+    if args.command == "build":
+        count = write_name_index(load_name_entries(args.source), args.output, args.complete)
+        print(f"Wrote {count} entries to {args.output}.", file=sys.stderr)
+        return 0
+    index = open_name_index(args.index)
+    for name in args.names:
+        exact = index.get(name, args.kind)
+        matches = [exact] if exact else index.prefix(name, args.kind) or index.fuzzy(name, args.kind)
+        print(json.dumps({"name": name, "exact": exact is not None,
+                          "matches": [dict(vars(entry), aon_url=entry.aon_url) for entry in matches]}, ensure_ascii=False))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,250 @@
+# pf2e_auditor/prefetch.py
+# Speculative prefetch of likely Q&A answers after an upload.
+#
+# Most questions about a character are predictable from the sheet: how one of
+# its feats works, what its strongest spells are. While the user reads the
+# audit tab, a PrefetchJob answers the top few predicted questions in the
+# background and stores them in the similar-question cache (qa_cache), so
+# clicking one of the suggested questions answers instantly. Speculation must
+# never slow down real requests, so the job:
+#
+# - runs on its own small thread pool (PF2E_PREFETCH_WORKERS), so jobs waiting
+#   for a quiet key never hold the threads combat-suggestion jobs need;
+# - runs at the scheduler's lowest priority (PREFETCH);
+# - before each call, backs off (exponentially, up to PREFETCH_MAX_BACKOFF_SECONDS)
+#   while interactive requests for the same API key are waiting or in flight;
+# - spends from a per-key hourly budget shared by every job in the process
+#   (only for calls that reach the API, not response-cache hits), and stops
+#   when it runs out or a call fails;
+# - skips questions the cache can already answer, and stops when cancelled
+#   (a new upload).
+#
+# Configuration (environment variables):
+#   PF2E_PREFETCH_QUESTIONS         questions predicted per analysis (default 5)
+#   PF2E_PREFETCH_BUDGET_PER_HOUR   prefetch calls per API key per hour (default 20; 0 turns prefetch off)
+#   PF2E_PREFETCH_WORKERS           threads running prefetch jobs, shared by all sessions (default 2)
+
+import collections
+import contextvars
+import hashlib
+import logging
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Deque, Dict, Hashable, List, Optional
+
+from .models import Build, CharacterSheet
+from .feat_index import feat_source
+from .llm import DEFAULT_MAX_OUTPUT_TOKENS, DEFAULT_MODEL_NAME, CallNotPermitted, answer_character_question, build_qa_prompt
+from .prompt_context import get_prompt_context
+from .qa_cache import SimilarQuestionCache
+from .scheduler import INTERACTIVE, PREFETCH, get_scheduler
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PREFETCH_QUESTIONS = int(os.environ.get("PF2E_PREFETCH_QUESTIONS", "5"))
+DEFAULT_PREFETCH_BUDGET_PER_HOUR = int(os.environ.get("PF2E_PREFETCH_BUDGET_PER_HOUR", "20"))
+DEFAULT_PREFETCH_WORKERS = int(os.environ.get("PF2E_PREFETCH_WORKERS", "2"))
+PREFETCH_MIN_BACKOFF_SECONDS = 0.5
+PREFETCH_MAX_BACKOFF_SECONDS = 8.0
+
+# Feat slot source -> rank (lower is asked about first). Heritages aren't feats players ask about.
+FEAT_SOURCE_RANKS: Dict[str, int] = {"class": 0, "archetype": 0, "free_archetype": 0, "ancestry": 1,
+                                     "skill": 2, "general": 2, "awarded": 2, "other": 3}
+
+
+# --- Prediction ---
+
+def _has_spells(build: Build) -> bool:
+    return any("unselected" not in spell.lower()
+               for sc in build.spellCasters for entry in sc.spells for spell in entry.list_of_spells)
+
+
+def predict_questions(build: Build, limit: int = DEFAULT_PREFETCH_QUESTIONS) -> List[str]:
+    """
+    The questions a player is most likely to ask about this character, most likely first:
+    its strongest spells and focus spells (if any), then how its highest-level class and
+    archetype feats work, then ancestry and other feats.
+    """
+    questions = []
+    if _has_spells(build):
+        questions.append("What are my strongest spells?")
+    if get_prompt_context(build).focus_spells:
+        questions.append("How should I use my focus spells?")
+    feats = [feat for feat in build.feat_index.selected_up_to_level(build.level)
+             if feat.category != "Heritage" and feat.name.strip()]
+    feats.sort(key=lambda feat: (FEAT_SOURCE_RANKS.get(feat_source(feat), 3), -feat.level_taken, feat.name))
+    seen = set()
+    for feat in feats:
+        if feat.name not in seen:
+            seen.add(feat.name)
+            questions.append(f"How does {feat.name} work?") # Phrased the way players ask, so their question matches
+    return questions[:limit]
+
+
+# --- Budget ---
+
+class PrefetchBudget:
+    """At most per_hour prefetch calls per API key in any rolling hour. Thread-safe."""
+
+    def __init__(self, per_hour: int = DEFAULT_PREFETCH_BUDGET_PER_HOUR, clock: Callable[[], float] = time.monotonic):
+        self.per_hour = per_hour
+        self._clock = clock
+        self._spent: Dict[str, Deque[float]] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(google_api_key: str) -> str:
+        return hashlib.sha256(google_api_key.encode("utf-8")).hexdigest()
+
+    def _window(self, google_api_key: str, now: float) -> Deque[float]:
+        window = self._spent.setdefault(self._key(google_api_key), collections.deque())
+        while window and window[0] <= now - 3600:
+            window.popleft()
+        return window
+
+    def remaining(self, google_api_key: str) -> int:
+        with self._lock:
+            return max(self.per_hour - len(self._window(google_api_key, self._clock())), 0)
+
+    def try_spend(self, google_api_key: str) -> bool:
+        with self._lock:
+            now = self._clock()
+            window = self._window(google_api_key, now)
+            if len(window) >= self.per_hour:
+                return False
+            window.append(now)
+            return True
+
+
+_default_budget: Optional[PrefetchBudget] = None
+_default_budget_lock = threading.Lock()
+
+
+def get_prefetch_budget() -> PrefetchBudget:
+    global _default_budget
+    with _default_budget_lock:
+        if _default_budget is None:
+            _default_budget = PrefetchBudget()
+        return _default_budget
+
+
+# --- Job ---
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def get_prefetch_executor(max_workers: int = DEFAULT_PREFETCH_WORKERS) -> ThreadPoolExecutor:
+    """Thread pool for prefetch jobs, separate from background.get_executor (jobs sleep here while backing off)."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=max(max_workers, 1), thread_name_prefix="pf2e-prefetch")
+        return _executor
+
+
+class PrefetchJob:
+    """
+    Answers predicted questions in the background and stores them in a SimilarQuestionCache
+    under scope (the same scope the Q&A tab looks up). cancel() stops it between questions
+    and interrupts a back-off wait; answered() lists the questions stored so far.
+    """
+
+    def __init__(self, character: CharacterSheet, questions: List[str], google_api_key: str, cache: SimilarQuestionCache,
+                 scope: Hashable, llm_model_name: str = DEFAULT_MODEL_NAME, token_budget: Optional[int] = None,
+                 max_output_tokens: int = DEFAULT_MAX_OUTPUT_TOKENS, grounded: bool = True,
+                 budget: Optional[PrefetchBudget] = None):
+        self.questions = list(questions)
+        self.llm_model_name = llm_model_name
+        self._character = character
+        self._google_api_key = google_api_key
+        self._cache = cache
+        self._scope = scope
+        self._token_budget = token_budget
+        self._max_output_tokens = max_output_tokens
+        self._grounded = grounded
+        self._budget = budget or get_prefetch_budget()
+        self._cancel_event = threading.Event()
+        self._lock = threading.Lock()
+        self._answered: List[str] = []
+        self.skipped_for_budget = False
+        self.future: Optional[Future] = None
+
+    def start(self, executor: Optional[ThreadPoolExecutor] = None) -> "PrefetchJob":
+        # Same context copy as CombatSuggestionsJob.start: spans land in the caller's trace.
+        self.future = (executor or get_prefetch_executor()).submit(contextvars.copy_context().run, self._run)
+        return self
+
+    def _wait_for_quiet(self):
+        """Backs off while interactive requests for this key are waiting or running."""
+        delay = PREFETCH_MIN_BACKOFF_SECONDS
+        scheduler = get_scheduler()
+        while scheduler.busy(self._google_api_key, INTERACTIVE) and not self._cancel_event.is_set():
+            with metrics.span("prefetch.backoff", seconds=delay):
+                self._cancel_event.wait(delay)
+            delay = min(delay * 2, PREFETCH_MAX_BACKOFF_SECONDS)
+
+    def _run(self) -> List[str]:
+        for question in self.questions:
+            if self._cancel_event.is_set():
+                break
+            if self._cache.contains(self._scope, question):
+                with self._lock:
+                    self._answered.append(question)
+                continue
+            self._wait_for_quiet()
+            if self._cancel_event.is_set():
+                break
+            try:
+                with metrics.span("prefetch.question"):
+                    prompt = build_qa_prompt(self._character.build, question, self._token_budget, grounded=self._grounded)
+                    answer = answer_character_question(
+                        self._character, question, self._google_api_key, self.llm_model_name, prompt=prompt,
+                        max_output_tokens=self._max_output_tokens, priority=PREFETCH,
+                        permit=lambda: self._budget.try_spend(self._google_api_key))
+            except CallNotPermitted:
+                self.skipped_for_budget = True
+                break
+            except Exception as e:
+                # Likely to fail the same way for the rest (bad key, quota); leave it to real requests
+                logger.warning("Prefetch stopped after a failed call: %s", e)
+                break
+            self._cache.add(self._scope, question, answer)
+            with self._lock:
+                self._answered.append(question)
+        return self.answered()
+
+    # --- Polling API ---
+
+    def cancel(self):
+        self._cancel_event.set()
+        if self.future is not None:
+            self.future.cancel()
+
+    def done(self) -> bool:
+        return self.future is not None and self.future.done()
+
+    def answered(self) -> List[str]:
+        """Predicted questions whose answers are cached so far."""
+        with self._lock:
+            return list(self._answered)
+
+    def result(self, timeout: Optional[float] = None) -> Optional[List[str]]:
+        if self.future is None or self.future.cancelled():
+            return None
+        return self.future.result(timeout=timeout)
+
+
+def submit_prefetch(character: CharacterSheet, google_api_key: str, cache: SimilarQuestionCache, scope: Hashable,
+                    llm_model_name: str = DEFAULT_MODEL_NAME, limit: int = DEFAULT_PREFETCH_QUESTIONS,
+                    token_budget: Optional[int] = None, max_output_tokens: int = DEFAULT_MAX_OUTPUT_TOKENS,
+                    grounded: bool = True) -> Optional[PrefetchJob]:
+    """Starts prefetching the character's predicted questions. None if there is nothing to do or no budget."""
+    questions = predict_questions(character.build, limit)
+    if not questions or not google_api_key or get_prefetch_budget().remaining(google_api_key) <= 0:
+        return None
+    return PrefetchJob(character, questions, google_api_key, cache, scope, llm_model_name, token_budget,
+                       max_output_tokens, grounded).start()
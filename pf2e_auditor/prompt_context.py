@@ -0,0 +1,205 @@
+# pf2e_auditor/prompt_context.py
+# Character serialization shared by every LLM prompt, with a token budget.
+#
+# The combat and Q&A prompt builders used to serialize feats, weapons and
+# spellcasters separately, and re-flattened build.focus inside the per-caster
+# loop, so every spellcaster repeated the full focus-spell list. A
+# PromptContext serializes a character once, as compact de-duplicated
+# sections, and is cached on the Build. render_prompt() wraps it in a prompt's
+# fixed head/tail text and, when the estimated token count is over budget,
+# drops the lowest-priority sections first (leaving a note of what was cut).
+
+import math
+import os
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from .models import Build
+
+CHARS_PER_TOKEN = 4 # Rough average for English prose with Gemini/SentencePiece tokenizers
+
+# Whole-prompt budget in estimated tokens; 0 disables trimming.
+DEFAULT_PROMPT_TOKEN_BUDGET = int(os.environ.get("PF2E_PROMPT_TOKEN_BUDGET", "6000"))
+
+REQUIRED = 1000 # Priority of sections that are never trimmed
+
+# Section name (or prefix, for per-caster sections) -> priority. Lower is trimmed first.
+SECTION_PRIORITIES: Dict[str, int] = {
+    "identity": REQUIRED,
+    "feats": 90,
+    "weapons": 85,
+    "spellcasting": 80,
+    "focus_spells": 70,
+    "innate_spellcasting": 50,
+    "armor": 40,
+    "specials": 30,
+}
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap, offline token estimate (no tokenizer or API call)."""
+    return math.ceil(len(text) / CHARS_PER_TOKEN) if text else 0
+
+
+def unique_names(items: Iterable[str]) -> List[str]:
+    """Non-blank strings, de-duplicated, in first-seen order."""
+    seen = set()
+    result = []
+    for item in items:
+        if isinstance(item, str) and item.strip() and item not in seen:
+            seen.add(item)
+            result.append(item)
+    return result
+
+
+@dataclass(frozen=True)
+class PromptSection:
+    name: str
+    text: str
+    priority: int
+
+    @property
+    def tokens(self) -> int:
+        return estimate_tokens(self.text)
+
+
+@dataclass(frozen=True)
+class BudgetedPrompt:
+    text: str
+    estimated_tokens: int
+    omitted_sections: Tuple[str, ...] = ()
+
+
+# --- Serialization ---
+
+def focus_spell_names(build: Build) -> List[str]:
+    """Every focus spell on the sheet, once (focus spells belong to the character, not to a spellcaster)."""
+    if not build.focus:
+        return []
+    spells = []
+    for tradition in (build.focus.divine, build.focus.arcane, build.focus.primal, build.focus.occult):
+        if tradition is None:
+            continue
+        for ability in (tradition.cha, tradition.wis, tradition.con, tradition.str_score, tradition.dex, tradition.int_score):
+            if ability is not None:
+                spells.extend(ability.focusSpells)
+    return sorted(unique_names(spells))
+
+
+def _weapon_line(build: Build) -> str:
+    counts: Dict[str, int] = {}
+    for weapon in build.weapons:
+        entry = f"{weapon.display} ({weapon.die}{''.join(f' +{ed}' for ed in weapon.extraDamage)})"
+        counts[entry] = counts.get(entry, 0) + 1
+    return ", ".join(entry if n == 1 else f"{entry} x{n}" for entry, n in counts.items())
+
+
+def _spellcaster_sections(build: Build) -> List[PromptSection]:
+    sections = []
+    for i, sc in enumerate(build.spellCasters):
+        innate_note = " (Innate)" if sc.innate else ""
+        lines = [f"Spellcasting ({sc.name}{innate_note} - {sc.magicTradition}, {sc.spellcastingType}, {sc.ability.upper()}):"]
+        slots = [f"L{level}: {n}" for level, n in enumerate(sc.perDay) if n > 0]
+        if slots:
+            lines.append("  Slots/day: " + ", ".join(slots))
+        has_spells = False
+        for entry in sc.spells:
+            names = unique_names(name for name in entry.list_of_spells if "unselected" not in name.lower())
+            if names:
+                has_spells = True
+                lines.append(f"  L{entry.spellLevel}: " + ", ".join(names))
+        if not has_spells:
+            lines.append("  (No regular spells listed for this caster.)")
+        kind = "innate_spellcasting" if sc.innate else "spellcasting"
+        sections.append(PromptSection(f"{kind}:{i}", "\n".join(lines), SECTION_PRIORITIES[kind]))
+    return sections
+
+
+class PromptContext:
+    """
+    A character serialized once into prompt sections (in display order), plus the focus
+    spells found along the way (routing, retrieval and prefetch read them from here).
+    """
+
+    def __init__(self, sections: Sequence[PromptSection], focus_spells: Sequence[str] = ()):
+        self.sections: Tuple[PromptSection, ...] = tuple(sections)
+        self.focus_spells: Tuple[str, ...] = tuple(focus_spells)
+
+    @classmethod
+    def from_build(cls, build: Build) -> "PromptContext":
+        sections = [PromptSection("identity", "\n".join([
+            f"Name: {build.name}, Class: {build.class_name}, Level: {build.level}",
+            f"Ancestry: {build.ancestry}, Heritage: {build.heritage}",
+            f"Key Ability: {build.keyability.upper()}",
+        ]), REQUIRED)]
+
+        def add(name: str, label: str, values: List[str]):
+            if values:
+                sections.append(PromptSection(name, f"{label}: " + ", ".join(values), SECTION_PRIORITIES[name]))
+
+        add("feats", "Feats", unique_names(feat.name for feat in build.feat_index.selected_up_to_level(build.level)))
+        add("specials", "Special Abilities/Class Features", unique_names(build.specials))
+        weapons = _weapon_line(build)
+        if weapons:
+            sections.append(PromptSection("weapons", f"Weapons: {weapons}", SECTION_PRIORITIES["weapons"]))
+        worn_armor = next((armor for armor in build.armor if armor.worn), None)
+        if worn_armor:
+            sections.append(PromptSection("armor", f"Worn Armor: {worn_armor.display}", SECTION_PRIORITIES["armor"]))
+        focus_spells = focus_spell_names(build)
+        add("focus_spells", "Focus Spells", focus_spells)
+        sections.extend(_spellcaster_sections(build))
+        return cls(sections, focus_spells)
+
+    @property
+    def estimated_tokens(self) -> int:
+        return estimate_tokens(self.render())
+
+    def render(self, omit: Iterable[str] = ()) -> str:
+        omit = set(omit)
+        return "\n".join(section.text for section in self.sections if section.name not in omit)
+
+    def fit(self, token_budget: int, omit: Iterable[str] = ()) -> Tuple[str, Tuple[str, ...]]:
+        """
+        Renders the sections (except omit), dropping the lowest-priority ones until the text fits
+        token_budget. Returns the text and the sections dropped for length.
+        """
+        excluded = set(omit)
+        omitted: List[str] = []
+        text = self.render(excluded)
+        if token_budget <= 0 or estimate_tokens(text) <= token_budget:
+            return text, ()
+        # Stable sort: among equal priorities, later sections (e.g. the last caster) go first.
+        candidates = sorted((s for s in reversed(self.sections) if s.priority < REQUIRED and s.name not in excluded),
+                            key=lambda s: s.priority)
+        for section in candidates:
+            omitted.append(section.name)
+            text = self.render(excluded.union(omitted)) + f"\n(Omitted for length: {', '.join(omitted)})"
+            if estimate_tokens(text) <= token_budget:
+                break
+        return text, tuple(omitted)
+
+
+def get_prompt_context(build: Build) -> PromptContext:
+    """The Build's PromptContext, serialized on first use and then reused by every prompt."""
+    if build._prompt_context is None:
+        build._prompt_context = PromptContext.from_build(build)
+    return build._prompt_context
+
+
+def render_prompt(head: Sequence[str], build: Build, tail: Sequence[str], token_budget: Optional[int] = None,
+                  sections: Optional[Iterable[str]] = None) -> BudgetedPrompt:
+    """
+    head + character context + tail, trimmed to token_budget (DEFAULT_PROMPT_TOKEN_BUDGET if None;
+    0 for no limit). The head and tail are never trimmed. sections: names of the context sections
+    to include (None for all).
+    """
+    if token_budget is None:
+        token_budget = DEFAULT_PROMPT_TOKEN_BUDGET
+    head_text = "\n".join(head)
+    tail_text = "\n".join(tail)
+    context_budget = max(token_budget - estimate_tokens(head_text) - estimate_tokens(tail_text), 1) if token_budget > 0 else 0
+    context = get_prompt_context(build)
+    excluded = () if sections is None else [s.name for s in context.sections if s.name not in set(sections)]
+    context_text, omitted = context.fit(context_budget, excluded)
+    text = "\n".join([head_text, context_text, tail_text])
+    return BudgetedPrompt(text=text, estimated_tokens=estimate_tokens(text), omitted_sections=omitted)
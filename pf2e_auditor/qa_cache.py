@@ -0,0 +1,234 @@
+# pf2e_auditor/qa_cache.py
+# Near-duplicate question cache for single-shot character Q&A.
+#
+# The Q&A caches (st.cache_data, the persistent response cache) key on the
+# exact question, so "How does Power Attack work?" and "how does power attack
+# work" were separate Gemini calls. SimilarQuestionCache sits in front of them:
+#
+# - questions are normalized (lower-cased, contractions expanded, punctuation,
+#   stopwords and framing words dropped, plurals folded, words sorted; see
+#   retrieval.tokenize), and identical normalized questions always match. In a
+#   comparison ("is my AC higher than my Fort save?") only each side of "than"
+#   is sorted, so swapping the sides changes the question;
+# - otherwise each question becomes a set of shingles (its words plus
+#   character 4-grams, so typos still overlap) and a MinHash signature.
+#   Signatures are banded into an LSH index, so a lookup only compares
+#   against the few stored questions sharing a band, and a candidate matches
+#   when the Jaccard similarity of the shingle sets reaches the threshold;
+# - questions that differ in a number ("at level 5" / "at level 7"), in a
+#   negation or qualifier ("can I" / "can't I", "with" / "without"), or in the
+#   sides of a comparison never match, however similar the rest is.
+#
+# Entries are scoped (character fingerprint plus every setting that changes the
+# answer), so a match is always an answer about the same character version.
+#
+# Configuration (environment variables):
+#   PF2E_QA_SIMILARITY_THRESHOLD   default Jaccard threshold (default 0.85; 1.0: identical normalized questions only)
+
+import os
+import random
+import threading
+import re
+import zlib
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, FrozenSet, Hashable, Optional, Set, Tuple
+
+from .retrieval import tokenize
+from . import metrics
+
+DEFAULT_SIMILARITY_THRESHOLD = float(os.environ.get("PF2E_QA_SIMILARITY_THRESHOLD", "0.85"))
+DEFAULT_MAX_ENTRIES = 5000
+
+CHAR_SHINGLE_SIZE = 4
+NUM_PERMUTATIONS = 64
+BAND_ROWS = 4 # 16 bands of 4 rows: questions at Jaccard 0.75 share a band ~99.7% of the time, at 0.5 ~64%
+
+_MERSENNE_PRIME = (1 << 61) - 1
+_rng = random.Random(0x9F2E) # Fixed seed: signatures are comparable across restarts
+_PERMUTATIONS: Tuple[Tuple[int, int], ...] = tuple(
+    (_rng.randrange(1, _MERSENNE_PRIME), _rng.randrange(0, _MERSENNE_PRIME)) for _ in range(NUM_PERMUTATIONS)
+)
+
+
+# Words that only frame the question ("how does X work", "explain X", "what's X") and spelling variants.
+QUESTION_FILLER = frozenset("work explain tell describe please mean s d ll ve re m".split())
+SYNONYMS = {"vs": "against", "versu": "against", # tokenize strips the "s" of "versus"
+            "lvl": "level", "dmg": "damage",
+            "pick": "take", "choose": "take", "select": "take"}
+# Words that flip or narrow the meaning (kept even when they are stopwords): two questions only match if
+# they have the same ones.
+QUALIFIERS = frozenset("not no without never nor except unless only".split())
+COMPARISON_MARKER = "than" # A stopword, so the sides are split before tokenizing
+
+_CONTRACTIONS = ((re.compile(r"\bcan(?:not|['’]t)\b"), "can not"), (re.compile(r"\bwon['’]t\b"), "will not"),
+                 (re.compile(r"n['’]t\b"), " not"))
+_MARKER_RE = re.compile(rf"\b{COMPARISON_MARKER}\b")
+_WORD_RE = re.compile(r"[a-z]+")
+
+
+def _sorted_words(text: str) -> str:
+    words = {SYNONYMS.get(token, token) for token in tokenize(text) if token not in QUESTION_FILLER}
+    words.update(word for word in _WORD_RE.findall(text) if word in QUALIFIERS)
+    return " ".join(sorted(words))
+
+
+def normalize_question(question: str) -> str:
+    """
+    The question's distinct words, lower-cased and sorted, without stopwords, framing words or punctuation
+    ("How does Power Attack work?" -> "attack power"; "Can't I ...?" keeps "not"). Sorting makes reworded
+    questions line up; a comparison keeps its sides apart ("ac higher than fort save").
+    """
+    text = question.lower()
+    for pattern, replacement in _CONTRACTIONS:
+        text = pattern.sub(replacement, text)
+    parts = _MARKER_RE.split(text, maxsplit=1)
+    if len(parts) == 2:
+        left, right = _sorted_words(parts[0]), _sorted_words(parts[1])
+        if left and right:
+            return f"{left} {COMPARISON_MARKER} {right}"
+    return _sorted_words(text)
+
+
+def question_shingles(normalized: str) -> FrozenSet[str]:
+    """Words plus character 4-grams of a normalized question."""
+    shingles = set(normalized.split())
+    padded = f" {normalized} "
+    shingles.update(padded[i:i + CHAR_SHINGLE_SIZE] for i in range(max(len(padded) - CHAR_SHINGLE_SIZE + 1, 0)))
+    return frozenset(shingles)
+
+
+def minhash_signature(shingles: FrozenSet[str]) -> Tuple[int, ...]:
+    hashes = [zlib.crc32(shingle.encode("utf-8")) for shingle in shingles]
+    return tuple(min((a * h + b) % _MERSENNE_PRIME for h in hashes) for a, b in _PERMUTATIONS)
+
+
+def jaccard(a: FrozenSet[str], b: FrozenSet[str]) -> float:
+    return len(a & b) / len(a | b) if a or b else 1.0
+
+
+@dataclass(frozen=True)
+class SimilarAnswer:
+    question: str      # The stored question that matched
+    answer: str
+    similarity: float  # Jaccard similarity of the shingle sets (1.0 for identical normalized questions)
+
+
+@dataclass(frozen=True)
+class _Entry:
+    scope: Hashable
+    question: str
+    normalized: str
+    shingles: FrozenSet[str]
+    constraints: Tuple[Hashable, ...] # Must equal a candidate's (see _constraints)
+    bands: Tuple[Tuple[int, ...], ...]
+    answer: str
+
+
+def _constraints(normalized: str) -> Tuple[Hashable, ...]:
+    """What two questions must share to match: their numbers, their qualifiers, and the sides of a comparison."""
+    tokens = normalized.split()
+    sides = tuple(normalized.split(f" {COMPARISON_MARKER} ", 1)) if f" {COMPARISON_MARKER} " in normalized else None
+    return (frozenset(t for t in tokens if t.isdigit()), frozenset(t for t in tokens if t in QUALIFIERS), sides)
+
+
+def _bands(signature: Tuple[int, ...]) -> Tuple[Tuple[int, ...], ...]:
+    return tuple(signature[i:i + BAND_ROWS] for i in range(0, len(signature), BAND_ROWS))
+
+
+class SimilarQuestionCache:
+    """In-memory near-duplicate question -> answer cache with an LSH index, least recently used evicted. Thread-safe."""
+
+    def __init__(self, threshold: float = DEFAULT_SIMILARITY_THRESHOLD, max_entries: int = DEFAULT_MAX_ENTRIES):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[int, _Entry]" = OrderedDict()
+        self._exact: Dict[Tuple[Hashable, str], int] = {}                        # (scope, normalized) -> entry id
+        self._buckets: Dict[Tuple[Hashable, int, Tuple[int, ...]], Set[int]] = {} # (scope, band no, band) -> entry ids
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _remove(self, entry_id: int):
+        entry = self._entries.pop(entry_id)
+        self._exact.pop((entry.scope, entry.normalized), None)
+        for band_no, band in enumerate(entry.bands):
+            key = (entry.scope, band_no, band)
+            ids = self._buckets[key]
+            ids.discard(entry_id)
+            if not ids:
+                del self._buckets[key]
+
+    def lookup(self, scope: Hashable, question: str, threshold: Optional[float] = None) -> Optional[SimilarAnswer]:
+        """The stored answer to the most similar question in scope at or above threshold, if any."""
+        threshold = self.threshold if threshold is None else threshold
+        normalized = normalize_question(question)
+        with metrics.span("qa.similar_lookup") as attrs:
+            match = self._lookup(scope, normalized, threshold) if normalized else None
+            attrs["hit"] = match is not None
+        with self._lock:
+            if match is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return match
+
+    def _lookup(self, scope: Hashable, normalized: str, threshold: float) -> Optional[SimilarAnswer]:
+        with self._lock:
+            entry_id = self._exact.get((scope, normalized))
+            if entry_id is not None:
+                self._entries.move_to_end(entry_id)
+                entry = self._entries[entry_id]
+                return SimilarAnswer(entry.question, entry.answer, 1.0)
+        if threshold >= 1.0:
+            return None
+        shingles = question_shingles(normalized)
+        constraints = _constraints(normalized)
+        bands = _bands(minhash_signature(shingles))
+        with self._lock:
+            candidates: Set[int] = set()
+            for band_no, band in enumerate(bands):
+                candidates.update(self._buckets.get((scope, band_no, band), ()))
+            best: Optional[Tuple[float, int]] = None
+            for candidate_id in candidates:
+                entry = self._entries[candidate_id]
+                if entry.constraints != constraints:
+                    continue
+                similarity = jaccard(shingles, entry.shingles)
+                if similarity >= threshold and (best is None or similarity > best[0]):
+                    best = (similarity, candidate_id)
+            if best is None:
+                return None
+            self._entries.move_to_end(best[1])
+            entry = self._entries[best[1]]
+            return SimilarAnswer(entry.question, entry.answer, best[0])
+
+    def contains(self, scope: Hashable, question: str) -> bool:
+        """Whether the same normalized question is stored in scope (not counted as a hit or miss)."""
+        with self._lock:
+            return (scope, normalize_question(question)) in self._exact
+
+    def add(self, scope: Hashable, question: str, answer: str):
+        """Stores an answer, replacing any earlier answer to the same normalized question in scope."""
+        normalized = normalize_question(question)
+        if not normalized:
+            return
+        shingles = question_shingles(normalized)
+        entry = _Entry(scope, question, normalized, shingles, _constraints(normalized), _bands(minhash_signature(shingles)), answer)
+        with self._lock:
+            previous = self._exact.get((scope, normalized))
+            if previous is not None:
+                self._remove(previous)
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = entry
+            self._exact[(scope, normalized)] = entry_id
+            for band_no, band in enumerate(entry.bands):
+                self._buckets.setdefault((scope, band_no, band), set()).add(entry_id)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
@@ -0,0 +1,329 @@
+# pf2e_auditor/qa_session.py
+# Multi-turn Q&A that sends the character context once per session.
+#
+# get_character_qa_answer sends the full Q&A prompt (instructions + character
+# context + question) for every question. A QASession instead opens a chat
+# whose system instruction is the question-independent context
+# (llm.build_qa_context) and then sends only each question, plus the last few
+# turns of history so follow-ups like "and at level 12?" still make sense.
+# Each question carries its own retrieved rules passages (see retrieval); the
+# character context is the whole sheet, since it is sent only once.
+#
+# Backends:
+# - GeminiChatBackend puts the context in a Gemini context cache when the model
+#   accepts it (there is a per-model minimum size), so follow-ups are billed
+#   only for the new tokens. Otherwise it falls back to a plain chat with the
+#   context as the system instruction, which the API re-reads on every turn
+#   (models with implicit prefix caching still discount it).
+# - FakeChatBackend answers locally and bills estimated tokens, so the savings
+#   can be measured without an API key (see QASession.usage).
+#
+# Session answers depend on the conversation, so they bypass the persistent
+# response cache.
+
+import logging
+import threading
+from dataclasses import dataclass
+from datetime import timedelta
+from typing import Callable, Iterator, List, Optional, Tuple
+
+from .models import CharacterSheet
+from .clients import KeyClients, _get_genai, get_client_pool
+from .llm import DEFAULT_MODEL_NAME, DEFAULT_MAX_OUTPUT_TOKENS, build_qa_context, format_qa_question
+from .prompt_context import estimate_tokens
+from .retrieval import retrieve_rules
+from .router import CHAT, resolve_model
+from .scheduler import INTERACTIVE, get_scheduler
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_HISTORY_TURNS = 1 # Earlier question/answer pairs kept; answers are long, so each turn kept costs real tokens
+CONTEXT_CACHE_TTL = timedelta(hours=1)
+
+
+@dataclass
+class TokenUsage:
+    """Input-token accounting for one session."""
+    turns: int = 0
+    input_tokens: int = 0     # Billed at the full rate
+    cached_tokens: int = 0    # Served from the context cache
+    context_tokens: int = 0   # The instructions and character context, which a single-question prompt resends every time
+    question_tokens: int = 0  # The questions sent, with their retrieved rules passages
+
+    @property
+    def baseline_tokens(self) -> int:
+        """About what sending the full Q&A prompt for each question would have cost."""
+        return self.turns * self.context_tokens + self.question_tokens
+
+    @property
+    def saved_tokens(self) -> int:
+        return self.baseline_tokens - self.input_tokens
+
+
+class ChatHandle:
+    """One open conversation. send()/send_stream() update last_usage = (input tokens, cached tokens)."""
+
+    last_usage: Tuple[int, int] = (0, 0)
+
+    def send(self, message: str, max_output_tokens: int) -> str:
+        raise NotImplementedError
+
+    def send_stream(self, message: str, max_output_tokens: int) -> Iterator[str]:
+        yield self.send(message, max_output_tokens)
+
+    def close(self):
+        pass
+
+
+class ChatBackend:
+    requires_api_key = True
+
+    def open_chat(self, google_api_key: str, llm_model_name: str, system_instruction: str, history_turns: int) -> ChatHandle:
+        raise NotImplementedError
+
+
+# --- Gemini ---
+
+class _GeminiChat(ChatHandle):
+    # Each send goes through the request scheduler (as INTERACTIVE), which also caps the key's calls in flight.
+    def __init__(self, model, cached_content, history_turns: int, google_api_key: str, llm_model_name: str):
+        self._chat = model.start_chat()
+        self._google_api_key = google_api_key
+        self._llm_model_name = llm_model_name
+        self._cached_content = cached_content
+        self._history_turns = history_turns
+        self.uses_context_cache = cached_content is not None
+
+    def _generation_config(self, max_output_tokens: int):
+        return _get_genai().types.GenerationConfig(max_output_tokens=max_output_tokens)
+
+    def _after_turn(self, response):
+        # Reading history commits the pending turn, and raises if the response was blocked or broken off.
+        history = self._chat.history
+        usage = response.usage_metadata
+        cached = getattr(usage, "cached_content_token_count", 0) or 0
+        self.last_usage = (usage.prompt_token_count - cached, cached)
+        # Each turn is a user + model message; drop turns beyond the history window.
+        self._chat.history = history[-2 * self._history_turns:] if self._history_turns else []
+
+    def _discard_turn(self):
+        # The ChatSession keeps the last request/response pending until history is read. A failed, blocked or
+        # abandoned one would make every later send raise BrokenResponseError, so it is dropped (like rewind(),
+        # which needs a complete response) and the history is as it was before the question.
+        self._chat._last_sent = None
+        self._chat._last_received = None
+
+    def _send(self, message: str, max_output_tokens: int):
+        return self._chat.send_message(message, generation_config=self._generation_config(max_output_tokens))
+
+    def _send_stream(self, message: str, max_output_tokens: int) -> Iterator[str]:
+        # The finally also runs when the scheduler retries after an error before the first chunk, so each
+        # attempt starts from a clean history, and when the caller stops reading early.
+        completed = False
+        try:
+            response = self._chat.send_message(message, generation_config=self._generation_config(max_output_tokens), stream=True)
+            for chunk in response:
+                try:
+                    text = chunk.text
+                except ValueError: # Chunks with no text parts
+                    continue
+                if text:
+                    yield text
+            self._after_turn(response)
+            completed = True
+        finally:
+            if not completed:
+                self._discard_turn()
+
+    def send(self, message: str, max_output_tokens: int) -> str:
+        response = get_scheduler().run(lambda: self._send(message, max_output_tokens),
+                                       self._google_api_key, self._llm_model_name, estimate_tokens(message), INTERACTIVE)
+        try:
+            self._after_turn(response)
+        except Exception:
+            self._discard_turn()
+            raise
+        return response.text
+
+    def send_stream(self, message: str, max_output_tokens: int) -> Iterator[str]:
+        yield from get_scheduler().stream(lambda: self._send_stream(message, max_output_tokens),
+                                          self._google_api_key, self._llm_model_name, estimate_tokens(message), INTERACTIVE)
+
+    def close(self):
+        if self._cached_content is not None:
+            try:
+                protos = _get_genai().protos
+                get_client_pool().for_key(self._google_api_key).cache_client.delete_cached_content(
+                    protos.DeleteCachedContentRequest(name=self._cached_content.name))
+            except Exception as e: # Expires on its own after CONTEXT_CACHE_TTL anyway
+                logger.warning("Could not delete Gemini context cache: %s", e)
+            self._cached_content = None
+
+
+class GeminiChatBackend(ChatBackend):
+    def __init__(self, use_context_cache: bool = True, cache_ttl: timedelta = CONTEXT_CACHE_TTL):
+        self.use_context_cache = use_context_cache
+        self.cache_ttl = cache_ttl
+
+    def _create_context_cache(self, clients: KeyClients, llm_model_name: str, system_instruction: str):
+        # CachedContent.create() would use the SDK's global (configure()-d) client, so the
+        # request is sent on this key's own cache client instead.
+        CachedContent = _get_genai().caching.CachedContent
+        request = CachedContent._prepare_create_request(model=llm_model_name, system_instruction=system_instruction, ttl=self.cache_ttl)
+        return CachedContent._from_obj(clients.cache_client.create_cached_content(request))
+
+    def open_chat(self, google_api_key: str, llm_model_name: str, system_instruction: str, history_turns: int) -> ChatHandle:
+        genai = _get_genai()
+        clients = get_client_pool().for_key(google_api_key)
+        cached_content = None
+        if self.use_context_cache:
+            try:
+                cached_content = get_scheduler().run(
+                    lambda: self._create_context_cache(clients, llm_model_name, system_instruction),
+                    google_api_key, llm_model_name, estimate_tokens(system_instruction), INTERACTIVE)
+            except Exception: # Context below the model's caching minimum, or caching unsupported for this model
+                cached_content = None
+        if cached_content is not None:
+            model = genai.GenerativeModel.from_cached_content(cached_content)
+        else:
+            model = genai.GenerativeModel(model_name=llm_model_name, system_instruction=system_instruction)
+        return _GeminiChat(clients.bind(model), cached_content, history_turns, google_api_key, llm_model_name)
+
+
+# --- Local fake (offline measurement) ---
+
+class _FakeChat(ChatHandle):
+    def __init__(self, backend: "FakeChatBackend", system_instruction: str, history_turns: int):
+        self._backend = backend
+        self._system_instruction = system_instruction
+        self._history_turns = history_turns
+        self._history: List[str] = []
+        self._context_sent = False
+        self.uses_context_cache = backend.caches_context
+
+    def send(self, message: str, max_output_tokens: int) -> str:
+        context_tokens = estimate_tokens(self._system_instruction)
+        history_tokens = sum(estimate_tokens(text) for text in self._history)
+        if self._backend.caches_context and self._context_sent:
+            self.last_usage = (history_tokens + estimate_tokens(message), context_tokens)
+        else:
+            self.last_usage = (context_tokens + history_tokens + estimate_tokens(message), 0)
+        self._context_sent = True
+        answer = self._backend.reply(message)
+        self._history = (self._history + [message, answer])[-2 * self._history_turns:] if self._history_turns else []
+        return answer
+
+
+class FakeChatBackend(ChatBackend):
+    """
+    Offline backend for tests and benchmarks. reply(message) produces the answer.
+    With caches_context, the system instruction is billed on the first turn only
+    (like a Gemini context cache); without it, on every turn (like a plain chat).
+    """
+
+    requires_api_key = False
+
+    def __init__(self, reply: Optional[Callable[[str], str]] = None, caches_context: bool = True):
+        self.reply = reply or (lambda message: "This is a canned answer from the local fake backend.")
+        self.caches_context = caches_context
+
+    def open_chat(self, google_api_key: str, llm_model_name: str, system_instruction: str, history_turns: int) -> ChatHandle:
+        return _FakeChat(self, system_instruction, history_turns)
+
+
+# --- Session ---
+
+class QASession:
+    """
+    A conversation about one analyzed character. The chat is opened lazily on the
+    first question; ask()/stream() return or yield error strings instead of raising,
+    like the functions in llm. Not safe for concurrent questions (one chat, one turn at a time).
+    """
+
+    def __init__(self, character: CharacterSheet, google_api_key: str, llm_model_name: str = DEFAULT_MODEL_NAME,
+                 backend: Optional[ChatBackend] = None, history_turns: int = DEFAULT_HISTORY_TURNS,
+                 token_budget: Optional[int] = None, max_output_tokens: int = DEFAULT_MAX_OUTPUT_TOKENS,
+                 grounded: bool = True):
+        self.character = character
+        self.backend = backend or GeminiChatBackend()
+        self.history_turns = history_turns
+        self.token_budget = token_budget
+        self.max_output_tokens = max_output_tokens
+        self.grounded = grounded # Send each question's retrieved rules passages with it (see retrieval)
+        self.system_instruction = build_qa_context(character.build, token_budget)
+        self.llm_model_name = resolve_model(llm_model_name, CHAT, self.system_instruction) # One model for the whole chat
+        self.transcript: List[Tuple[str, str]] = []
+        self.usage = TokenUsage(context_tokens=estimate_tokens(self.system_instruction))
+        self._google_api_key = google_api_key
+        self._chat: Optional[ChatHandle] = None
+        self._lock = threading.Lock()
+
+    @property
+    def uses_context_cache(self) -> bool:
+        return bool(self._chat is not None and getattr(self._chat, "uses_context_cache", False))
+
+    def _open(self) -> ChatHandle:
+        if self._chat is None:
+            with metrics.span("qa.open_chat", model=self.llm_model_name):
+                self._chat = self.backend.open_chat(self._google_api_key, self.llm_model_name, self.system_instruction,
+                                                    self.history_turns)
+        return self._chat
+
+    def _record(self, user_question: str, message: str, answer: str):
+        input_tokens, cached_tokens = self._chat.last_usage
+        metrics.count(metrics.PROMPT_TOKENS, input_tokens)
+        self.usage.turns += 1
+        self.usage.input_tokens += input_tokens
+        self.usage.cached_tokens += cached_tokens
+        self.usage.question_tokens += estimate_tokens(message)
+        self.transcript.append((user_question, answer))
+
+    def _message(self, user_question: str) -> str:
+        return "\n".join(format_qa_question(user_question, retrieve_rules(user_question) if self.grounded else ()))
+
+    def ask(self, user_question: str) -> str:
+        if not self._google_api_key and self.backend.requires_api_key:
+            return "Google AI Studio API key not provided. Cannot answer question."
+        if not user_question:
+            return "No question asked."
+        with self._lock:
+            try:
+                message = self._message(user_question)
+                with metrics.span("llm.total", model=self.llm_model_name, streamed=False, session=True):
+                    answer = self._open().send(message, self.max_output_tokens)
+            except Exception as e:
+                logger.error("Error answering question (Q&A session): %s", e)
+                return f"Error answering question: {e}"
+            metrics.count(metrics.RESPONSE_TOKENS, estimate_tokens(answer))
+            self._record(user_question, message, answer)
+            return answer
+
+    def stream(self, user_question: str) -> Iterator[str]:
+        if not self._google_api_key and self.backend.requires_api_key:
+            yield "Google AI Studio API key not provided. Cannot answer question."
+            return
+        if not user_question:
+            yield "No question asked."
+            return
+        with self._lock:
+            chunks = []
+            try:
+                message = self._message(user_question)
+                chat = self._open()
+                for chunk in metrics.timed_stream(chat.send_stream(message, self.max_output_tokens),
+                                                  model=self.llm_model_name, session=True):
+                    chunks.append(chunk)
+                    yield chunk
+            except Exception as e:
+                logger.error("Error answering question (Q&A session, streaming): %s", e)
+                yield f"\n\nError answering question: {e}"
+                return
+            self._record(user_question, message, "".join(chunks))
+
+    def close(self):
+        """Releases the chat (and deletes its Gemini context cache, if one was created)."""
+        with self._lock:
+            if self._chat is not None:
+                self._chat.close()
+                self._chat = None
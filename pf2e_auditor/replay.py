@@ -0,0 +1,122 @@
+# pf2e_auditor/replay.py
+# Offline LLM backends for benchmarks and tests (see llm.set_llm_backend).
+#
+# ReplayBackend answers from recorded responses instead of calling Gemini,
+# with configurable latency: a time to first token, then chunks at a fixed
+# tokens-per-second rate, so streaming and the background combat job behave
+# like a live call. RecordingBackend wraps the real backend and appends every
+# response to a JSONL file that ReplayBackend can load.
+#
+# Recorded-response file format, one JSON object per line:
+#   {"kind": "combat" | "qa", "prompt_sha256": "...", "response": "..."}
+# An entry with a prompt_sha256 is replayed for that exact prompt; otherwise it
+# is the response for every prompt of its kind.
+
+import hashlib
+import json
+import threading
+import time
+from typing import Callable, Dict, Iterable, Iterator, List, Optional
+
+from .llm import LLMBackend, GeminiBackend, QA_INSTRUCTIONS
+from .prompt_context import CHARS_PER_TOKEN
+
+COMBAT = "combat"
+QA = "qa"
+
+DEFAULT_REPLAY_RESPONSE = "Suggestion: Strike twice, then Raise a Shield.\nSuggestion: Cast your highest-rank damage spell."
+
+
+def prompt_kind(prompt: str) -> str:
+    """Which prompt builder in llm produced this prompt."""
+    return QA if prompt.startswith(QA_INSTRUCTIONS[0]) else COMBAT
+
+
+def _prompt_sha256(prompt: str) -> str:
+    return hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+
+
+def load_recorded_responses(path: str) -> List[Dict[str, str]]:
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+class ReplayBackend(LLMBackend):
+    """
+    Replays recorded responses. ttft_seconds is slept before the first chunk (and before
+    a non-streamed response); the rest of the text follows at tokens_per_second, in
+    chunks of chunk_tokens. Thread-safe; counts calls per prompt kind.
+    """
+
+    def __init__(self, responses: Iterable[Dict[str, str]] = (), ttft_seconds: float = 0.0,
+                 tokens_per_second: float = 0.0, chunk_tokens: int = 16,
+                 default_response: str = DEFAULT_REPLAY_RESPONSE, sleep: Callable[[float], None] = time.sleep):
+        self.ttft_seconds = ttft_seconds
+        self.tokens_per_second = tokens_per_second # 0: the whole response arrives with the first token
+        self.chunk_tokens = chunk_tokens
+        self.default_response = default_response
+        self._sleep = sleep
+        self._by_prompt: Dict[str, str] = {}
+        self._by_kind: Dict[str, str] = {}
+        for entry in responses:
+            if entry.get("prompt_sha256"):
+                self._by_prompt[entry["prompt_sha256"]] = entry["response"]
+            else:
+                self._by_kind[entry.get("kind", COMBAT)] = entry["response"]
+        self._lock = threading.Lock()
+        self.calls: Dict[str, int] = {COMBAT: 0, QA: 0}
+
+    @classmethod
+    def from_file(cls, path: str, **kwargs) -> "ReplayBackend":
+        return cls(load_recorded_responses(path), **kwargs)
+
+    def response_for(self, prompt: str) -> str:
+        kind = prompt_kind(prompt)
+        with self._lock:
+            self.calls[kind] += 1
+        return self._by_prompt.get(_prompt_sha256(prompt)) or self._by_kind.get(kind) or self.default_response
+
+    def _chunks(self, text: str) -> List[str]:
+        size = max(self.chunk_tokens * CHARS_PER_TOKEN, 1)
+        return [text[i:i + size] for i in range(0, len(text), size)] or [""]
+
+    def generate(self, prompt: str, google_api_key: str, llm_model_name: str, max_output_tokens: int) -> str:
+        text = self.response_for(prompt)
+        self._sleep(self.ttft_seconds)
+        if self.tokens_per_second > 0:
+            self._sleep(len(text) / CHARS_PER_TOKEN / self.tokens_per_second)
+        return text
+
+    def stream(self, prompt: str, google_api_key: str, llm_model_name: str, max_output_tokens: int) -> Iterator[str]:
+        self._sleep(self.ttft_seconds)
+        delay = self.chunk_tokens / self.tokens_per_second if self.tokens_per_second > 0 else 0.0
+        for i, chunk in enumerate(self._chunks(self.response_for(prompt))):
+            if i and delay:
+                self._sleep(delay)
+            yield chunk
+
+
+class RecordingBackend(LLMBackend):
+    """Passes calls to inner (Gemini by default) and appends each complete response to a JSONL file."""
+
+    def __init__(self, path: str, inner: Optional[LLMBackend] = None):
+        self.path = path
+        self.inner = inner or GeminiBackend()
+        self._lock = threading.Lock()
+
+    def _record(self, prompt: str, response: str):
+        entry = {"kind": prompt_kind(prompt), "prompt_sha256": _prompt_sha256(prompt), "response": response}
+        with self._lock, open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+    def generate(self, prompt: str, google_api_key: str, llm_model_name: str, max_output_tokens: int) -> str:
+        text = self.inner.generate(prompt, google_api_key, llm_model_name, max_output_tokens)
+        self._record(prompt, text)
+        return text
+
+    def stream(self, prompt: str, google_api_key: str, llm_model_name: str, max_output_tokens: int) -> Iterator[str]:
+        chunks = []
+        for chunk in self.inner.stream(prompt, google_api_key, llm_model_name, max_output_tokens):
+            chunks.append(chunk)
+            yield chunk
+        self._record(prompt, "".join(chunks))
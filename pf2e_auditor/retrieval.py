@@ -0,0 +1,288 @@
+# pf2e_auditor/retrieval.py
+# Offline rules retrieval (BM25) and question-relevant character sections for Q&A.
+#
+# The Q&A prompt used to lean on the model's general Pathfinder 2e knowledge
+# and send the whole character summary whatever was asked. For each question,
+# ground_question() now picks:
+#
+# - the top-k passages of a local rules corpus, ranked by BM25 over an
+#   inverted index built once per process (no network, no embeddings);
+# - only the character sections (see prompt_context) that name an item
+#   mentioned in the question, or whose topic it asks about ("my spells",
+#   "my weapons"). A question that matches no section keeps them all.
+#
+# The corpus is every *.jsonl, *.md and *.txt file under the configured paths:
+#   *.jsonl  one passage per line: {"id": "...", "title": "...", "text": "...", "source": "..."}
+#   *.md     one passage per heading (the heading is the title)
+#   *.txt    one passage per blank-line-separated paragraph
+#
+# Configuration (environment variables):
+#   PF2E_RULES_CORPUS      corpus files/directories, separated by os.pathsep (default: rules_corpus/ in the repo)
+#   PF2E_RULES_TOP_K       passages per question (default 3)
+#   PF2E_RULES_DISABLED    set to "1" to turn rules retrieval off
+
+import glob
+import json
+import logging
+import math
+import os
+import re
+import threading
+from collections import Counter
+from dataclasses import dataclass
+from typing import Dict, FrozenSet, Iterable, List, Optional, Sequence, Tuple
+
+from .models import Build
+from .prompt_context import get_prompt_context, unique_names
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_CORPUS_PATH = os.path.join(REPO_ROOT, "rules_corpus")
+DEFAULT_TOP_K = int(os.environ.get("PF2E_RULES_TOP_K", "3"))
+# Passages scoring under this fraction of the best hit are dropped: they usually share only a
+# generic word ("spell", "feat") with the question and would just lengthen the prompt.
+MIN_RELATIVE_SCORE = 0.5
+
+# Common English and question words that carry no rules meaning.
+STOPWORDS = frozenset("""
+a an and are as at be but by can could do does for from get got has have how i if in into is it its me my of on
+or so than that the their them then there these they this to too was we what when where which while who why will
+with would you your yours should much many any some more most about after before again also just only other
+""".split())
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text: str) -> List[str]:
+    """Lower-cased word tokens without stopwords, with a light plural strip ("spells" -> "spell")."""
+    tokens = []
+    for token in _TOKEN_RE.findall(text.lower()):
+        if token in STOPWORDS:
+            continue
+        if len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+            token = token[:-1]
+        tokens.append(token)
+    return tokens
+
+
+@dataclass(frozen=True)
+class Passage:
+    id: str
+    title: str
+    text: str
+    source: str = ""
+
+    def render(self) -> str:
+        return f"[{self.title}] {self.text}"
+
+
+# --- Corpus loading ---
+
+def _passages_from_markdown(text: str, source: str) -> List[Passage]:
+    passages, title, body = [], "", []
+
+    def flush():
+        content = " ".join(line.strip() for line in body if line.strip())
+        if content:
+            passages.append(Passage(f"{source}#{len(passages)}", title or source, content, source))
+
+    for line in text.splitlines():
+        if line.startswith("#"):
+            flush()
+            title, body = line.lstrip("#").strip(), []
+        else:
+            body.append(line)
+    flush()
+    return passages
+
+
+def _passages_from_file(path: str) -> List[Passage]:
+    source = os.path.splitext(os.path.basename(path))[0]
+    with open(path, "r", encoding="utf-8") as f:
+        text = f.read()
+    if path.endswith(".jsonl"):
+        passages = []
+        for n, line in enumerate(text.splitlines()):
+            if line.strip():
+                entry = json.loads(line)
+                passages.append(Passage(entry.get("id") or f"{source}#{n}", entry.get("title", ""), entry["text"],
+                                        entry.get("source", source)))
+        return passages
+    if path.endswith(".md"):
+        return _passages_from_markdown(text, source)
+    paragraphs = [" ".join(p.split()) for p in re.split(r"\n\s*\n", text)]
+    return [Passage(f"{source}#{n}", source, p, source) for n, p in enumerate(paragraphs) if p]
+
+
+def load_rules_corpus(paths: Iterable[str]) -> List[Passage]:
+    """Every passage under the given files/directories (missing paths are skipped)."""
+    passages = []
+    for path in paths:
+        if os.path.isdir(path):
+            files = sorted(f for ext in ("jsonl", "md", "txt") for f in glob.glob(os.path.join(path, "**", f"*.{ext}"), recursive=True))
+        else:
+            files = [path] if os.path.isfile(path) else []
+        for file_path in files:
+            try:
+                passages.extend(_passages_from_file(file_path))
+            except (OSError, ValueError, KeyError) as e:
+                logger.warning("Skipping rules corpus file %s: %s", file_path, e)
+    return passages
+
+
+# --- BM25 ---
+
+class BM25Index:
+    """
+    Okapi BM25 over an inverted index (term -> [(passage number, term frequency)]).
+    Title words count twice, so a passage named after the asked-about rule ranks first.
+    """
+
+    def __init__(self, passages: Sequence[Passage], k1: float = 1.2, b: float = 0.75):
+        self.passages: Tuple[Passage, ...] = tuple(passages)
+        self.k1 = k1
+        self.b = b
+        self.postings: Dict[str, List[Tuple[int, int]]] = {}
+        self.lengths: List[int] = []
+        for n, passage in enumerate(self.passages):
+            tokens = tokenize(passage.title) * 2 + tokenize(passage.text)
+            self.lengths.append(len(tokens))
+            for term, tf in Counter(tokens).items():
+                self.postings.setdefault(term, []).append((n, tf))
+        self.avg_length = sum(self.lengths) / len(self.lengths) if self.lengths else 0.0
+        total = len(self.passages)
+        self.idf: Dict[str, float] = {term: math.log(1 + (total - len(docs) + 0.5) / (len(docs) + 0.5))
+                                      for term, docs in self.postings.items()}
+
+    def __len__(self) -> int:
+        return len(self.passages)
+
+    def search(self, query: str, k: int = DEFAULT_TOP_K, min_relative_score: float = 0.0) -> List[Tuple[Passage, float]]:
+        """
+        The k best-scoring passages for query, best first (only passages sharing a term with it
+        and scoring at least min_relative_score times the best score).
+        """
+        scores: Dict[int, float] = {}
+        for term in set(tokenize(query)):
+            idf = self.idf.get(term)
+            if idf is None:
+                continue
+            for n, tf in self.postings[term]:
+                norm = self.k1 * (1 - self.b + self.b * self.lengths[n] / self.avg_length)
+                scores[n] = scores.get(n, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+        cutoff = ranked[0][1] * min_relative_score if ranked else 0.0
+        return [(self.passages[n], score) for n, score in ranked[:k] if score >= cutoff]
+
+
+_default_index: Optional[BM25Index] = None
+_default_index_loaded = False
+_default_index_lock = threading.Lock()
+
+
+def get_rules_index() -> Optional[BM25Index]:
+    """The process-wide index of the configured corpus, built on first use. None when disabled or empty."""
+    global _default_index, _default_index_loaded
+    if os.environ.get("PF2E_RULES_DISABLED") == "1":
+        return None
+    with _default_index_lock:
+        if not _default_index_loaded:
+            paths = os.environ.get("PF2E_RULES_CORPUS", DEFAULT_CORPUS_PATH).split(os.pathsep)
+            with metrics.span("retrieval.load_corpus") as attrs:
+                passages = load_rules_corpus(p for p in paths if p)
+                attrs["passages"] = len(passages)
+                _default_index = BM25Index(passages) if passages else None
+            _default_index_loaded = True
+        return _default_index
+
+
+def set_rules_index(index: Optional[BM25Index]):
+    """Replaces the process-wide index (e.g. with one over a test corpus). None: no rules retrieval."""
+    global _default_index, _default_index_loaded
+    with _default_index_lock:
+        _default_index, _default_index_loaded = index, True
+
+
+# --- Character sections ---
+
+# Prompt section (or per-caster prefix) -> question words that ask about the whole section.
+SECTION_TOPICS: Dict[str, FrozenSet[str]] = {
+    name: frozenset(tokenize(words)) for name, words in {
+        "feats": "feat feats dedication archetype",
+        "specials": "feature features class ability abilities",
+        "weapons": "weapon weapons strike strikes attack attacks damage melee ranged",
+        "armor": "armor ac shield defense",
+        "focus_spells": "focus refocus",
+        "spellcasting": "spell spells cast casting slot slots cantrip cantrips rank heighten",
+        "innate_spellcasting": "innate",
+    }.items()
+}
+
+
+def _section_items(build: Build) -> Dict[str, List[str]]:
+    """Names shown in each prompt section (same section names as PromptContext.from_build)."""
+    items = {
+        "feats": [feat.name for feat in build.feat_index.selected_up_to_level(build.level)],
+        "specials": list(build.specials),
+        "weapons": [weapon.display for weapon in build.weapons],
+        "armor": [armor.display for armor in build.armor if armor.worn],
+        "focus_spells": list(get_prompt_context(build).focus_spells),
+    }
+    for i, sc in enumerate(build.spellCasters):
+        kind = "innate_spellcasting" if sc.innate else "spellcasting"
+        items[f"{kind}:{i}"] = [sc.name] + [spell for entry in sc.spells for spell in entry.list_of_spells]
+    return {name: unique_names(values) for name, values in items.items()}
+
+
+def _mentions(item: str, question_tokens: FrozenSet[str]) -> bool:
+    """Whether the question names the item: every word of its name (minus any parenthetical) appears in it."""
+    words = tokenize(item.split("(")[0])
+    return bool(words) and all(word in question_tokens for word in words)
+
+
+def relevant_sections(build: Build, question: str) -> Optional[Tuple[str, ...]]:
+    """
+    Names of the prompt sections the question is about: identity, plus sections naming an item the
+    question mentions or whose topic it asks about. None (keep everything) if nothing matched.
+    """
+    question_tokens = frozenset(tokenize(question))
+    items = _section_items(build)
+    selected = []
+    for section in get_prompt_context(build).sections:
+        topic = SECTION_TOPICS.get(section.name.split(":")[0], frozenset())
+        if topic & question_tokens or any(_mentions(item, question_tokens) for item in items.get(section.name, ())):
+            selected.append(section.name)
+    if not selected:
+        return None
+    return ("identity",) + tuple(name for name in selected if name != "identity")
+
+
+# --- Grounding ---
+
+@dataclass(frozen=True)
+class QAGrounding:
+    passages: Tuple[Passage, ...] = ()            # Rules passages to quote, best first
+    sections: Optional[Tuple[str, ...]] = None    # Character sections to include (None: all)
+
+
+def retrieve_rules(question: str, top_k: Optional[int] = None, index: Optional[BM25Index] = None) -> Tuple[Passage, ...]:
+    """The top_k rules passages for a question (none if no corpus is configured)."""
+    index = index if index is not None else get_rules_index()
+    if index is None or not question:
+        return ()
+    with metrics.span("retrieval.rules") as attrs:
+        hits = index.search(question, DEFAULT_TOP_K if top_k is None else top_k, MIN_RELATIVE_SCORE)
+        attrs["hits"] = len(hits)
+    return tuple(passage for passage, _ in hits)
+
+
+def ground_question(build: Build, question: str, top_k: Optional[int] = None,
+                    index: Optional[BM25Index] = None) -> QAGrounding:
+    """The rules passages and character sections to send with a Q&A question."""
+    passages = retrieve_rules(question, top_k, index)
+    with metrics.span("retrieval.sections") as attrs:
+        sections = relevant_sections(build, question)
+        attrs["sections"] = "all" if sections is None else len(sections)
+    return QAGrounding(passages, sections)
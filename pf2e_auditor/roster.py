@@ -0,0 +1,313 @@
+# pf2e_auditor/roster.py
+# Columnar, vectorized audits over many characters (league dashboards).
+#
+# Looping check_unspent_gold / check_equipment_runes / check_missing_feat_slots
+# over tens of thousands of sheets spends most of its time in per-object
+# Python. A Roster instead holds one NumPy array per field: one row per
+# character, plus flat per-item arrays for weapons and armor with an `owner`
+# column pointing back at the character row. The vectorized checks mirror the
+# per-character logic in checks.py (same thresholds from rules.py) and return
+# boolean flag arrays, which the report functions aggregate.
+#
+# Usage:
+#   python -m pf2e_auditor.roster characters/ "league/**/*.json" -j 8 > report.json
+
+import argparse
+import json
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, List, Optional
+
+import numpy as np
+
+from .models import Build
+from .rules import (
+    MAX_LEVEL, RUNES_BY_LEVEL, STRIKING_RANKS, RESILIENCY_RANKS, HIGH_GOLD_FACTOR, LOW_GOLD_FACTOR,
+    expected_feat_counts,
+)
+
+FEAT_KINDS = ("ancestry", "general", "class", "free_archetype")
+
+
+def roster_row(build: Build) -> Dict[str, Any]:
+    """The handful of scalars and per-item lists a Roster needs from one Build (small and picklable)."""
+    feat_index = build.feat_index
+    return {
+        "name": build.name,
+        "class_name": build.class_name.lower(),
+        "level": build.level,
+        "total_gp": build.money.total_in_gp(),
+        # (potency or 0, has striking rune, striking rank, property rune count)
+        "weapons": [(w.pot or 0, bool(w.str_rune), STRIKING_RANKS.get(w.str_rune, 0), len(w.runes)) for w in build.weapons],
+        # Only worn armor is audited
+        "armor": [(a.pot or 0, bool(a.res), RESILIENCY_RANKS.get(a.res, 0), len(a.runes)) for a in build.armor if a.worn],
+        "placeholders": len(feat_index.placeholders),
+        "ancestry_feats": feat_index.ancestry_slot_count,
+        "general_feats": feat_index.category_count("General Feat"),
+        "class_feats": feat_index.category_count("Class Feat"),
+        "archetype_feats": feat_index.category_count("Archetype Feat"),
+        "free_archetype_active": build.free_archetype_active,
+    }
+
+
+def _items(rows: List[Dict[str, Any]], key: str) -> Dict[str, np.ndarray]:
+    owners, pots, has_rune, ranks, rune_counts = [], [], [], [], []
+    for i, row in enumerate(rows):
+        for pot, has, rank, count in row[key]:
+            owners.append(i)
+            pots.append(pot)
+            has_rune.append(has)
+            ranks.append(rank)
+            rune_counts.append(count)
+    return {
+        "owner": np.array(owners, dtype=np.int64),
+        "pot": np.array(pots, dtype=np.int16),
+        "has_rune": np.array(has_rune, dtype=bool),
+        "rank": np.array(ranks, dtype=np.int8),
+        "rune_count": np.array(rune_counts, dtype=np.int16),
+    }
+
+
+@dataclass
+class Roster:
+    """Column arrays for many characters. Per-character arrays are indexed by row; item arrays by item."""
+    names: np.ndarray
+    class_names: np.ndarray
+    levels: np.ndarray
+    total_gp: np.ndarray
+    placeholders: np.ndarray
+    feat_counts: Dict[str, np.ndarray] # "ancestry"/"general"/"class"/"archetype" -> actual counts
+    free_archetype_active: np.ndarray
+    weapons: Dict[str, np.ndarray] # owner, pot, has_rune (striking), rank, rune_count
+    armor: Dict[str, np.ndarray]   # same columns, resiliency instead of striking; worn armor only
+
+    @classmethod
+    def from_rows(cls, rows: Iterable[Dict[str, Any]]) -> "Roster":
+        rows = list(rows)
+        return cls(
+            names=np.array([row["name"] for row in rows], dtype=object),
+            class_names=np.array([row["class_name"] for row in rows], dtype=object),
+            levels=np.array([row["level"] for row in rows], dtype=np.int16),
+            total_gp=np.array([row["total_gp"] for row in rows], dtype=np.float64),
+            placeholders=np.array([row["placeholders"] for row in rows], dtype=np.int16),
+            feat_counts={
+                kind: np.array([row[f"{kind}_feats"] for row in rows], dtype=np.int16)
+                for kind in ("ancestry", "general", "class", "archetype")
+            },
+            free_archetype_active=np.array([row["free_archetype_active"] for row in rows], dtype=bool),
+            weapons=_items(rows, "weapons"),
+            armor=_items(rows, "armor"),
+        )
+
+    @classmethod
+    def from_builds(cls, builds: Iterable[Build]) -> "Roster":
+        return cls.from_rows(roster_row(build) for build in builds)
+
+    def __len__(self) -> int:
+        return len(self.levels)
+
+
+# --- Level-indexed lookup arrays (from the same tables the per-character checks use) ---
+
+def _rune_column(key: str) -> np.ndarray:
+    return np.array([row[key] for row in RUNES_BY_LEVEL], dtype=np.int16)
+
+WEAPON_POTENCY_BY_LEVEL = _rune_column("weapon_potency")
+WEAPON_STRIKING_RANK_BY_LEVEL = _rune_column("weapon_striking_rank")
+ARMOR_POTENCY_BY_LEVEL = _rune_column("armor_potency")
+ARMOR_RESILIENCY_RANK_BY_LEVEL = _rune_column("armor_resiliency_rank")
+
+
+def _table_levels(levels: np.ndarray) -> np.ndarray:
+    return np.clip(levels, 0, MAX_LEVEL)
+
+
+def _any_per_owner(item_flags: np.ndarray, owners: np.ndarray, n: int) -> np.ndarray:
+    return np.bincount(owners[item_flags], minlength=n) > 0
+
+
+# --- Vectorized checks ---
+
+def unspent_gold_flags(roster: Roster, gold_threshold_factor: int = HIGH_GOLD_FACTOR) -> Dict[str, np.ndarray]:
+    """Per-character "high" / "low" unspent gold flags, matching check_unspent_gold."""
+    levels = roster.levels.astype(np.float64)
+    high = roster.total_gp > levels * gold_threshold_factor
+    low = (roster.levels > 1) & (roster.total_gp < levels * LOW_GOLD_FACTOR)
+    return {"high": high, "low": low}
+
+
+def _fundamental_rune_flags(items: Dict[str, np.ndarray], item_levels: np.ndarray,
+                            potency_by_level: np.ndarray, rank_by_level: np.ndarray) -> Dict[str, np.ndarray]:
+    table_levels = _table_levels(item_levels)
+    pot = items["pot"]
+    has_potency = pot > 0
+    return {
+        "missing_potency": ~has_potency,
+        "low_potency": has_potency & (pot < potency_by_level[table_levels]),
+        "missing_rune": has_potency & ~items["has_rune"],
+        "low_rune": has_potency & items["has_rune"] & (items["rank"] < rank_by_level[table_levels]),
+        "open_property_slots": has_potency & (items["rune_count"] < pot),
+    }
+
+
+def equipment_rune_flags(roster: Roster) -> Dict[str, Dict[str, np.ndarray]]:
+    """
+    Item-level flags for weapons and worn armor, matching check_equipment_runes:
+    {"weapons": {...}, "armor": {...}}, each with missing_potency, low_potency, missing_rune
+    (striking / resiliency), low_rune and open_property_slots, aligned with roster.weapons / roster.armor.
+    """
+    return {
+        "weapons": _fundamental_rune_flags(roster.weapons, roster.levels[roster.weapons["owner"]],
+                                           WEAPON_POTENCY_BY_LEVEL, WEAPON_STRIKING_RANK_BY_LEVEL),
+        "armor": _fundamental_rune_flags(roster.armor, roster.levels[roster.armor["owner"]],
+                                         ARMOR_POTENCY_BY_LEVEL, ARMOR_RESILIENCY_RANK_BY_LEVEL),
+    }
+
+
+def _expected_feat_counts(roster: Roster) -> Dict[str, np.ndarray]:
+    # Group by (class, level) so the table lookup runs once per distinct pair, not per character.
+    pairs, inverse = np.unique(
+        np.stack([roster.class_names.astype(str), roster.levels.astype(str)], axis=1).reshape(-1, 2),
+        axis=0, return_inverse=True)
+    inverse = inverse.reshape(-1)
+    expected = {}
+    for kind in FEAT_KINDS:
+        per_pair = np.array([expected_feat_counts(class_name, int(level))[kind] for class_name, level in pairs], dtype=np.int16)
+        expected[kind] = per_pair[inverse]
+    return expected
+
+
+def missing_feat_flags(roster: Roster) -> Dict[str, np.ndarray]:
+    """Per-character flags matching check_missing_feat_slots (count checks only apply without placeholders)."""
+    expected = _expected_feat_counts(roster)
+    counts = roster.feat_counts
+    fa = roster.free_archetype_active
+    has_placeholders = roster.placeholders > 0
+    no_placeholders = ~has_placeholders
+    return {
+        "unselected_slots": has_placeholders,
+        "ancestry_short": no_placeholders & (counts["ancestry"] < expected["ancestry"]),
+        "general_short": no_placeholders & (counts["general"] < expected["general"]),
+        "class_short": no_placeholders & (counts["class"] < expected["class"]),
+        "free_archetype_short": no_placeholders & fa & (counts["archetype"] < expected["free_archetype"]),
+        "archetype_without_free_archetype": no_placeholders & ~fa & (counts["archetype"] > 0),
+    }
+
+
+def character_flags(roster: Roster) -> Dict[str, np.ndarray]:
+    """All per-character boolean flags, one array per flag, aligned with roster rows."""
+    n = len(roster)
+    flags = {f"gold_{name}": values for name, values in unspent_gold_flags(roster).items()}
+    for kind, item_flags in equipment_rune_flags(roster).items():
+        owners = getattr(roster, kind)["owner"]
+        for name, values in item_flags.items():
+            flags[f"{kind}_{name}"] = _any_per_owner(values, owners, n)
+    flags.update({f"feats_{name}": values for name, values in missing_feat_flags(roster).items()})
+    return flags
+
+
+# --- Aggregate reports ---
+
+def _rate(mask: np.ndarray) -> float:
+    return float(mask.mean()) if mask.size else 0.0
+
+
+def unspent_gold_report(roster: Roster) -> Dict[str, Any]:
+    """Unspent gold distribution per level (count, mean, median, p90) plus high/low flag rates."""
+    flags = unspent_gold_flags(roster)
+    by_level = {}
+    for level in np.unique(roster.levels):
+        gp = roster.total_gp[roster.levels == level]
+        by_level[int(level)] = {
+            "count": int(gp.size),
+            "mean_gp": float(gp.mean()),
+            "median_gp": float(np.median(gp)),
+            "p90_gp": float(np.percentile(gp, 90)),
+            "high_rate": _rate(flags["high"][roster.levels == level]),
+        }
+    return {"high_rate": _rate(flags["high"]), "low_rate": _rate(flags["low"]), "by_level": by_level}
+
+
+def equipment_rune_report(roster: Roster) -> Dict[str, float]:
+    """Fraction of characters with at least one weapon / worn armor below the recommended fundamental runes."""
+    flags = character_flags(roster)
+    return {
+        "under_potency_rate": _rate(flags["weapons_missing_potency"] | flags["weapons_low_potency"]
+                                    | flags["armor_missing_potency"] | flags["armor_low_potency"]),
+        "under_striking_rate": _rate(flags["weapons_missing_rune"] | flags["weapons_low_rune"]),
+        "under_resiliency_rate": _rate(flags["armor_missing_rune"] | flags["armor_low_rune"]),
+        "open_property_slots_rate": _rate(flags["weapons_open_property_slots"] | flags["armor_open_property_slots"]),
+    }
+
+
+def missing_feat_report(roster: Roster) -> Dict[str, Dict[str, Any]]:
+    """Per class: character count and the rate of each missing-feat flag (plus "any")."""
+    flags = missing_feat_flags(roster)
+    any_flag = np.logical_or.reduce(list(flags.values())) if len(roster) else np.zeros(0, dtype=bool)
+    classes, inverse = np.unique(roster.class_names.astype(str), return_inverse=True)
+    totals = np.bincount(inverse, minlength=len(classes))
+    report = {}
+    for i, class_name in enumerate(classes):
+        rates = {name: float(np.bincount(inverse[values], minlength=len(classes))[i] / totals[i]) for name, values in flags.items()}
+        rates["any"] = float(np.bincount(inverse[any_flag], minlength=len(classes))[i] / totals[i])
+        report[str(class_name)] = {"count": int(totals[i]), "rates": rates}
+    return report
+
+
+def roster_report(roster: Roster) -> Dict[str, Any]:
+    """The league-wide summary used by dashboards and the CLI."""
+    return {
+        "characters": len(roster),
+        "unspent_gold": unspent_gold_report(roster),
+        "equipment_runes": equipment_rune_report(roster),
+        "missing_feats_by_class": missing_feat_report(roster),
+    }
+
+
+# --- Loading from files ---
+
+def _roster_row_from_file(path: str) -> Optional[Dict[str, Any]]:
+    from .sheet_cache import parse_sheet_bytes
+    try:
+        with open(path, "rb") as f:
+            return roster_row(parse_sheet_bytes(f.read()).build)
+    except Exception:
+        return None # Unreadable sheets are skipped; the batch auditor reports them individually
+
+
+def load_roster(paths: Iterable[str], max_workers: Optional[int] = None) -> Roster:
+    """Parses sheets on a process pool (workers return only roster rows) and builds a Roster."""
+    paths = list(paths)
+    if max_workers == 1 or len(paths) <= 1:
+        rows = [_roster_row_from_file(path) for path in paths]
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            rows = list(executor.map(_roster_row_from_file, paths, chunksize=64))
+    return Roster.from_rows(row for row in rows if row is not None)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    from .batch import expand_inputs
+
+    parser = argparse.ArgumentParser(
+        prog="python -m pf2e_auditor.roster",
+        description="Print league-wide audit statistics (JSON) for a directory or glob of Pathbuilder exports.",
+    )
+    parser.add_argument("inputs", nargs="+", help="Directories, files, or glob patterns (quote globs to avoid shell expansion).")
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="Worker processes (default: CPU count).")
+    args = parser.parse_args(argv)
+
+    paths = expand_inputs(args.inputs)
+    if not paths:
+        print("No JSON files matched the given inputs.", file=sys.stderr)
+        return 1
+    roster = load_roster(paths, max_workers=args.jobs)
+    json.dump(roster_report(roster), sys.stdout, indent=2)
+    sys.stdout.write("\n")
+    print(f"Summarized {len(roster)} of {len(paths)} character file(s).", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,403 @@
+# pf2e_auditor/router.py
+# "auto" model routing: the fastest Gemini model that is good enough for a request.
+#
+# With one fixed model, a one-line lookup ("what's my AC rune?") pays a pro
+# model's multi-second latency. When the model is AUTO_MODEL, each request is
+# routed instead:
+#
+# - classify_request() rates it SIMPLE, STANDARD or COMPLEX from its kind and
+#   size. Combat planning is rated from the character (CombatSignals): COMPLEX
+#   for several spellcasting entries, rank 7+ spell slots, or a very long spell
+#   or feat list; otherwise STANDARD. Calibrated on characters/melon.json (a
+#   level 10 sorcerer, one spellcasting entry up to rank 5: STANDARD) and
+#   bench.synthetic_sheet() (the level 20, four-caster, 300-feat default:
+#   COMPLEX; level 1 and level 5 variants with few spells: STANDARD). Without a character it falls back to prompt
+#   size: melon's combat prompt is ~320 estimated tokens, the synthetic
+#   sheet's ~4150. A Q&A question is
+#   SIMPLE when it is a short lookup, STANDARD when it asks for advice or comes
+#   with a large prompt, and COMPLEX only when it asks to plan a fight.
+#   Conversation-mode chats are STANDARD (one model for the whole chat).
+# - each complexity has a minimum tier (lite, flash, pro). route() picks the
+#   model of that tier with the lowest p50 latency, and only moves to a higher
+#   tier (never a lower one: quality is the floor) when the model's p95 is over
+#   the complexity's latency target and a higher-tier model's p95 is lower.
+# - every uncached Gemini call records its latency (excluding scheduler queue
+#   wait) per model and request kind in a LatencyTracker, persisted to a local
+#   SQLite file so measurements survive restarts. Samples are written behind,
+#   in batches on one background thread, never on the request path. p50/p95 are computed over the
+#   most recent samples; a model with too few samples uses its tier's prior.
+#
+# Configuration (environment variables):
+#   PF2E_LATENCY_PATH       database file (default: ~/.cache/pf2e_auditor/latency.sqlite3)
+#   PF2E_LATENCY_DISABLED   set to "1" to keep latency samples in memory only
+#   PF2E_ROUTER_MODELS      tier models, e.g. "lite=gemini-2.0-flash-lite;flash=gemini-2.0-flash;pro=gemini-2.5-pro-preview-05-06"
+
+import collections
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Deque, Dict, List, Optional, Sequence, Tuple
+
+from .models import Build
+from .feat_index import is_placeholder_feat
+from .prompt_context import estimate_tokens, get_prompt_context
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+AUTO_MODEL = "auto"
+
+DEFAULT_LATENCY_PATH = os.path.join(os.path.expanduser("~"), ".cache", "pf2e_auditor", "latency.sqlite3")
+MAX_SAMPLES = 200 # Most recent samples kept per (model, kind)
+MIN_SAMPLES = 5   # Below this, a model's latency is its tier's prior
+
+# Request kinds
+COMBAT = "combat"
+QA = "qa"
+CHAT = "chat"
+
+# Complexities
+SIMPLE = "simple"
+STANDARD = "standard"
+COMPLEX = "complex"
+
+# Tiers, cheapest and fastest first
+LITE = "lite"
+FLASH = "flash"
+PRO = "pro"
+TIERS: Tuple[str, ...] = (LITE, FLASH, PRO)
+
+DEFAULT_TIER_MODELS: Dict[str, Tuple[str, ...]] = {
+    LITE: ("gemini-2.0-flash-lite",),
+    FLASH: ("gemini-2.5-flash-preview-05-20", "gemini-2.0-flash"),
+    PRO: ("gemini-2.5-pro-preview-05-06",),
+}
+COMPLEXITY_TIERS: Dict[str, str] = {SIMPLE: LITE, STANDARD: FLASH, COMPLEX: PRO}
+# p95 latency (seconds) above which a request may move up a tier, if that is faster. COMPLEX never moves.
+P95_TARGETS: Dict[str, float] = {SIMPLE: 4.0, STANDARD: 12.0, COMPLEX: float("inf")}
+# (p50, p95) seconds assumed for a model with fewer than MIN_SAMPLES samples.
+TIER_PRIORS: Dict[str, Tuple[float, float]] = {LITE: (1.5, 3.0), FLASH: (3.0, 8.0), PRO: (12.0, 30.0)}
+
+# Combat planning is COMPLEX at any of these (see CombatSignals and the calibration in the module comment).
+COMPLEX_COMBAT_SPELLCASTERS = 2   # Spellcasting entries with slots (innate ones don't count)
+COMPLEX_COMBAT_SPELL_RANK = 7     # Highest rank with slots: level 13+ full casters
+COMPLEX_COMBAT_SPELLS = 40        # Spells known or prepared, plus focus spells
+COMPLEX_COMBAT_FEATS = 60         # Selected feats; a level 20 character with Free Archetype has ~45
+COMPLEX_COMBAT_PROMPT_TOKENS = 2000 # Fallback without a character
+LARGE_QA_PROMPT_TOKENS = 1500
+LONG_QUESTION_WORDS = 15
+
+# Question words that ask for judgement rather than a lookup, for a plan, and for a fight.
+ADVICE_TERMS = frozenset("""
+should best better worst optimize optimise improve recommend recommendation suggest build retrain worth compare
+comparison versus vs why strategy strategies tactic tactics synergy synergies combo combos
+""".split())
+PLANNING_TERMS = frozenset("plan planning turn turns round rounds rotation sequence strategy strategies tactic tactics".split())
+FIGHT_TERMS = frozenset("combat fight fights fighting battle battles encounter encounters enemy enemies boss bosses monster monsters".split())
+
+_WORD_RE = re.compile(r"[a-z]+")
+
+
+@dataclass(frozen=True)
+class CombatSignals:
+    """What makes a character's turns hard to plan: how much spellcasting and how many feats it has."""
+    level: int
+    spellcasters: int   # Non-innate spellcasting entries with slots
+    spell_rank: int     # Highest rank with slots
+    spells: int         # Spells across all entries, plus focus spells
+    feats: int          # Selected (non-placeholder) feats
+
+    @classmethod
+    def from_build(cls, build: Build) -> "CombatSignals":
+        slotted = [caster for caster in build.spellCasters if not caster.innate and any(caster.perDay)]
+        spell_rank = max((rank for caster in slotted for rank, slots in enumerate(caster.perDay) if slots), default=0)
+        spells = sum(len(entry.list_of_spells) for caster in build.spellCasters for entry in caster.spells)
+        spells += len(get_prompt_context(build).focus_spells) # Serialized once per Build, like every prompt
+        feats = sum(1 for feat in build.feat_index.selected if not is_placeholder_feat(feat, feat.name.lower()))
+        return cls(build.level, len(slotted), spell_rank, spells, feats)
+
+    @property
+    def complex(self) -> bool:
+        return (self.spellcasters >= COMPLEX_COMBAT_SPELLCASTERS or self.spell_rank >= COMPLEX_COMBAT_SPELL_RANK
+                or self.spells >= COMPLEX_COMBAT_SPELLS or self.feats >= COMPLEX_COMBAT_FEATS)
+
+
+def classify_request(kind: str, prompt_tokens: int, question: str = "", signals: Optional[CombatSignals] = None) -> str:
+    """
+    SIMPLE, STANDARD or COMPLEX, from the request kind, the character's combat signals (or else the prompt
+    size) and, for Q&A, the question's wording.
+    """
+    if kind == COMBAT:
+        if signals is not None:
+            return COMPLEX if signals.complex else STANDARD
+        return COMPLEX if prompt_tokens >= COMPLEX_COMBAT_PROMPT_TOKENS else STANDARD
+    if kind != QA:
+        return STANDARD
+    words = _WORD_RE.findall(question.lower())
+    word_set = set(words)
+    if word_set & PLANNING_TERMS and word_set & FIGHT_TERMS:
+        return COMPLEX
+    if word_set & ADVICE_TERMS or len(words) > LONG_QUESTION_WORDS or prompt_tokens >= LARGE_QA_PROMPT_TOKENS:
+        return STANDARD
+    return SIMPLE
+
+
+def parse_tier_models(spec: str) -> Dict[str, Tuple[str, ...]]:
+    """Tier models from "lite=m1,m2;flash=m3;pro=m4". Tiers left out keep their defaults."""
+    tiers = dict(DEFAULT_TIER_MODELS)
+    for part in spec.split(";"):
+        tier, _, models = part.partition("=")
+        tier = tier.strip().lower()
+        names = tuple(name.strip() for name in models.split(",") if name.strip())
+        if tier in tiers and names:
+            tiers[tier] = names
+    return tiers
+
+
+# --- Latency ---
+
+@dataclass(frozen=True)
+class LatencyStats:
+    p50: float      # Seconds
+    p95: float
+    samples: int    # 0 for a prior
+
+
+def _percentile(sorted_values: Sequence[float], fraction: float) -> float:
+    """Nearest-rank percentile of already sorted values."""
+    rank = max(int(round(fraction * len(sorted_values) + 0.5)) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS latency_samples (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    model TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    seconds REAL NOT NULL,
+    recorded_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS latency_samples_model_kind ON latency_samples(model, kind, id);
+"""
+
+
+class LatencyStore:
+    """SQLite-backed latency samples, keeping the most recent max_samples per (model, kind)."""
+
+    def __init__(self, path: str = DEFAULT_LATENCY_PATH, max_samples: int = MAX_SAMPLES):
+        self.path = path
+        self.max_samples = max_samples
+        self._local = threading.local() # One connection per thread; sqlite3 connections aren't thread-safe
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._connect().executescript(_SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def add(self, llm_model_name: str, kind: str, seconds: float):
+        self.add_many([(llm_model_name, kind, seconds, time.time())])
+
+    def add_many(self, samples: Sequence[Tuple[str, str, float, float]]):
+        """Inserts (model, kind, seconds, recorded_at) samples in one transaction, then trims each pair."""
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany("INSERT INTO latency_samples(model, kind, seconds, recorded_at) VALUES (?, ?, ?, ?)", samples)
+            conn.executemany(
+                """DELETE FROM latency_samples WHERE model = ? AND kind = ? AND id NOT IN (
+                       SELECT id FROM latency_samples WHERE model = ? AND kind = ? ORDER BY id DESC LIMIT ?)""",
+                [(model, kind, model, kind, self.max_samples) for model, kind in {(s[0], s[1]) for s in samples}],
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def load(self) -> Dict[Tuple[str, str], List[float]]:
+        """(model, kind) -> samples, oldest first."""
+        samples: Dict[Tuple[str, str], List[float]] = {}
+        for model, kind, seconds in self._connect().execute(
+                "SELECT model, kind, seconds FROM latency_samples ORDER BY id"):
+            samples.setdefault((model, kind), []).append(seconds)
+        return samples
+
+
+class LatencyTracker:
+    """
+    Recent call latencies per (model, kind), in memory and optionally persisted to a LatencyStore. Thread-safe.
+    Persisting is write-behind: record() queues the sample, and one writer thread stores whatever is queued
+    in a single transaction (so a burst of calls costs one write). flush() waits for the queue to be stored.
+    """
+
+    def __init__(self, store: Optional[LatencyStore] = None, max_samples: int = MAX_SAMPLES):
+        self.store = store
+        self.max_samples = max_samples
+        self._samples: Dict[Tuple[str, str], Deque[float]] = {}
+        self._pending: List[Tuple[str, str, float, float]] = []
+        self._lock = threading.Lock()
+        self._writer: Optional[ThreadPoolExecutor] = None
+        self._write_scheduled = False
+        if store is not None:
+            for key, values in store.load().items():
+                self._samples[key] = collections.deque(values, maxlen=max_samples)
+
+    def record(self, llm_model_name: str, kind: str, seconds: float):
+        with self._lock:
+            self._samples.setdefault((llm_model_name, kind), collections.deque(maxlen=self.max_samples)).append(seconds)
+            if self.store is None:
+                return
+            self._pending.append((llm_model_name, kind, seconds, time.time()))
+            if self._write_scheduled: # The queued write will pick this sample up
+                return
+            self._write_scheduled = True
+            if self._writer is None:
+                self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="pf2e-latency")
+            writer = self._writer
+        writer.submit(self._write_pending)
+
+    def _write_pending(self):
+        with self._lock:
+            samples, self._pending, self._write_scheduled = self._pending, [], False
+        if samples:
+            try:
+                self.store.add_many(samples)
+            except sqlite3.Error as e:
+                logger.warning("Could not persist %d latency samples: %s", len(samples), e)
+
+    def flush(self):
+        """Stores every queued sample now (e.g. before exit or in tests)."""
+        with self._lock:
+            writer = self._writer
+        if writer is not None:
+            writer.submit(lambda: None).result() # The single writer runs queued writes in order
+        if self.store is not None:
+            self._write_pending()
+
+    def stats(self, llm_model_name: str, kind: Optional[str] = None) -> Optional[LatencyStats]:
+        """p50/p95 of the model's recent calls of this kind (of any kind if too few), or None below MIN_SAMPLES."""
+        with self._lock:
+            values = list(self._samples.get((llm_model_name, kind), ())) if kind is not None else []
+            if len(values) < MIN_SAMPLES:
+                values = [v for (model, _), samples in self._samples.items() if model == llm_model_name for v in samples]
+        if len(values) < MIN_SAMPLES:
+            return None
+        values.sort()
+        return LatencyStats(_percentile(values, 0.5), _percentile(values, 0.95), len(values))
+
+    def summary(self) -> Dict[Tuple[str, str], LatencyStats]:
+        """(model, kind) -> stats, for every pair with at least MIN_SAMPLES samples."""
+        with self._lock:
+            keys = [key for key, samples in self._samples.items() if len(samples) >= MIN_SAMPLES]
+        return {key: self.stats(*key) for key in sorted(keys)}
+
+
+_default_tracker: Optional[LatencyTracker] = None
+_default_tracker_lock = threading.Lock()
+
+
+def get_latency_tracker() -> LatencyTracker:
+    """The process-wide tracker, loading persisted samples on first use."""
+    global _default_tracker
+    with _default_tracker_lock:
+        if _default_tracker is None:
+            store = None
+            if os.environ.get("PF2E_LATENCY_DISABLED") != "1":
+                try:
+                    store = LatencyStore(os.environ.get("PF2E_LATENCY_PATH", DEFAULT_LATENCY_PATH))
+                except (OSError, sqlite3.Error) as e:
+                    logger.warning("Latency store unavailable, keeping samples in memory: %s", e)
+            _default_tracker = LatencyTracker(store)
+        return _default_tracker
+
+
+def set_latency_tracker(tracker: Optional[LatencyTracker]):
+    """Replaces the process-wide tracker (e.g. with an in-memory one in benchmarks). None: recreate on next use."""
+    global _default_tracker
+    with _default_tracker_lock:
+        _default_tracker = tracker
+
+
+# --- Routing ---
+
+@dataclass(frozen=True)
+class RouteDecision:
+    model: str
+    complexity: str
+    tier: str
+    expected: LatencyStats # Measured (samples > 0) or prior latency of the chosen model
+    reason: str
+
+
+class ModelRouter:
+    """Picks a concrete model for an "auto" request (see the module comment)."""
+
+    def __init__(self, tier_models: Optional[Dict[str, Tuple[str, ...]]] = None, tracker: Optional[LatencyTracker] = None):
+        self.tier_models = tier_models or parse_tier_models(os.environ.get("PF2E_ROUTER_MODELS", ""))
+        self._tracker = tracker
+
+    @property
+    def tracker(self) -> LatencyTracker:
+        return self._tracker or get_latency_tracker()
+
+    def expected_latency(self, llm_model_name: str, tier: str, kind: str) -> LatencyStats:
+        measured = self.tracker.stats(llm_model_name, kind)
+        if measured is not None:
+            return measured
+        p50, p95 = TIER_PRIORS[tier]
+        return LatencyStats(p50, p95, 0)
+
+    def _fastest(self, tier: str, kind: str) -> Optional[Tuple[str, LatencyStats]]:
+        candidates = [(model, self.expected_latency(model, tier, kind)) for model in self.tier_models.get(tier, ())]
+        return min(candidates, key=lambda c: (c[1].p50, c[1].p95)) if candidates else None
+
+    def route(self, kind: str, prompt: str, question: str = "", signals: Optional[CombatSignals] = None) -> RouteDecision:
+        with metrics.span("llm.route", kind=kind) as attrs:
+            complexity = classify_request(kind, estimate_tokens(prompt), question, signals)
+            floor = TIERS.index(COMPLEXITY_TIERS[complexity])
+            options = [(tier, best) for tier in TIERS[floor:] for best in [self._fastest(tier, kind)] if best is not None]
+            if not options:
+                raise ValueError("No models configured for auto routing")
+            tier, (model, expected) = options[0]
+            reason = f"{complexity} request: fastest {tier} model"
+            target = P95_TARGETS[complexity]
+            if expected.p95 > target:
+                faster = [option for option in options[1:] if option[1][1].p95 < expected.p95]
+                if faster:
+                    tier, (model, escalated) = min(faster, key=lambda option: option[1][1].p95)
+                    reason = (f"{complexity} request: {options[0][1][0]} p95 {expected.p95:.1f}s over the "
+                              f"{target:.0f}s target, {tier} model is faster")
+                    expected = escalated
+            attrs.update(complexity=complexity, tier=tier, model=model)
+        return RouteDecision(model, complexity, tier, expected, reason)
+
+
+_default_router: Optional[ModelRouter] = None
+_default_router_lock = threading.Lock()
+
+
+def get_model_router() -> ModelRouter:
+    global _default_router
+    with _default_router_lock:
+        if _default_router is None:
+            _default_router = ModelRouter()
+        return _default_router
+
+
+def resolve_model(llm_model_name: str, kind: str, prompt: str, question: str = "", build: Optional[Build] = None) -> str:
+    """The model to call: llm_model_name itself, or the routed model when it is AUTO_MODEL (build: the character)."""
+    if llm_model_name != AUTO_MODEL:
+        return llm_model_name
+    signals = CombatSignals.from_build(build) if build is not None and kind == COMBAT else None
+    return get_model_router().route(kind, prompt, question, signals).model
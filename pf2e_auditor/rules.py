@@ -0,0 +1,120 @@
+# pf2e_auditor/rules.py
+# Level-indexed rule tables used by the audit checks.
+#
+# Everything here is computed once at import from a few small threshold lists,
+# so the checks do a list index instead of rebuilding dicts or walking if/elif
+# ladders on every call. To change a rule (or add a class exception), edit the
+# threshold lists / overrides below; the tables are rebuilt from them.
+
+from types import MappingProxyType
+from typing import Dict, List, Mapping, Optional, Sequence, Tuple
+
+MAX_LEVEL = 20
+
+
+def table_level(level: int) -> int:
+    """Clamps a character level into the range covered by the tables (levels past 20 use the level-20 row)."""
+    return min(max(level, 0), MAX_LEVEL)
+
+
+def _value_at(level: int, thresholds: Sequence[Tuple[int, object]], default: object) -> object:
+    """Value of the highest threshold reached at this level (thresholds sorted ascending)."""
+    value = default
+    for min_level, threshold_value in thresholds:
+        if level >= min_level:
+            value = threshold_value
+    return value
+
+
+# --- Fundamental runes ---
+
+WEAPON_POTENCY_THRESHOLDS = [(2, 1), (10, 2), (16, 3)]
+WEAPON_STRIKING_THRESHOLDS = [(4, ("striking", "Striking")), (12, ("greaterStriking", "Greater Striking")), (19, ("majorStriking", "Major Striking"))]
+ARMOR_POTENCY_THRESHOLDS = [(5, 1), (11, 2), (18, 3)]
+ARMOR_RESILIENCY_THRESHOLDS = [(8, ("resilient", "Resilient")), (14, ("greaterResilient", "Greater Resilient")), (20, ("majorResilient", "Major Resilient"))]
+
+# Rune id -> rank, for comparing a sheet's rune against the recommendation.
+STRIKING_RANKS: Mapping[Optional[str], int] = MappingProxyType({"striking": 1, "greaterStriking": 2, "majorStriking": 3})
+RESILIENCY_RANKS: Mapping[Optional[str], int] = MappingProxyType({"resilient": 1, "greaterResilient": 2, "majorResilient": 3})
+
+
+def _rune_row(level: int) -> Mapping[str, object]:
+    weapon_striking, weapon_striking_name = _value_at(level, WEAPON_STRIKING_THRESHOLDS, (None, "None"))
+    armor_resiliency, armor_resiliency_name = _value_at(level, ARMOR_RESILIENCY_THRESHOLDS, (None, "None"))
+    return MappingProxyType({
+        "weapon_potency": _value_at(level, WEAPON_POTENCY_THRESHOLDS, 0),
+        "weapon_striking": weapon_striking, "weapon_striking_name": weapon_striking_name,
+        "weapon_striking_rank": STRIKING_RANKS.get(weapon_striking, 0),
+        "armor_potency": _value_at(level, ARMOR_POTENCY_THRESHOLDS, 0),
+        "armor_resiliency": armor_resiliency, "armor_resiliency_name": armor_resiliency_name,
+        "armor_resiliency_rank": RESILIENCY_RANKS.get(armor_resiliency, 0),
+    })
+
+
+# RUNES_BY_LEVEL[level] -> read-only recommendation row
+RUNES_BY_LEVEL: List[Mapping[str, object]] = [_rune_row(level) for level in range(MAX_LEVEL + 1)]
+
+
+# --- Wealth ---
+
+HIGH_GOLD_FACTOR = 50 # More than level * this is "a lot" of unspent gold
+LOW_GOLD_FACTOR = 5   # Less than level * this (above level 1) is tight
+
+def _gold_row(level: int, high_factor: int = HIGH_GOLD_FACTOR) -> Tuple[Optional[int], int]:
+    return (level * LOW_GOLD_FACTOR if level > 1 else None, level * high_factor)
+
+# GOLD_THRESHOLDS_BY_LEVEL[level] -> (low threshold or None, high threshold), in gp
+GOLD_THRESHOLDS_BY_LEVEL: List[Tuple[Optional[int], int]] = [_gold_row(level) for level in range(MAX_LEVEL + 1)]
+
+
+def gold_thresholds(level: int, high_factor: int = HIGH_GOLD_FACTOR) -> Tuple[Optional[int], int]:
+    """
+    (low, high) unspent-gold thresholds, the high one at level * high_factor. Levels past the table
+    (homebrew) and other factors use the same formula.
+    """
+    if 0 <= level <= MAX_LEVEL and high_factor == HIGH_GOLD_FACTOR:
+        return GOLD_THRESHOLDS_BY_LEVEL[level]
+    return _gold_row(level, high_factor)
+
+
+# --- Feat slot schedules ---
+
+ANCESTRY_FEAT_LEVELS = (1, 5, 9, 13, 17)
+GENERAL_FEAT_LEVELS = (3, 7, 11, 15, 19)
+CLASS_FEAT_LEVELS = (1,) + tuple(range(2, MAX_LEVEL + 1, 2))
+SKILL_FEAT_LEVELS = tuple(range(2, MAX_LEVEL + 1, 2))
+FREE_ARCHETYPE_FEAT_LEVELS = tuple(range(2, MAX_LEVEL + 1, 2))
+
+DEFAULT_FEAT_SCHEDULE: Dict[str, Tuple[int, ...]] = {
+    "ancestry": ANCESTRY_FEAT_LEVELS,
+    "general": GENERAL_FEAT_LEVELS,
+    "class": CLASS_FEAT_LEVELS,
+    "skill": SKILL_FEAT_LEVELS,
+    "free_archetype": FREE_ARCHETYPE_FEAT_LEVELS,
+}
+
+# Per-class differences from DEFAULT_FEAT_SCHEDULE (class name lower-cased).
+CLASS_FEAT_SCHEDULE_OVERRIDES: Dict[str, Dict[str, Tuple[int, ...]]] = {
+    "fighter": {"class": (1,) + CLASS_FEAT_LEVELS}, # Extra class feat at L1
+    "rogue": {"skill": tuple(range(1, MAX_LEVEL + 1))}, # Skill feat every level
+}
+
+
+def _cumulative_counts(schedule: Dict[str, Tuple[int, ...]]) -> List[Mapping[str, int]]:
+    return [
+        MappingProxyType({kind: sum(1 for slot_level in levels if level >= slot_level) for kind, levels in schedule.items()})
+        for level in range(MAX_LEVEL + 1)
+    ]
+
+
+# FEAT_COUNTS_BY_CLASS[class][level] -> expected number of feats of each kind by that level
+DEFAULT_FEAT_COUNTS = _cumulative_counts(DEFAULT_FEAT_SCHEDULE)
+FEAT_COUNTS_BY_CLASS: Dict[str, List[Mapping[str, int]]] = {
+    class_name: _cumulative_counts({**DEFAULT_FEAT_SCHEDULE, **overrides})
+    for class_name, overrides in CLASS_FEAT_SCHEDULE_OVERRIDES.items()
+}
+
+
+def expected_feat_counts(class_name: str, level: int) -> Mapping[str, int]:
+    """Expected feat counts by kind ("ancestry", "general", "class", "skill", "free_archetype")."""
+    return FEAT_COUNTS_BY_CLASS.get(class_name.lower(), DEFAULT_FEAT_COUNTS)[table_level(level)]
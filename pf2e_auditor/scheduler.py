@@ -0,0 +1,308 @@
+# pf2e_auditor/scheduler.py
+# Rate-limit-aware queue in front of every Gemini call.
+#
+# Gemini enforces requests-per-minute and tokens-per-minute quotas per project
+# (i.e. per API key) and model. Without a queue, a burst of batch/background
+# calls ran straight into 429s, each of which went to the user as an error
+# string, and then the quota sat idle. LLMScheduler.run() instead:
+#
+# - waits for capacity in token buckets per (API key, model): one for requests,
+#   one for estimated input tokens, refilled continuously at the configured rate;
+# - caps the number of calls in flight process-wide and per API key (the
+#   per-key cap used to be a semaphore in the client pool, taken after
+#   admission, where a batch call holding it could keep an admitted
+#   interactive call waiting; now both caps are part of the same
+#   priority-ordered admission);
+# - admits waiters in priority order (INTERACTIVE before BACKGROUND before BATCH
+#   before PREFETCH, FIFO within a priority), so a user's Q&A isn't stuck behind
+#   background jobs; busy() lets speculative work back off entirely;
+# - retries 429 and 5xx errors with capped exponential backoff and full jitter,
+#   emptying the bucket on a 429 so other waiters for that key/model back off too.
+#
+# Only errors that survive the retries reach the caller.
+
+import hashlib
+import itertools
+import os
+import random
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Iterator, List, Optional, Tuple, TypeVar
+
+from . import metrics
+
+T = TypeVar("T")
+
+# Priorities: lower runs first.
+INTERACTIVE = 0
+BACKGROUND = 10
+BATCH = 20
+PREFETCH = 30 # Speculative work nobody has asked for yet (see prefetch.py)
+
+DEFAULT_MAX_CONCURRENCY = int(os.environ.get("PF2E_LLM_MAX_CONCURRENCY", "16"))
+DEFAULT_MAX_CONCURRENCY_PER_KEY = int(os.environ.get("PF2E_LLM_MAX_CONCURRENCY_PER_KEY", "4"))
+# (requests per minute, input tokens per minute) per key and model; override per model below.
+DEFAULT_RATE_LIMIT: Tuple[int, int] = (
+    int(os.environ.get("PF2E_LLM_RPM", "60")),
+    int(os.environ.get("PF2E_LLM_TPM", "1000000")),
+)
+MODEL_RATE_LIMITS: Dict[str, Tuple[int, int]] = {}
+
+RETRYABLE_STATUS_CODES = frozenset({429, 500, 502, 503, 504})
+DEFAULT_MAX_ATTEMPTS = 5
+BACKOFF_BASE_SECONDS = 1.0
+BACKOFF_MAX_SECONDS = 32.0
+
+
+def _status_code(error: Exception) -> Optional[int]:
+    """HTTP status of a google.api_core / HTTP error, if it has one."""
+    code = getattr(error, "code", None)
+    if isinstance(code, int):
+        return code
+    status = getattr(error, "status_code", None)
+    return status if isinstance(status, int) else None
+
+
+def is_retryable(error: Exception) -> bool:
+    return _status_code(error) in RETRYABLE_STATUS_CODES
+
+
+def backoff_delay(attempt: int, base: float = BACKOFF_BASE_SECONDS, cap: float = BACKOFF_MAX_SECONDS) -> float:
+    """Full-jitter exponential backoff: uniform in [0, min(cap, base * 2**attempt)]."""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+class TokenBucket:
+    """Continuously refilling bucket; capacity is one minute's worth of the rate. Not thread-safe on its own."""
+
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.tokens = self.capacity
+        self._updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def available(self, amount: float, now: float) -> bool:
+        self._refill(now)
+        # A request larger than the whole bucket is let through once the bucket is full.
+        return self.tokens >= min(amount, self.capacity)
+
+    def take(self, amount: float):
+        self.tokens -= min(amount, self.capacity)
+
+    def seconds_until(self, amount: float, now: float) -> float:
+        self._refill(now)
+        missing = min(amount, self.capacity) - self.tokens
+        return max(missing / self.rate, 0.0) if self.rate > 0 else float("inf")
+
+    def drain(self, now: float):
+        self._refill(now)
+        self.tokens = min(self.tokens, 0.0)
+
+
+@dataclass(order=True)
+class _Waiter:
+    priority: int
+    seq: int
+    bucket_key: Tuple[str, str] = field(compare=False)
+    tokens: int = field(compare=False)
+
+
+class LLMScheduler:
+    def __init__(self, max_concurrency: int = DEFAULT_MAX_CONCURRENCY, max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+                 sleep: Callable[[float], None] = time.sleep, rate_limit: Optional[Tuple[int, int]] = None,
+                 max_concurrency_per_key: int = DEFAULT_MAX_CONCURRENCY_PER_KEY):
+        self.max_concurrency = max_concurrency
+        self.max_concurrency_per_key = max_concurrency_per_key
+        self.max_attempts = max_attempts
+        self.rate_limit = rate_limit # (requests, tokens) per minute for every key/model; None: MODEL_RATE_LIMITS/DEFAULT_RATE_LIMIT
+        self._sleep = sleep
+        self._cond = threading.Condition()
+        self._waiting: List[_Waiter] = []
+        self._seq = itertools.count()
+        self._running = 0
+        self._running_by_priority: Dict[Tuple[str, int], int] = {} # (key hash, priority) -> calls in flight
+        self._running_by_key: Dict[str, int] = {}                  # Key hash -> calls in flight
+        self._buckets: Dict[Tuple[str, str], Tuple[TokenBucket, TokenBucket]] = {}
+        self.retries = 0
+        self.rate_limited = 0
+
+    # --- Admission ---
+
+    def _bucket_pair(self, bucket_key: Tuple[str, str]) -> Tuple[TokenBucket, TokenBucket]:
+        pair = self._buckets.get(bucket_key)
+        if pair is None:
+            rpm, tpm = self.rate_limit or MODEL_RATE_LIMITS.get(bucket_key[1], DEFAULT_RATE_LIMIT)
+            pair = self._buckets[bucket_key] = (TokenBucket(rpm), TokenBucket(tpm))
+        return pair
+
+    def _can_start(self, waiter: _Waiter, now: float) -> bool:
+        requests, tokens = self._bucket_pair(waiter.bucket_key)
+        return requests.available(1, now) and tokens.available(waiter.tokens, now)
+
+    def _key_full(self, waiter: _Waiter) -> bool:
+        return self._running_by_key.get(waiter.bucket_key[0], 0) >= self.max_concurrency_per_key
+
+    def _first_startable(self, now: float) -> Optional[_Waiter]:
+        if self._running >= self.max_concurrency:
+            return None
+        blocked = set() # Buckets with a higher-priority waiter still waiting: nobody may overtake it there
+        for waiter in sorted(self._waiting):
+            if waiter.bucket_key in blocked or self._key_full(waiter): # A full key's next slot goes to its most urgent waiter
+                continue
+            if self._can_start(waiter, now):
+                return waiter
+            blocked.add(waiter.bucket_key)
+        return None
+
+    def _next_refill_wait(self, now: float) -> Optional[float]:
+        """Seconds until a bucket may admit someone; None if every waiter's key is full (a release will notify)."""
+        waits = []
+        for waiter in self._waiting:
+            if self._key_full(waiter):
+                continue
+            requests, tokens = self._bucket_pair(waiter.bucket_key)
+            waits.append(max(requests.seconds_until(1, now), tokens.seconds_until(waiter.tokens, now)))
+        return min(waits, default=None)
+
+    def _acquire(self, bucket_key: Tuple[str, str], tokens: int, priority: int):
+        start = time.perf_counter()
+        with self._cond:
+            waiter = _Waiter(priority, next(self._seq), bucket_key, tokens)
+            self._waiting.append(waiter)
+            try:
+                while True:
+                    now = time.monotonic()
+                    if self._first_startable(now) is waiter:
+                        break
+                    refill_wait = None if self._running >= self.max_concurrency else self._next_refill_wait(now)
+                    self._cond.wait(None if refill_wait is None else max(refill_wait, 0.01))
+            finally:
+                self._waiting.remove(waiter)
+            requests_bucket, tokens_bucket = self._bucket_pair(bucket_key)
+            requests_bucket.take(1)
+            tokens_bucket.take(tokens)
+            self._running += 1
+            self._running_by_key[bucket_key[0]] = self._running_by_key.get(bucket_key[0], 0) + 1
+            running_key = (bucket_key[0], priority)
+            self._running_by_priority[running_key] = self._running_by_priority.get(running_key, 0) + 1
+            self._cond.notify_all() # The next waiter may be startable too
+        metrics.record("llm.queue_wait", (time.perf_counter() - start) * 1000, priority=priority, model=bucket_key[1])
+
+    def _release(self, bucket_key: Tuple[str, str], priority: int, error: Optional[Exception] = None):
+        with self._cond:
+            self._running -= 1
+            self._running_by_key[bucket_key[0]] -= 1
+            if not self._running_by_key[bucket_key[0]]:
+                del self._running_by_key[bucket_key[0]]
+            running_key = (bucket_key[0], priority)
+            self._running_by_priority[running_key] -= 1
+            if not self._running_by_priority[running_key]:
+                del self._running_by_priority[running_key]
+            if error is not None and _status_code(error) == 429:
+                self.rate_limited += 1
+                now = time.monotonic()
+                for bucket in self._bucket_pair(bucket_key):
+                    bucket.drain(now)
+            self._cond.notify_all()
+
+    @staticmethod
+    def _bucket_key(google_api_key: str, llm_model_name: str) -> Tuple[str, str]:
+        return hashlib.sha256(google_api_key.encode("utf-8")).hexdigest(), llm_model_name
+
+    def _backoff(self, attempt: int):
+        with self._cond:
+            self.retries += 1
+        self._sleep(backoff_delay(attempt))
+
+    # --- Public API ---
+
+    def run(self, func: Callable[[], T], google_api_key: str, llm_model_name: str,
+            estimated_tokens: int = 0, priority: int = INTERACTIVE) -> T:
+        """Runs func() once admitted, retrying 429/5xx errors with backoff. Other errors propagate immediately."""
+        bucket_key = self._bucket_key(google_api_key, llm_model_name)
+        attempt = 0
+        while True:
+            self._acquire(bucket_key, estimated_tokens, priority)
+            try:
+                result = func()
+            except Exception as e:
+                self._release(bucket_key, priority, e)
+                attempt += 1
+                if not is_retryable(e) or attempt >= self.max_attempts:
+                    raise
+                self._backoff(attempt - 1)
+                continue
+            self._release(bucket_key, priority)
+            return result
+
+    def stream(self, func: Callable[[], Iterator[str]], google_api_key: str, llm_model_name: str,
+               estimated_tokens: int = 0, priority: int = INTERACTIVE) -> Iterator[str]:
+        """
+        Like run() for a streaming call. Retries are only possible until the first chunk
+        arrives (after that the caller has already shown partial output). The slot is
+        held until the stream is consumed or closed.
+        """
+        bucket_key = self._bucket_key(google_api_key, llm_model_name)
+        attempt = 0
+        while True:
+            self._acquire(bucket_key, estimated_tokens, priority)
+            try:
+                chunks = func()
+                first = next(chunks, None)
+                break
+            except Exception as e:
+                self._release(bucket_key, priority, e)
+                attempt += 1
+                if not is_retryable(e) or attempt >= self.max_attempts:
+                    raise
+                self._backoff(attempt - 1)
+
+        error = None
+        try:
+            if first is not None:
+                yield first
+                yield from chunks
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            chunks.close()
+            self._release(bucket_key, priority, error)
+
+    def busy(self, google_api_key: str, max_priority: int = INTERACTIVE) -> bool:
+        """Whether calls at max_priority or more urgent are waiting or running for this key (any model)."""
+        key_hash = self._bucket_key(google_api_key, "")[0]
+        with self._cond:
+            return (any(w.bucket_key[0] == key_hash and w.priority <= max_priority for w in self._waiting)
+                    or any(k == key_hash and p <= max_priority for k, p in self._running_by_priority))
+
+    def stats(self) -> Dict[str, int]:
+        with self._cond:
+            return {"waiting": len(self._waiting), "running": self._running,
+                    "retries": self.retries, "rate_limited": self.rate_limited}
+
+
+_default_scheduler: Optional[LLMScheduler] = None
+_default_scheduler_lock = threading.Lock()
+
+
+def get_scheduler() -> LLMScheduler:
+    """The process-wide scheduler shared by all Gemini calls."""
+    global _default_scheduler
+    with _default_scheduler_lock:
+        if _default_scheduler is None:
+            _default_scheduler = LLMScheduler()
+        return _default_scheduler
+
+
+def set_scheduler(scheduler: Optional[LLMScheduler]) -> Optional[LLMScheduler]:
+    """Replaces the process-wide scheduler (None: a default one on next use) and returns the previous one."""
+    global _default_scheduler
+    with _default_scheduler_lock:
+        previous, _default_scheduler = _default_scheduler, scheduler
+        return previous
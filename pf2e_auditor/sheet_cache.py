@@ -0,0 +1,119 @@
+# pf2e_auditor/sheet_cache.py
+# Parse each distinct sheet once and share the result.
+#
+# An upload used to be JSON-decoded and validated by analyze_character_sheet,
+# again inside every cached LLM function, and again by the Raw Data tab on each
+# Streamlit rerun. ParsedSheetCache decodes + validates once per distinct upload
+# and hands every consumer the same ParsedSheet. Entries are reachable both by
+# a digest of the raw bytes (so re-uploading identical bytes skips JSON decoding)
+# and by the semantic fingerprint (so LLM/Q&A code can find the sheet by the key
+# it already caches on).
+
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from functools import cached_property
+from typing import Any, Dict, Optional
+
+from pydantic import ValidationError
+
+from .models import CharacterSheet
+from .fingerprint import character_fingerprint
+from . import metrics
+
+
+@dataclass(frozen=True)
+class ParsedSheet:
+    sheet: CharacterSheet
+    raw: bytes = field(repr=False)
+    fingerprint: str
+    raw_digest: str
+
+    @cached_property
+    def data(self) -> Dict[str, Any]:
+        """The upload as a plain dict, decoded on first access only (used by the Raw Data view)."""
+        with metrics.span("sheet.json_decode", bytes=len(self.raw)):
+            return json.loads(self.raw)
+
+
+def parse_sheet_bytes(raw: bytes) -> CharacterSheet:
+    """
+    Decodes and validates a Pathbuilder export in a single pass (pydantic-core parses the
+    JSON bytes directly into the models, with no intermediate dict).
+    Raises json.JSONDecodeError for malformed JSON, or pydantic.ValidationError.
+    """
+    try:
+        return CharacterSheet.model_validate_json(raw)
+    except ValidationError as e:
+        errors = e.errors(include_url=False)
+        if errors and errors[0]["type"] == "json_invalid":
+            # Keep the stdlib error type callers already handle for "not JSON at all".
+            raise json.JSONDecodeError(errors[0]["msg"], raw.decode("utf-8", errors="replace"), 0) from None
+        raise
+
+
+class ParsedSheetCache:
+    """Thread-safe LRU of ParsedSheet objects, indexed by raw-bytes digest and by fingerprint."""
+
+    def __init__(self, max_entries: int = 128):
+        self.max_entries = max_entries
+        self._by_digest: "OrderedDict[str, ParsedSheet]" = OrderedDict()
+        self._by_fingerprint: Dict[str, ParsedSheet] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def load(self, raw: bytes) -> ParsedSheet:
+        """Returns the parsed sheet for these bytes, parsing only if they haven't been seen."""
+        start = time.perf_counter()
+        raw_digest = hashlib.sha256(raw).hexdigest()
+        with self._lock:
+            parsed = self._by_digest.get(raw_digest)
+            if parsed is not None:
+                self._by_digest.move_to_end(raw_digest)
+                self.hits += 1
+                metrics.record("sheet.parse", (time.perf_counter() - start) * 1000, cache="hit", bytes=len(raw))
+                return parsed
+            self.misses += 1
+
+        # Parse outside the lock; a concurrent duplicate parse is harmless.
+        # JSON decoding and model validation are one pydantic-core pass, so they are one span.
+        with metrics.span("sheet.parse", cache="miss", bytes=len(raw)):
+            sheet = parse_sheet_bytes(raw)
+        with metrics.span("sheet.fingerprint"):
+            fingerprint = character_fingerprint(sheet.build)
+        parsed = ParsedSheet(sheet=sheet, raw=raw, fingerprint=fingerprint, raw_digest=raw_digest)
+        with self._lock:
+            self._by_digest[raw_digest] = parsed
+            self._by_fingerprint[parsed.fingerprint] = parsed
+            while len(self._by_digest) > self.max_entries:
+                _, evicted = self._by_digest.popitem(last=False)
+                if self._by_fingerprint.get(evicted.fingerprint) is evicted:
+                    del self._by_fingerprint[evicted.fingerprint]
+        return parsed
+
+    def get(self, fingerprint: str) -> Optional[ParsedSheet]:
+        with self._lock:
+            parsed = self._by_fingerprint.get(fingerprint)
+            if parsed is not None:
+                self._by_digest.move_to_end(parsed.raw_digest)
+            return parsed
+
+    def __len__(self) -> int:
+        return len(self._by_digest)
+
+
+_default_cache = ParsedSheetCache()
+
+
+def get_sheet_cache() -> ParsedSheetCache:
+    """The process-wide parsed-sheet cache."""
+    return _default_cache
+
+
+def load_sheet(raw: bytes) -> ParsedSheet:
+    """Parses raw upload bytes through the process-wide cache."""
+    return _default_cache.load(raw)
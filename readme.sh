@@ -10,6 +10,7 @@ A Streamlit web application designed to help Pathfinder 2nd Edition (PF2e) playe
     *   **⚔️ Equipment Runes:** Verifies weapon and armor (potency, striking/resiliency) fundamental runes against level-based recommendations and checks for unfilled property rune slots.
     *   **🎓 Missing Feat Slots:** Detects unselected feats or potential discrepancies in expected vs. actual feat counts for Ancestry, Skill, General, Class, and Free Archetype feats.
     *   **📜 Free Archetype Detection:** Automatically identifies if the Free Archetype variant rule is likely in use based on feat selection.
+    *   **📖 Feat Names (offline name index):** Flags feats that look like misspellings of a known feat (suggesting the closest names) and feats above the level of the slot they were taken in. Real feats whose names contain "choose" or "empty" are no longer mistaken for unfilled slots. The index is a compact memory-mapped file with exact, prefix and fuzzy lookups, and it needs no network. A seed list of common core feats and spells ships in `name_index/core.jsonl` and is built into an index in `~/.cache/pf2e_auditor` (`PF2E_NAME_CACHE_DIR`) on first use. To use a full export instead, build it with `python -m pf2e_auditor.name_index build names.jsonl pf2e_names.idx --complete` and point `PF2E_NAME_INDEX` at the file (or at a `.jsonl` source). The export has one `{"name", "kind" (feat/spell/item), "level", "url", "prerequisites"}` object per line. A complete index also flags feats it doesn't list, and with URLs the feat links go straight to each Archives of Nethys page instead of a search.
 *   **💡 LLM-Powered Combat Suggestions (via Google Gemini):**
     *   Provides 3-5 actionable combat turn ideas tailored to the character's class, feats, spells, and equipment.
     *   Utilizes a dynamically generated prompt based on the character sheet.
@@ -17,16 +18,30 @@ A Streamlit web application designed to help Pathfinder 2nd Edition (PF2e) playe
 *   **❓ LLM-Powered Character Q&A (via Google Gemini):**
     *   Allows users to ask specific questions about their character (e.g., "How does my Power Attack feat work?", "What are my strongest offensive spells?").
     *   The LLM answers based on the provided character sheet data and general PF2e knowledge.
+    *   Conversation mode (a sidebar option, on by default when prefetching is off) sends the character to Gemini once per analyzed sheet and then only each follow-up question, using a Gemini context cache when the model accepts one. The tab shows the input tokens billed versus resending the character every time. `pf2e_auditor.qa_session.FakeChatBackend` measures the same savings offline.
+    *   Questions are grounded in a local rules corpus (`rules_corpus/`, or the files and directories in `PF2E_RULES_CORPUS`; `.jsonl`, `.md` and `.txt`). A BM25 index built offline at first use picks the top passages for each question (`PF2E_RULES_TOP_K`, default 3) and adds them to the prompt. Single questions also send only the character sections the question names or asks about, so prompts for large characters shrink. Toggle it with "Ground Q&A in local rules" in the sidebar, or set `PF2E_RULES_DISABLED=1`.
+    *   Rephrased questions reuse earlier answers: single questions are normalized (case, punctuation, filler words, word order) and compared by word and character shingles through a MinHash/LSH index. A question at least as similar as the sidebar threshold (`PF2E_QA_SIMILARITY_THRESHOLD`, default 0.85) to one already answered for the same character and settings gets that answer, marked as reused, with a Regenerate button to ask the exact question instead. Questions that differ in a number ("at level 5" vs "at level 7"), a negation or qualifier ("can I" vs "can't I", "with" vs "without"), or the sides of a comparison ("is my AC higher than my Fort save?" vs the reverse) never match.
+    *   Likely questions are answered before you ask: after an analysis, the single-question Q&A tab suggests questions predicted from the sheet (strongest spells, focus spells, how its class, archetype and ancestry feats work), and the top few (`PF2E_PREFETCH_QUESTIONS`, default 5) are answered in the background into the similar-question cache, so clicking one (⚡) answers instantly. Prefetching runs on its own small thread pool (`PF2E_PREFETCH_WORKERS`, default 2) at the lowest scheduler priority, backs off while you are asking something, is capped per API key per hour (`PF2E_PREFETCH_BUDGET_PER_HOUR`, default 20; 0 turns it off; answers already in the response cache are free), stops on a new upload, and can be turned off in the sidebar. Because prefetched answers are single-question answers, single-question mode is the default while prefetching is on, and the sidebar notes that nothing is prefetched if you switch to conversation mode.
     *   Requires a Google AI Studio API Key.
 *   **🔗 Archives of Nethys Links:** Generates quick search links to Archives of Nethys for feats listed on the character sheet.
 *   **📊 User-Friendly Interface:**
-    *   Clear, tabbed layout for Audit Suggestions, Combat Ideas, Q&A, LLM Prompts, and Raw Data.
+    *   Clear, tabbed layout for Audit Suggestions, Combat Ideas, Q&A, LLM Prompts, Performance, and Raw Data.
     *   Visual cues for audit suggestions (e.g., icons).
-    *   Spinners for loading states during LLM calls.
+    *   Audit results appear as soon as the sheet is parsed; combat suggestions are generated in the background and fill in the Combat Ideas tab when ready (re-uploading cancels the pending request).
+    *   Incremental re-analysis (sidebar, on by default): uploading a new version of a character already analyzed in this session or stored in the character library (same name, class and ancestry) shows what changed since then. Only the audit checks that read a changed field are re-run, and combat suggestions are reused unless the combat prompt itself changed.
+    *   Each results tab reruns on its own: asking a question, expanding a prompt or opening the raw JSON re-renders only that tab, not the whole page. Long lists such as the feat links are rendered in batches, and the raw sheet is decoded and sent to the browser only when "Show parsed JSON" is switched on.
+    *   Optional streaming of Gemini output: combat suggestions appear one by one as each "Suggestion:" block completes, and Q&A answers render token by token.
 *   **📄 Data Handling & Caching:**
     *   Uses Pydantic for robust parsing and validation of the Pathbuilder JSON structure.
     *   Caches LLM responses using `st.cache_data` to speed up repeated requests for the same character/query and reduce API calls.
-    *   File content hashing ensures cache invalidation when the character sheet changes.
+    *   LLM responses are also stored in a persistent SQLite cache (keyed on model + prompt hash, never the API key) that survives restarts and can be shared by several app instances via `PF2E_LLM_CACHE_PATH`. Lookups are plain reads that never wait on SQLite's write lock; hit counts and access times are written behind in batches. Entries expire after 30 days and the least recently used are evicted past the size budget. Set `PF2E_LLM_CACHE_DISABLED=1` to turn it off.
+    *   Prompts share one compact, de-duplicated serialization of the character (built once per sheet) and are kept under a token budget (`PF2E_PROMPT_TOKEN_BUDGET`, default 6000; adjustable in the sidebar along with max output tokens). Over budget, the least useful sections (class features, worn armor, innate spells, ...) are left out first. The LLM Prompts tab shows each prompt's estimated token count.
+    *   Gemini calls go through a per-API-key client pool. Each key gets its own connections and model handles, and keys never pass through the SDK's global `genai.configure`, so concurrent users can't pick up each other's key.
+    *   A scheduler sits in front of every Gemini call. It keeps per-key, per-model request and token budgets (`PF2E_LLM_RPM`, `PF2E_LLM_TPM`) and caps the calls in flight, both overall (`PF2E_LLM_MAX_CONCURRENCY`) and per API key (`PF2E_LLM_MAX_CONCURRENCY_PER_KEY`, default 4), admitting waiting calls in priority order. It retries rate-limit (429) and server (5xx) errors with exponential backoff and jitter. Interactive Q&A is served ahead of background combat suggestions and batch jobs.
+    *   Choosing the "auto" model routes each request by complexity and measured latency. Short lookups go to flash-lite. Advice questions, long questions and large prompts go to flash. Combat planning goes to pro for characters with several spellcasting entries, rank 7+ spell slots, or very long spell or feat lists, and to flash otherwise. Q&A questions asking to plan a fight also go to pro. Within each tier, the model with the lowest p50 latency is chosen. A request only moves up a tier, never down, when its model's p95 is over the tier's latency target. Latencies are measured on every uncached call and stored locally in background batches (`PF2E_LATENCY_PATH`, or `PF2E_LATENCY_DISABLED=1` for memory only). They are shown in the Performance tab. `PF2E_ROUTER_MODELS` overrides the models in each tier.
+    *   Every stage is timed: file read, sheet parse (JSON decode and validation happen in one pydantic-core pass), fingerprint, each audit check, prompt build, scheduler queue wait, time to first token and total LLM time, plus estimated prompt/response tokens. The ⏱️ Performance tab shows them for the current analysis and each Q&A question and exports them as JSONL (per span) or Prometheus text (process-wide histograms, `pf2e_auditor.metrics.prometheus_text()`). Set `PF2E_METRICS_JSONL_PATH` to append every span to a file.
+    *   Every analyzed character is saved to a local SQLite character library (`PF2E_LIBRARY_PATH`, default `~/.local/share/pf2e_auditor/library.sqlite3`; `PF2E_LIBRARY_DISABLED=1` turns it off). Each version keeps the compressed export, its audit results, and its combat suggestions and Q&A answers. The 📚 Character Library roster filters by class, level, ancestry, Free Archetype and name, and re-opens a character without re-uploading it. From the command line, `python -m pf2e_auditor.library import <dirs/files/globs>` imports a folder of exports (audits only, no LLM calls) and `python -m pf2e_auditor.library list --class Wizard --min-level 5` prints the roster as JSON lines.
+    *   Caches are keyed on a semantic fingerprint of the fields the prompts and audits actually read, so a byte-different re-export of an unchanged character still hits the cache while real changes invalidate it.
 
 ## ✨ How It Works
 
@@ -71,11 +86,49 @@ A Streamlit web application designed to help Pathfinder 2nd Edition (PF2e) playe
 5.  **Use the App:**
     *   Open the provided local URL in your browser.
     *   Enter your Google AI Studio API Key in the sidebar (required for LLM features).
-    *   Select your preferred Gemini model.
+    *   Select your preferred Gemini model, or "auto" to route each request to the fastest model suited to it.
     *   Upload your Pathbuilder JSON file.
     *   Click "Analyze Character Sheet".
     *   Explore the results in the different tabs.
 
+## 📦 Batch Auditing (No Browser)
+
+The rule-based audits (gold, runes, feat slots) can be run headlessly over a whole directory or glob of Pathbuilder exports. Files are processed on a process pool and one JSON line is written per character as it finishes:
+
+```bash
+python -m pf2e_auditor.batch characters/ "league/**/*.json" -o results.jsonl -j 8
+```
+
+Files that fail to load are reported with an `"error"` field instead of stopping the run. The same pipeline is available from Python via `pf2e_auditor.batch.iter_batch_audit(paths)`.
+
+For league-wide statistics (unspent gold by level, the share of characters below the recommended potency/striking/resiliency runes, missing-feat rates by class), the roster report loads every sheet into NumPy column arrays and runs vectorized versions of the gold, rune and feat-slot checks:
+
+```bash
+python -m pf2e_auditor.roster "league/**/*.json" -j 8 > report.json
+```
+
+From Python, `Roster.from_builds(builds)` builds the columns, `roster_report(roster)` returns the aggregates and `character_flags(roster)` returns per-character boolean flag arrays.
+
+## ⏱️ Benchmarks (No API Key)
+
+`python -m pf2e_auditor.bench` times parsing, each audit check, prompt construction, suggestion splitting and the end-to-end analysis. It runs on `characters/melon.json` plus synthetic level-20 multi-caster sheets with hundreds of feats. Gemini is replaced by a replay backend that serves the responses in `benchmarks/recorded_responses.jsonl`, with optional simulated latency (`--ttft` seconds to first token, `--tps` output tokens per second). The persistent response cache is turned off for the run.
+
+Each run is saved to `benchmarks/results/`. `--compare latest` (or a results file) flags benchmarks whose median got more than `--threshold` slower:
+
+```bash
+python -m pf2e_auditor.bench --compare latest
+```
+
+To record real responses for replay, install `pf2e_auditor.replay.RecordingBackend` with `pf2e_auditor.llm.set_llm_backend`.
+
+## 🧪 Tests (No API Key)
+
+The tests in `tests/` run offline. Gemini is replaced by the replay backend and `pf2e_auditor.qa_session.FakeChatBackend`, and the response cache, latency store and library are turned off. Install pytest and run:
+
+```bash
+python -m pytest -q
+```
+
 ## 📝 LLM Prompts
 
 The application dynamically generates prompts for the LLM based on the character's details. Examples of these prompts can be viewed in the "LLM Prompts" tab after an analysis is run, which can be helpful for understanding the AI's context or for debugging.
@@ -0,0 +1,36 @@
+import copy
+import json
+import os
+
+import pytest
+
+# Tests never touch the user's caches or databases.
+os.environ["PF2E_LLM_CACHE_DISABLED"] = "1"
+os.environ["PF2E_LATENCY_DISABLED"] = "1"
+os.environ["PF2E_LIBRARY_DISABLED"] = "1"
+
+from pf2e_auditor import name_index  # noqa: E402
+from pf2e_auditor.models import CharacterSheet  # noqa: E402
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+with open(os.path.join(REPO_ROOT, "characters", "melon.json"), encoding="utf-8") as f:
+    _MELON = json.load(f)
+
+
+@pytest.fixture
+def melon_data():
+    """characters/melon.json as a dict (a fresh copy per test)."""
+    return copy.deepcopy(_MELON)
+
+
+def character(data) -> CharacterSheet:
+    return CharacterSheet.model_validate_json(json.dumps(data))
+
+
+@pytest.fixture(autouse=True)
+def no_name_index():
+    """Checks run without the name index unless a test installs one (see test_name_index)."""
+    name_index.set_name_index(None)
+    yield
+    name_index.set_name_index(None)
@@ -0,0 +1,17 @@
+import os
+
+from conftest import REPO_ROOT
+from pf2e_auditor.bench import run_benchmarks
+
+
+def test_run_benchmarks_restores_the_response_cache_setting(monkeypatch):
+    with open(os.path.join(REPO_ROOT, "characters", "melon.json"), "rb") as f:
+        fixtures = [("melon", f.read())]
+    for before in (None, "0"):
+        if before is None:
+            monkeypatch.delenv("PF2E_LLM_CACHE_DISABLED")
+        else:
+            monkeypatch.setenv("PF2E_LLM_CACHE_DISABLED", before)
+        report = run_benchmarks(fixtures, 1, 0.0, 0.0, responses_path=None)
+        assert "parse" in report["results"]["melon"]
+        assert os.environ.get("PF2E_LLM_CACHE_DISABLED") == before
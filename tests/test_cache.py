@@ -0,0 +1,53 @@
+import sqlite3
+import time
+
+from pf2e_auditor.cache import LLMResponseCache
+
+
+def test_lookups_do_not_take_the_write_lock(tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    cache = LLMResponseCache(path)
+    cache.set("model", "prompt", "response")
+    writer = sqlite3.connect(path, isolation_level=None)
+    writer.execute("BEGIN IMMEDIATE") # Another process in the middle of a write
+    try:
+        start = time.perf_counter()
+        assert cache.get("model", "prompt") == "response"
+        assert cache.get("model", "other prompt") is None
+        assert time.perf_counter() - start < 1
+    finally:
+        writer.execute("ROLLBACK")
+    cache.flush()
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 1
+
+
+def test_counters_are_written_behind(tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    cache = LLMResponseCache(path)
+    cache.set("model", "prompt", "response")
+    for _ in range(5):
+        cache.get("model", "prompt")
+    cache.get("model", "missing")
+    cache.flush()
+    assert LLMResponseCache(path).stats()["hits"] == 5 and LLMResponseCache(path).stats()["misses"] == 1
+
+
+def test_queued_hits_protect_entries_from_lru_eviction(tmp_path):
+    cache = LLMResponseCache(str(tmp_path / "cache.sqlite3"), max_entries=2)
+    cache.set("model", "old", "a")
+    time.sleep(0.01)
+    cache.set("model", "newer", "b")
+    time.sleep(0.01)
+    assert cache.get("model", "old") == "a" # Now the most recently used
+    cache.set("model", "newest", "c")
+    assert cache.get("model", "old") == "a" and cache.get("model", "newer") is None
+    assert cache.stats()["evictions"] == 1
+
+
+def test_expired_entries_are_misses(tmp_path):
+    cache = LLMResponseCache(str(tmp_path / "cache.sqlite3"), max_age_seconds=0)
+    cache.set("model", "prompt", "response")
+    time.sleep(0.01)
+    assert cache.get("model", "prompt") is None
+    cache.flush()
+    assert cache.stats()["misses"] == 1
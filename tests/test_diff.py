@@ -0,0 +1,78 @@
+import json
+
+from conftest import character
+from pf2e_auditor.analysis import analyze_sheet
+from pf2e_auditor.checks import AUDIT_CHECKS, audit_version, run_audit_check_results
+from pf2e_auditor.diff import checks_to_rerun, diff_builds, reaudit
+from pf2e_auditor.llm import set_llm_backend
+from pf2e_auditor.name_index import FEAT, NameEntry, NameIndex, set_name_index, write_name_index
+from pf2e_auditor.replay import ReplayBackend
+
+ALL_CHECKS = list(AUDIT_CHECKS)
+
+
+def previous_results():
+    return {name: [f"previous {name}"] for name in AUDIT_CHECKS}
+
+
+def test_checks_to_rerun_follows_declared_inputs():
+    previous, version = previous_results(), audit_version()
+    assert checks_to_rerun([], previous, version) == []
+    assert checks_to_rerun(["money"], previous, version) == ["unspent_gold"]
+    assert checks_to_rerun(["weapons", "specials"], previous, version) == ["equipment_runes"]
+    assert checks_to_rerun(["processed_feats"], previous, version) == ["missing_feat_slots", "feat_names"]
+    assert checks_to_rerun(["level"], previous, version) == ALL_CHECKS
+    del previous["equipment_runes"] # No earlier result: always run
+    assert checks_to_rerun(["money"], previous, version) == ["unspent_gold", "equipment_runes"]
+
+
+def test_results_from_another_audit_version_are_rerun(tmp_path):
+    previous = previous_results()
+    assert checks_to_rerun([], previous, "") == ALL_CHECKS # Unknown (e.g. stored before versions were)
+    assert checks_to_rerun([], previous, "older-checks") == ALL_CHECKS
+    before = audit_version()
+    path = str(tmp_path / "names.idx")
+    write_name_index([NameEntry("Power Attack", FEAT, 1)], path)
+    set_name_index(NameIndex(path))
+    assert audit_version() != before # A new name index can change the feat-name results
+    assert checks_to_rerun([], previous, before) == ALL_CHECKS
+
+
+def test_diff_and_reaudit_after_spending_gold(melon_data):
+    before = character(melon_data)
+    melon_data["build"]["money"]["gp"] = 4000
+    melon_data["build"]["feats"].append(["Toughness", None, "General Feat", 3, "General Feat 3", "standardChoice", None])
+    after = character(melon_data)
+
+    diff = diff_builds(before.build, after.build)
+    assert {"money", "feats_raw", "processed_feats"} <= diff.changed_fields
+    assert "level" not in diff.changed_fields
+    assert ("Gold", "15.00gp", "4000.00gp") in diff.scalar_changes
+    assert diff.added == {"Feats": ["Toughness (General Feat, level 3)"]} and not diff.removed
+
+    results, rerun = reaudit(after, previous_results(), diff.changed_fields, audit_version())
+    assert rerun == ["unspent_gold", "missing_feat_slots", "feat_names"]
+    assert results["equipment_runes"] == ["previous equipment_runes"] # Reused, not re-run
+    assert results == {**run_audit_check_results(after), "equipment_runes": ["previous equipment_runes"]}
+    assert results["unspent_gold"][0].startswith("High Unspent Gold")
+
+
+def test_reanalysis_reuses_combat_ideas_when_the_prompt_is_unchanged(melon_data):
+    replay = ReplayBackend()
+    previous_backend = set_llm_backend(replay)
+    try:
+        first = analyze_sheet(json.dumps(melon_data).encode(), "test-key", "gemini-2.0-flash")
+        first["combat_job"].result(timeout=10)
+        version = first["version"]
+        version.combat_ideas = first["combat_job"].result()
+
+        melon_data["build"]["money"]["gp"] = 4000 # Not in the combat prompt
+        second = analyze_sheet(json.dumps(melon_data).encode(), "test-key", "gemini-2.0-flash",
+                               previous_versions={version.identity: version})
+    finally:
+        set_llm_backend(previous_backend)
+    assert replay.calls["combat"] == 1
+    assert second["combat_ideas_reused"] and second["combat_job"] is None
+    assert second["combat_ideas"] == version.combat_ideas
+    assert second["checks_rerun"] == ["unspent_gold"]
+    assert second["diff"].changed_fields == frozenset({"money"})
@@ -0,0 +1,30 @@
+import json
+import sqlite3
+
+from conftest import character
+from pf2e_auditor.checks import audit_version, run_audit_check_results
+from pf2e_auditor.library import CharacterLibrary
+from pf2e_auditor.sheet_cache import load_sheet
+
+
+def test_stored_results_keep_their_audit_version(melon_data, tmp_path):
+    library = CharacterLibrary(str(tmp_path / "library.sqlite3"))
+    parsed = load_sheet(json.dumps(melon_data).encode())
+    library.save_analysis(parsed, run_audit_check_results(parsed.sheet))
+    identity = next(iter(library.query()))["identity"]
+    assert library.latest_version(identity).audit_version == audit_version()
+    library.save_analysis(parsed, {"unspent_gold": []}, "older-checks")
+    assert library.latest_version(identity).audit_version == "older-checks"
+
+
+def test_libraries_from_before_audit_versions_are_migrated(melon_data, tmp_path):
+    path = str(tmp_path / "library.sqlite3")
+    parsed = load_sheet(json.dumps(melon_data).encode())
+    CharacterLibrary(path).save_analysis(parsed, run_audit_check_results(character(melon_data)))
+    conn = sqlite3.connect(path)
+    conn.execute("ALTER TABLE characters DROP COLUMN audit_version") # As stored before versions were
+    conn.commit()
+    conn.close()
+    library = CharacterLibrary(path)
+    identity = next(iter(library.query()))["identity"]
+    assert library.latest_version(identity).audit_version == "" # Unknown, so every check is re-run
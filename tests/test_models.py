@@ -0,0 +1,44 @@
+from conftest import character
+
+
+def test_feat_rows_of_any_length(melon_data):
+    melon_data["build"]["feats"] = [
+        ["Toughness", None, "General Feat", 3, "General Feat 3", "standardChoice", None],
+        ["Charming Liar", None, "Awarded Feat", 1],
+        ["Fleet", None, "General Feat", 1, "General Feat 1", "standardChoice", None, "extra column"],
+        ["Bare"],
+    ]
+    feats = character(melon_data).build.processed_feats
+    assert [(f.name, f.category, f.level_taken, f.source_description) for f in feats] == [
+        ("Toughness", "General Feat", 3, "General Feat 3"),
+        ("Charming Liar", "Awarded Feat", 1, None),
+        ("Fleet", "General Feat", 1, "General Feat 1"),
+        ("Bare", "Unknown Feat Type", 0, None),
+    ]
+
+
+def test_unexpected_column_values_do_not_reject_the_sheet(melon_data, caplog):
+    melon_data["build"]["feats"] = [
+        ["Reach Spell", {"id": 7}, "Class Feat", "1", "Sorcerer Feat 1", "childChoice", "Human Feat 1"],
+        ["Counterspell", None, "Class Feat", 1, "Sorcerer Feat 1", "childChoice", 12], # Coerced to "12", as pydantic v1 did
+        [{"not": "a name"}, None, "Class Feat", 2],
+        ["Widen Spell", None, "Class Feat", "second", "Sorcerer Feat 2"],
+        ["", None, "Class Feat", 4],
+        ["Dragon Claws", None, "Class Feat", 2.0, "Sorcerer Feat 2"],
+        ["Power Attack", None, "Class Feat", 1, "Fighter Feat 1", None, None],
+    ]
+    build = character(melon_data).build
+    assert [f.name for f in build.processed_feats] == ["Reach Spell", "Counterspell", "Dragon Claws", "Power Attack"]
+    assert build.processed_feats[0].level_taken == 1 # Coerced from "1", as before
+    assert build.processed_feats[1].parent_feat_id == "12"
+    assert build.processed_feats[2].level_taken == 2
+    assert len(build.feats_raw) == 7
+    skipped = [r for r in caplog.records if r.name == "pf2e_auditor.models" and r.levelname == "WARNING"]
+    assert len(skipped) == 2 # Invalid rows are logged, not printed; an empty name is skipped quietly
+
+
+def test_free_archetype_detected_from_feat_sources(melon_data):
+    assert not character(melon_data).build.free_archetype_active
+    melon_data["build"]["feats"].append(["Dedication", None, "Archetype Feat", 2, "Free Archetype 2", "standardChoice", None])
+    build = character(melon_data).build
+    assert build.free_archetype_active and build.feat_index.category_count("Archetype Feat") >= 1
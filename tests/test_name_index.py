@@ -0,0 +1,119 @@
+import json
+import os
+
+import pytest
+
+from conftest import character
+from pf2e_auditor import name_index as ni
+from pf2e_auditor.checks import check_feat_names
+from pf2e_auditor.name_index import FEAT, SPELL, NameEntry, NameIndex, normalize_name, write_name_index
+
+ENTRIES = [
+    NameEntry("Power Attack", FEAT, 1, "/Feats.aspx?ID=1"),
+    NameEntry("Sudden Charge", FEAT, 1),
+    NameEntry("Reactive Shield", FEAT, 1),
+    NameEntry("Reach Spell", FEAT, 1),
+    NameEntry("Assurance", FEAT, 1),
+    NameEntry("Greater Bloodline", FEAT, 10),
+    NameEntry("Cat's Luck", FEAT, 1),
+    NameEntry("Éclair du Ciel", FEAT, 4),
+    NameEntry("天狗の羽", FEAT, 2),
+    NameEntry("Fireball", SPELL, 3),
+]
+
+
+@pytest.fixture
+def index(tmp_path):
+    path = tmp_path / "names.idx"
+    assert write_name_index(ENTRIES + [NameEntry("power-attack", FEAT, 9)], str(path)) == len(ENTRIES)
+    index = NameIndex(str(path))
+    yield index
+    index.close()
+
+
+def test_round_trip(index):
+    assert len(index) == len(ENTRIES)
+    assert not index.complete
+    for entry in ENTRIES:
+        assert index.get(entry.name, entry.kind) == entry
+    assert index.get("power attack").level == 1 # First duplicate kept
+    assert index.get("Power Attack").aon_url == "https://2e.aonprd.com/Feats.aspx?ID=1"
+    assert index.get("Fireball", FEAT) is None
+    assert index.get("Cats Luck") == index.get("cat's luck") == ENTRIES[6]
+    assert index.get("Assurance (Athletics)") == ENTRIES[4]
+    assert index.get("Éclair du Ciel").level == 4
+    assert index.get("天狗の羽").name == "天狗の羽"
+
+
+def test_prefix_and_fuzzy(index):
+    assert [e.name for e in index.prefix("rea", FEAT)] == ["Reach Spell", "Reactive Shield"]
+    assert [e.name for e in index.fuzzy("Powr Attack", FEAT)] == ["Power Attack"]
+    assert index.fuzzy("Reactive Strike", FEAT) == []
+
+
+def test_complete_flag(tmp_path):
+    path = str(tmp_path / "names.idx")
+    write_name_index(ENTRIES, path, complete=True)
+    assert NameIndex(path).complete
+
+
+def test_long_strings_truncate_on_character_boundary(tmp_path):
+    path = str(tmp_path / "names.idx")
+    long_prerequisites = "é" * 0x8000 # 0x10000 bytes: a cut at 0xFFFF would split the last "é"
+    write_name_index([NameEntry("Odd Feat", FEAT, 1, prerequisites=long_prerequisites)], path)
+    prerequisites = NameIndex(path).get("Odd Feat").prerequisites
+    assert prerequisites == long_prerequisites[:len(prerequisites)]
+    assert len(prerequisites.encode("utf-8")) == 0xFFFE
+
+
+def test_normalize_name():
+    assert normalize_name("Battle-Medicine") == "battle medicine"
+    assert normalize_name("Cat’s  Luck") == "cats luck"
+    assert normalize_name("Éclair du Ciel!") == "éclair du ciel"
+    assert normalize_name("天狗の羽") == "天狗の羽"
+
+
+def test_jsonl_source_is_built_into_cache(tmp_path, monkeypatch):
+    source = tmp_path / "names.jsonl"
+    source.write_text("\n".join(json.dumps({"name": e.name, "kind": e.kind, "level": e.level}) for e in ENTRIES),
+                      encoding="utf-8")
+    monkeypatch.setenv("PF2E_NAME_INDEX", str(tmp_path / "missing.idx"))
+    monkeypatch.setenv("PF2E_NAME_CACHE_DIR", str(tmp_path / "cache"))
+    ni._default_index_set = False
+    assert ni.get_name_index() is None
+    monkeypatch.setenv("PF2E_NAME_INDEX", str(source)) # Not cached as missing: a later index is picked up
+    index = ni.get_name_index()
+    assert index is not None and index.get("Éclair du Ciel").level == 4
+    assert os.path.dirname(index.path) == str(tmp_path / "cache")
+
+
+def test_bundled_seed_source_builds(tmp_path):
+    index = NameIndex(ni.built_index_path(ni.DEFAULT_NAME_SOURCE, str(tmp_path)))
+    assert index.get("Reach Spell", FEAT).level == 1
+    assert index.get("Fireball", SPELL).level == 3
+
+
+def test_check_feat_names(tmp_path, melon_data):
+    melon_data["build"]["feats"] = [
+        ["Reach Spell", None, "Class Feat", 1, "Sorcerer Feat 1"],
+        ["Powr Attack", None, "Class Feat", 2, "Fighter Feat 2"],
+        ["Homebrew Feat", None, "Class Feat", 4, "Sorcerer Feat 4"],
+        ["Greater Bloodline", None, "Class Feat", 8, "Sorcerer Feat 8"],
+    ]
+    sheet = character(melon_data)
+    path = str(tmp_path / "names.idx")
+    write_name_index(ENTRIES, path)
+    ni.set_name_index(NameIndex(path))
+    suggestions = check_feat_names(sheet)
+    assert len(suggestions) == 2
+    assert suggestions[0].startswith("Possible Misspelling: 'Powr Attack'") and "Power Attack" in suggestions[0]
+    assert suggestions[1].startswith("Feat Level: 'Greater Bloodline' is a level 10 feat")
+
+    write_name_index(ENTRIES, path, complete=True)
+    ni.set_name_index(NameIndex(path))
+    suggestions = check_feat_names(sheet)
+    assert [s.split(":")[0] for s in suggestions] == ["Unknown Feat", "Unknown Feat", "Feat Level"]
+    assert "Homebrew Feat" in suggestions[1]
+
+    ni.set_name_index(None)
+    assert check_feat_names(sheet) == []
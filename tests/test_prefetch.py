@@ -0,0 +1,60 @@
+from pf2e_auditor import llm
+from pf2e_auditor.cache import LLMResponseCache
+from pf2e_auditor.llm import DEFAULT_MODEL_NAME, LLMBackend, build_qa_prompt, set_llm_backend
+from pf2e_auditor.prefetch import PrefetchBudget, PrefetchJob
+from pf2e_auditor.qa_cache import SimilarQuestionCache
+
+from conftest import character
+
+SCOPE = ("fingerprint", DEFAULT_MODEL_NAME)
+QUESTIONS = ["How does Reach Spell work?", "How does Counterspell work?"]
+
+
+class CountingBackend(LLMBackend):
+    def __init__(self, error: Exception = None):
+        self.calls = 0
+        self.error = error
+
+    def generate(self, prompt, google_api_key, llm_model_name, max_output_tokens):
+        self.calls += 1
+        if self.error is not None:
+            raise self.error
+        return f"answer {self.calls}"
+
+
+def run_job(sheet, backend, budget):
+    previous = set_llm_backend(backend)
+    try:
+        cache = SimilarQuestionCache()
+        job = PrefetchJob(sheet, QUESTIONS, "key", cache, SCOPE, budget=budget).start()
+        job.result(timeout=10)
+        return job, cache
+    finally:
+        set_llm_backend(previous)
+
+
+def test_response_cache_hits_do_not_spend_the_budget(melon_data, tmp_path, monkeypatch):
+    sheet = character(melon_data)
+    responses = LLMResponseCache(str(tmp_path / "responses.sqlite3"))
+    responses.set(DEFAULT_MODEL_NAME, build_qa_prompt(sheet.build, QUESTIONS[0]), "stored answer")
+    monkeypatch.setattr(llm, "get_response_cache", lambda: responses)
+    backend, budget = CountingBackend(), PrefetchBudget(per_hour=1)
+    job, cache = run_job(sheet, backend, budget)
+    assert job.answered() == QUESTIONS and not job.skipped_for_budget
+    assert backend.calls == 1 and budget.remaining("key") == 0
+    assert cache.lookup(SCOPE, QUESTIONS[0]).answer == "stored answer"
+
+
+def test_exhausted_budget_stops_before_calling(melon_data):
+    backend = CountingBackend()
+    job, _ = run_job(character(melon_data), backend, PrefetchBudget(per_hour=1))
+    assert job.answered() == QUESTIONS[:1] and job.skipped_for_budget
+    assert backend.calls == 1
+
+
+def test_failed_call_stops_without_caching_the_error(melon_data):
+    backend = CountingBackend(error=RuntimeError("quota exceeded"))
+    job, cache = run_job(character(melon_data), backend, PrefetchBudget(per_hour=5))
+    assert job.answered() == [] and not job.skipped_for_budget
+    assert backend.calls == 1 # The rest would fail the same way
+    assert cache.stats()["entries"] == 0
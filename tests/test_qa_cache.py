@@ -0,0 +1,68 @@
+import pytest
+
+from pf2e_auditor.qa_cache import SimilarQuestionCache, normalize_question
+
+SCOPE = ("fingerprint", "model", 6000, 20000, True)
+
+
+def cache_with(question: str, answer: str = "stored answer") -> SimilarQuestionCache:
+    cache = SimilarQuestionCache()
+    cache.add(SCOPE, question, answer)
+    return cache
+
+
+@pytest.mark.parametrize("stored, asked", [
+    ("How does Power Attack work?", "how does power attack work"),
+    ("How does Power Attack work?", "Explain Power Attack"),
+    ("What does Reach Spell do?", "How does Reach Spell work?"),
+    ("Fireball vs Lightning Bolt?", "Lightning Bolt versus Fireball?"),
+])
+def test_rephrased_questions_hit(stored, asked):
+    cache = cache_with(stored)
+    match = cache.lookup(SCOPE, asked)
+    assert match is not None and match.answer == "stored answer"
+    assert cache.stats() == {"entries": 1, "hits": 1, "misses": 0}
+
+
+@pytest.mark.parametrize("stored, asked", [
+    ("Can I cast Fireball?", "Can't I cast Fireball?"),
+    ("Can I cast Fireball?", "I cannot cast Fireball?"),
+    ("Is my AC higher than my Fort save?", "Is my Fort save higher than my AC?"),
+    ("Can I Shield Block with a buckler?", "Can I Shield Block without a buckler?"),
+    ("How much damage does Fireball do at level 5?", "How much damage does Fireball do at level 7?"),
+    ("Does Reach Spell work with cantrips?", "Does Reach Spell only work with cantrips?"),
+])
+def test_questions_with_a_different_meaning_miss(stored, asked):
+    cache = cache_with(stored)
+    assert cache.lookup(SCOPE, asked) is None
+    assert cache.lookup(SCOPE, asked, threshold=0.5) is None # Not a matter of the threshold
+    assert cache.stats()["misses"] == 2
+
+
+def test_normalization_keeps_negations_and_comparison_sides():
+    assert normalize_question("Can't I cast Fireball?") == "cast fireball not"
+    assert normalize_question("Is my AC higher than my Fort save?") == "ac higher than fort save"
+    assert normalize_question("Is my Fort save higher than my AC?") == "fort higher save than ac"
+
+
+def test_scopes_are_separate():
+    cache = cache_with("How does Power Attack work?")
+    assert cache.lookup(("other character",) + SCOPE[1:], "How does Power Attack work?") is None
+
+
+def test_add_replaces_same_normalized_question_and_contains_does_not_count():
+    cache = cache_with("How does Power Attack work?", "old")
+    cache.add(SCOPE, "how does power attack work", "new")
+    assert cache.contains(SCOPE, "Explain Power Attack")
+    assert cache.stats() == {"entries": 1, "hits": 0, "misses": 0}
+    assert cache.lookup(SCOPE, "How does Power Attack work?").answer == "new"
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = SimilarQuestionCache(max_entries=2)
+    cache.add(SCOPE, "How does Power Attack work?", "a")
+    cache.add(SCOPE, "How does Sudden Charge work?", "b")
+    cache.lookup(SCOPE, "How does Power Attack work?") # Now most recently used
+    cache.add(SCOPE, "How does Reach Spell work?", "c")
+    assert cache.contains(SCOPE, "How does Power Attack work?")
+    assert not cache.contains(SCOPE, "How does Sudden Charge work?")
@@ -0,0 +1,122 @@
+from types import SimpleNamespace
+
+import pytest
+
+from conftest import character
+from pf2e_auditor import qa_session
+from pf2e_auditor.llm import build_qa_prompt
+from pf2e_auditor.prompt_context import estimate_tokens
+from pf2e_auditor.qa_session import FakeChatBackend, QASession, _GeminiChat
+from pf2e_auditor.scheduler import LLMScheduler, set_scheduler
+
+
+class RateLimited(Exception):
+    code = 429
+
+
+class FakeChatSession:
+    """Like the SDK's ChatSession: the last turn stays pending until history is read, which fails if it broke."""
+
+    def __init__(self, script):
+        self.script = script # Per send: list of chunk texts, with an Exception where the stream fails
+        self._history = []
+        self._last_sent = None
+        self._last_received = None
+
+    @property
+    def history(self):
+        if self._last_received is not None:
+            if self._last_received.broken:
+                raise RuntimeError("BrokenResponseError")
+            self._history += [self._last_sent, "".join(self._last_received.texts)]
+            self._last_sent = self._last_received = None
+        return self._history
+
+    @history.setter
+    def history(self, value):
+        self._history = value
+
+    def send_message(self, message, generation_config=None, stream=False):
+        _ = self.history # Raises if the previous turn is still broken
+        steps = self.script.pop(0)
+        if isinstance(steps, Exception):
+            raise steps
+        response = FakeResponse(steps)
+        self._last_sent, self._last_received = message, response
+        return response
+
+
+class FakeResponse:
+    def __init__(self, steps):
+        self.steps = steps
+        self.texts = []
+        self.broken = False
+        self.usage_metadata = SimpleNamespace(prompt_token_count=10, cached_content_token_count=0)
+
+    def __iter__(self):
+        for step in self.steps:
+            if isinstance(step, Exception):
+                self.broken = True
+                raise step
+            self.texts.append(step)
+            yield SimpleNamespace(text=step)
+
+
+@pytest.fixture(autouse=True)
+def scheduler():
+    previous = set_scheduler(LLMScheduler(sleep=lambda seconds: None, rate_limit=(60000, 10 ** 9)))
+    yield
+    set_scheduler(previous)
+
+
+def gemini_chat(script) -> _GeminiChat:
+    session = FakeChatSession(script)
+    return _GeminiChat(SimpleNamespace(start_chat=lambda: session), None, 1, "test-key", "test-model")
+
+
+def test_failed_stream_leaves_a_clean_history():
+    chat = gemini_chat([["Part", ConnectionError("connection reset")], ["Second ", "answer"]])
+    with pytest.raises(ConnectionError):
+        list(chat.send_stream("first?", 100))
+    assert chat._chat.history == []
+    assert "".join(chat.send_stream("second?", 100)) == "Second answer"
+    assert chat._chat.history == ["second?", "Second answer"]
+
+
+def test_abandoned_stream_is_discarded():
+    chat = gemini_chat([["One ", "two ", "three"], ["Next"]])
+    stream = chat.send_stream("first?", 100)
+    assert next(stream) == "One "
+    stream.close()
+    assert chat._chat.history == []
+    assert "".join(chat.send_stream("again?", 100)) == "Next"
+
+
+def test_retry_before_first_chunk_starts_clean():
+    chat = gemini_chat([RateLimited("429"), [RateLimited("429")], ["Retried"]])
+    assert "".join(chat.send_stream("question?", 100)) == "Retried"
+    assert chat._chat.history == ["question?", "Retried"]
+
+
+def test_session_with_fake_backend_keeps_context_once(melon_data):
+    session = QASession(character(melon_data), "", "gemini-2.0-flash", backend=FakeChatBackend(), grounded=False)
+    for question in ("What is my AC?", "And my Fort save?"):
+        assert session.ask(question)
+    assert session.usage.turns == 2
+    assert session.usage.cached_tokens > 0
+    assert session.usage.saved_tokens > 0
+
+
+def test_baseline_estimate_reuses_the_context_and_retrieval(melon_data, monkeypatch):
+    retrievals = []
+    retrieve_rules = qa_session.retrieve_rules
+    monkeypatch.setattr(qa_session, "retrieve_rules", lambda question: retrievals.append(question) or retrieve_rules(question))
+    build = character(melon_data).build
+    session = QASession(character(melon_data), "", "gemini-2.0-flash", backend=FakeChatBackend())
+    questions = ("How does Reach Spell work?", "What is my AC?")
+    for question in questions:
+        assert session.ask(question)
+    assert retrievals == list(questions) # Once per question, for the message actually sent
+    full_prompts = sum(estimate_tokens(build_qa_prompt(build, question)) for question in questions)
+    # Single-question prompts send only the related sections; the estimate counts the whole context
+    assert full_prompts <= session.usage.baseline_tokens <= 1.1 * full_prompts
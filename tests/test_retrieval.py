@@ -0,0 +1,55 @@
+import pytest
+
+from conftest import character
+from pf2e_auditor.retrieval import (
+    DEFAULT_CORPUS_PATH, BM25Index, Passage, load_rules_corpus, relevant_sections, retrieve_rules, tokenize,
+)
+
+PASSAGES = [
+    Passage("map", "Multiple attack penalty", "Each attack after the first on your turn takes a -5 penalty, -4 with an agile weapon."),
+    Passage("strike", "Strike", "Make a melee or ranged attack roll against the target's AC."),
+    Passage("reach", "Reach Spell", "Metamagic: the next spell you cast gets 30 more feet of range."),
+    Passage("shield", "Raise a Shield", "Raise your shield to gain its circumstance bonus to AC until your next turn."),
+    Passage("flanking", "Flanking", "A creature flanked by you and an ally is off-guard to your melee attacks."),
+]
+
+
+@pytest.fixture
+def index():
+    return BM25Index(PASSAGES)
+
+
+def test_title_match_ranks_first(index):
+    assert [p.id for p, _ in index.search("How does Reach Spell work?")][:1] == ["reach"]
+    assert [p.id for p, _ in index.search("what is the multiple attack penalty with an agile weapon")][:1] == ["map"]
+    assert [p.id for p, _ in index.search("raise shield AC")][:1] == ["shield"]
+
+
+def test_scores_are_sorted_and_filtered(index):
+    hits = index.search("attack AC", k=5)
+    scores = [score for _, score in hits]
+    assert scores == sorted(scores, reverse=True) and len(hits) > 2
+    assert all(score >= hits[0][1] * 0.9 for _, score in index.search("attack AC", k=5, min_relative_score=0.9))
+    assert index.search("dragon breath") == [] # No shared terms
+    assert index.search("the and of") == []    # Stopwords only
+
+
+def test_retrieve_rules(index):
+    assert [p.id for p in retrieve_rules("Reach Spell range", top_k=2, index=index)] == ["reach"] # Others under the cutoff
+    assert retrieve_rules("", index=index) == ()
+
+
+def test_bundled_corpus_loads_and_ranks():
+    passages = load_rules_corpus([DEFAULT_CORPUS_PATH])
+    assert passages and len({p.id for p in passages}) == len(passages)
+    assert BM25Index(passages).search("multiple attack penalty agile")[0][0].id == "multiple-attack-penalty"
+
+
+def test_tokenize_drops_stopwords():
+    assert tokenize("What is MY Reach-Spell?") == ["reach", "spell"]
+
+
+def test_relevant_sections(melon_data):
+    build = character(melon_data).build
+    assert relevant_sections(build, "What does Elemental Toss do?") == ("identity", "focus_spells")
+    assert relevant_sections(build, "Tell me a joke") is None
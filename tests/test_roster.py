@@ -0,0 +1,70 @@
+import random
+import re
+
+import pytest
+
+from conftest import character
+from pf2e_auditor.bench import synthetic_sheet
+from pf2e_auditor.checks import check_equipment_runes, check_missing_feat_slots, check_unspent_gold
+from pf2e_auditor.roster import Roster, character_flags
+
+# Suggestion text of the per-character checks -> the roster flag it corresponds to.
+MESSAGE_FLAGS = [
+    (r"High Unspent Gold", "gold_high"),
+    (r"Low Gold", "gold_low"),
+    (r"Weapon '.*': Missing Potency", "weapons_missing_potency"),
+    (r"Weapon '.*': Potency rune", "weapons_low_potency"),
+    (r"Weapon '.*': Missing Striking", "weapons_missing_rune"),
+    (r"Weapon '.*': Striking rune", "weapons_low_rune"),
+    (r"Weapon '.*': Has \d+/\d+ property", "weapons_open_property_slots"),
+    (r"Armor '.*': Missing Potency", "armor_missing_potency"),
+    (r"Armor '.*': Potency rune", "armor_low_potency"),
+    (r"Armor '.*': Missing Resiliency", "armor_missing_rune"),
+    (r"Armor '.*': Resiliency rune", "armor_low_rune"),
+    (r"Armor '.*': Has \d+/\d+ property", "armor_open_property_slots"),
+    (r"Unselected Feat Slots Found", "feats_unselected_slots"),
+    (r"Ancestry Feats Count", "feats_ancestry_short"),
+    (r"General Feats Count", "feats_general_short"),
+    (r"Class Feats Count", "feats_class_short"),
+    (r"Free Archetype Feats Count", "feats_free_archetype_short"),
+    (r"Archetype Feats Present", "feats_archetype_without_free_archetype"),
+]
+
+STRIKING = [None, "striking", "greaterStriking", "majorStriking"]
+RESILIENT = [None, "resilient", "greaterResilient", "majorResilient"]
+
+
+def varied_sheets(count: int, seed: int = 7):
+    """Synthetic sheets across levels, classes, gold, runes, worn/unworn armor and feat lists."""
+    rng = random.Random(seed)
+    for i in range(count):
+        level = rng.randint(1, 20)
+        data = synthetic_sheet(level=level, casters=rng.randint(0, 2), feats=rng.choice([0, 5, 20, 60]), spells_per_rank=1, seed=i)
+        build = data["build"]
+        build["class"] = rng.choice(["Fighter", "Rogue", "Sorcerer", "Wizard"])
+        build["money"] = {"cp": 0, "sp": 0, "gp": rng.choice([0, 3, level * 5, level * 50, level * 50 + 1, 10 ** 5]), "pp": 0}
+        for weapon in build["weapons"][:rng.randint(0, 6)]:
+            weapon.update(pot=rng.choice([None, 0, 1, 2, 3]), str=rng.choice(STRIKING), runes=["flaming"] * rng.randint(0, 3))
+        build["weapons"] = build["weapons"][:rng.randint(0, 6)]
+        build["armor"] = [
+            {"name": f"Armor {n}", "qty": 1, "prof": "medium", "pot": rng.choice([None, 0, 1, 2, 3]), "res": rng.choice(RESILIENT),
+             "mat": None, "display": f"Armor {n}", "worn": rng.random() < 0.6, "runes": ["fortification"] * rng.randint(0, 3)}
+            for n in range(rng.randint(0, 2))
+        ]
+        yield data
+
+
+def expected_flags(sheet):
+    suggestions = check_unspent_gold(sheet) + check_equipment_runes(sheet) + check_missing_feat_slots(sheet)
+    return {flag for pattern, flag in MESSAGE_FLAGS for s in suggestions if re.match(pattern, s)}
+
+
+@pytest.mark.parametrize("seed", [1, 2, 3])
+def test_vectorized_flags_match_per_character_checks(seed, melon_data):
+    sheets = [character(melon_data)] + [character(data) for data in varied_sheets(40, seed)]
+    flags = character_flags(Roster.from_builds(sheet.build for sheet in sheets))
+    assert set(flags) == {flag for _, flag in MESSAGE_FLAGS}
+    for row, sheet in enumerate(sheets):
+        assert {name for name, values in flags.items() if values[row]} == expected_flags(sheet), sheet.build.name
+    for flag in ("gold_high", "gold_low", "weapons_low_rune", "armor_missing_potency", "feats_class_short"):
+        assert flags[flag].any() and not flags[flag].all() # The variants exercise both outcomes
@@ -0,0 +1,53 @@
+import pytest
+
+from conftest import character
+from pf2e_auditor.bench import synthetic_sheet
+from pf2e_auditor.router import (
+    COMBAT, COMPLEX, PRO, QA, SIMPLE, STANDARD, CombatSignals, LatencyStore, LatencyTracker, ModelRouter,
+    classify_request,
+)
+
+
+def signals(data) -> CombatSignals:
+    return CombatSignals.from_build(character(data).build)
+
+
+def test_combat_complexity_calibration(melon_data):
+    melon = signals(melon_data)
+    assert (melon.level, melon.spellcasters, melon.spell_rank) == (10, 1, 5)
+    assert classify_request(COMBAT, 320, signals=melon) == STANDARD
+    assert classify_request(COMBAT, 4150, signals=signals(synthetic_sheet())) == COMPLEX
+    low = signals(synthetic_sheet(level=1, casters=0, feats=8, spells_per_rank=0))
+    assert classify_request(COMBAT, 500, signals=low) == STANDARD
+    assert classify_request(COMBAT, 320) == STANDARD # Prompt-size fallback
+    assert classify_request(COMBAT, 4150) == COMPLEX
+
+
+def test_feat_signal_counts_only_chosen_feats(melon_data):
+    chosen = signals(melon_data).feats
+    melon_data["build"]["feats"] += [["Unselected", None, "Class Feat", 12], ["Choose a Skill Feat", None, "Skill Feat", 12]]
+    assert signals(melon_data).feats == chosen # Open slots don't count, and aren't subtracted twice
+
+
+def test_qa_complexity():
+    assert classify_request(QA, 100, "What's my AC?") == SIMPLE
+    assert classify_request(QA, 100, "Should I retrain Power Attack?") == STANDARD
+    assert classify_request(QA, 100, "Plan my first turns against the boss") == COMPLEX
+
+
+def test_route_uses_signals():
+    router = ModelRouter(tracker=LatencyTracker())
+    decision = router.route(COMBAT, "x" * 2000, signals=signals(synthetic_sheet()))
+    assert (decision.complexity, decision.tier) == (COMPLEX, PRO)
+    assert router.route(COMBAT, "x" * 20000, signals=CombatSignals(10, 1, 5, 2, 10)).complexity == STANDARD
+
+
+def test_latency_samples_are_written_behind_in_batches(tmp_path):
+    store = LatencyStore(str(tmp_path / "latency.sqlite3"), max_samples=3)
+    tracker = LatencyTracker(store)
+    for i in range(5):
+        tracker.record("model-a", QA, float(i))
+    tracker.record("model-b", COMBAT, 9.0)
+    tracker.flush()
+    assert store.load() == {("model-a", QA): [2.0, 3.0, 4.0], ("model-b", COMBAT): [9.0]}
+    assert LatencyTracker(store)._samples[("model-a", QA)] == pytest.approx([2.0, 3.0, 4.0])
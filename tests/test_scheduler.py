@@ -0,0 +1,160 @@
+import threading
+import time
+
+import pytest
+
+from pf2e_auditor.scheduler import BACKGROUND, BATCH, INTERACTIVE, PREFETCH, LLMScheduler, TokenBucket
+
+FAST = (60000, 10 ** 9) # Rate limit that never holds a call back
+
+
+def start_blocked_calls(scheduler, count, key="key", priority=BATCH):
+    """Starts count calls that hold their slot until the returned event is set."""
+    release = threading.Event()
+    started = threading.Semaphore(0)
+
+    def call():
+        started.release()
+        release.wait(5)
+
+    threads = [threading.Thread(target=scheduler.run, args=(call, key, "model", 0, priority)) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    for _ in range(count):
+        assert started.acquire(timeout=5)
+    return release, threads
+
+
+def wait_for_waiters(scheduler, count):
+    deadline = time.monotonic() + 5
+    while scheduler.stats()["waiting"] < count:
+        assert time.monotonic() < deadline
+        time.sleep(0.005)
+
+
+def test_per_key_cap_admits_by_priority():
+    scheduler = LLMScheduler(rate_limit=FAST, max_concurrency_per_key=1) # One slot: admissions are strictly ordered
+    release, threads = start_blocked_calls(scheduler, 1)
+    order = []
+    waiting = [threading.Thread(target=scheduler.run, args=(lambda p=p: order.append(p), "key", "model", 0, p))
+               for p in (BATCH, BACKGROUND)]
+    for thread in waiting:
+        thread.start()
+    wait_for_waiters(scheduler, 2)
+    interactive = threading.Thread(target=scheduler.run, args=(lambda: order.append(INTERACTIVE), "key", "model", 0, INTERACTIVE))
+    interactive.start()
+    wait_for_waiters(scheduler, 3)
+    release.set()
+    for thread in threads + waiting + [interactive]:
+        thread.join(5)
+    assert order == [INTERACTIVE, BACKGROUND, BATCH]
+
+
+def test_per_key_cap_does_not_hold_other_keys():
+    scheduler = LLMScheduler(rate_limit=FAST, max_concurrency_per_key=1)
+    release, threads = start_blocked_calls(scheduler, 1, key="busy")
+    assert scheduler.run(lambda: "done", "other", "model") == "done"
+    assert scheduler.busy("busy", BATCH) and not scheduler.busy("other", BATCH)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+    assert scheduler.stats()["running"] == 0
+
+
+def test_token_bucket_refills_continuously():
+    bucket = TokenBucket(60) # One per second, up to 60
+    now = time.monotonic()
+    bucket.take(60)
+    assert not bucket.available(1, now)
+    assert bucket.seconds_until(1, now) == pytest.approx(1.0, abs=0.01)
+    assert bucket.available(1, now + 1.01)
+    assert not bucket.available(3, now + 1.01)
+    assert bucket.available(60, now + 1000) and bucket.tokens == 60 # Capped at capacity
+    bucket.drain(now + 1000)
+    assert bucket.tokens == 0
+
+
+def test_priority_order_for_a_full_scheduler():
+    scheduler = LLMScheduler(rate_limit=FAST, max_concurrency=1)
+    release, threads = start_blocked_calls(scheduler, 1)
+    order = []
+    for priority in (PREFETCH, BATCH, BACKGROUND):
+        thread = threading.Thread(target=scheduler.run, args=(lambda p=priority: order.append(p), "other-key", "model", 0, priority))
+        thread.start()
+        threads.append(thread)
+    wait_for_waiters(scheduler, 3)
+    assert scheduler.busy("other-key", PREFETCH) and not scheduler.busy("other-key", INTERACTIVE)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+    assert order == [BACKGROUND, BATCH, PREFETCH]
+
+
+def test_requests_wait_for_the_rate_limit():
+    scheduler = LLMScheduler(rate_limit=(60, 10 ** 9))
+    pair = scheduler._bucket_pair(scheduler._bucket_key("key", "model"))
+    pair[0].take(60) # Used up: the next request waits about a second for one to refill
+    start = time.monotonic()
+    assert scheduler.run(lambda: "ok", "key", "model") == "ok"
+    assert 0.8 < time.monotonic() - start < 3
+
+
+class ApiError(Exception):
+    def __init__(self, code):
+        super().__init__(f"HTTP {code}")
+        self.code = code
+
+
+def test_429_is_retried_with_backoff():
+    sleeps = []
+    scheduler = LLMScheduler(rate_limit=FAST, sleep=sleeps.append, max_attempts=4)
+    errors = [ApiError(429), ApiError(503)]
+
+    def call():
+        if errors:
+            raise errors.pop(0)
+        return "ok"
+
+    assert scheduler.run(call, "key", "model") == "ok"
+    assert len(sleeps) == 2 and 0 <= sleeps[0] <= 1 and 0 <= sleeps[1] <= 2 # Full jitter, doubling cap
+    assert scheduler.stats()["retries"] == 2 and scheduler.stats()["rate_limited"] == 1
+    assert scheduler._bucket_pair(scheduler._bucket_key("key", "model"))[0].tokens < FAST[0] # Drained by the 429
+
+
+def test_non_retryable_errors_and_exhausted_retries_propagate():
+    scheduler = LLMScheduler(rate_limit=FAST, sleep=lambda seconds: None, max_attempts=3)
+    calls = []
+
+    def bad_request():
+        calls.append(1)
+        raise ApiError(400)
+
+    with pytest.raises(ApiError):
+        scheduler.run(bad_request, "key", "model")
+    assert len(calls) == 1
+
+    def always_limited():
+        calls.append(1)
+        raise ApiError(429)
+
+    with pytest.raises(ApiError):
+        scheduler.run(always_limited, "key", "model")
+    assert len(calls) == 4 and scheduler.stats()["running"] == 0
+
+
+def test_stream_retries_only_before_the_first_chunk():
+    scheduler = LLMScheduler(rate_limit=FAST, sleep=lambda seconds: None)
+    attempts = []
+
+    def flaky_stream():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise ApiError(503)
+        yield "a"
+        raise ApiError(503)
+
+    stream = scheduler.stream(flaky_stream, "key", "model")
+    assert next(stream) == "a"
+    with pytest.raises(ApiError):
+        next(stream)
+    assert len(attempts) == 2 and scheduler.stats()["running"] == 0
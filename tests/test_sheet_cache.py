@@ -0,0 +1,52 @@
+import json
+
+import pytest
+from pydantic import ValidationError
+
+from pf2e_auditor.sheet_cache import ParsedSheetCache
+
+
+def upload(data, **build_changes) -> bytes:
+    data = json.loads(json.dumps(data))
+    data["build"].update(build_changes)
+    return json.dumps(data).encode()
+
+
+def test_identical_bytes_parse_once(melon_data):
+    cache = ParsedSheetCache()
+    raw = upload(melon_data)
+    first = cache.load(raw)
+    assert cache.load(raw) is first
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert cache.get(first.fingerprint) is first
+    assert first.data["build"]["name"] == first.sheet.build.name
+
+
+def test_reformatted_upload_shares_the_fingerprint(melon_data):
+    cache = ParsedSheetCache()
+    first = cache.load(upload(melon_data))
+    reformatted = cache.load(json.dumps(melon_data, indent=2).encode())
+    assert reformatted is not first and reformatted.fingerprint == first.fingerprint
+    assert cache.misses == 2
+
+
+def test_least_recently_used_is_evicted(melon_data):
+    cache = ParsedSheetCache(max_entries=2)
+    a, b = (cache.load(upload(melon_data, level=level)) for level in (1, 2))
+    cache.get(a.fingerprint)  # a is now more recent than b
+    c = cache.load(upload(melon_data, level=3))
+    assert len(cache) == 2
+    assert cache.get(b.fingerprint) is None
+    assert cache.get(a.fingerprint) is a and cache.get(c.fingerprint) is c
+    assert cache.load(upload(melon_data, level=2)) is not b # Parsed again
+    assert cache.misses == 4
+
+
+def test_invalid_uploads_are_not_cached(melon_data):
+    cache = ParsedSheetCache()
+    with pytest.raises(json.JSONDecodeError):
+        cache.load(b"{not json")
+    del melon_data["build"]["level"]
+    with pytest.raises(ValidationError):
+        cache.load(json.dumps(melon_data).encode())
+    assert len(cache) == 0